@@ -0,0 +1,157 @@
+""" Goodput of transfers over a lossy link, with and without pacing.
+
+Usage: python benchmarks/pacing.py [LOSS] [DELAY] [SIZE]
+
+Downloads a SIZE bytes file (default 256 KB) through a relay dropping each
+datagram with the probability LOSS (default 0.02) and delaying the others
+by DELAY seconds (default 0.002), with a client retransmitting after 1
+second like most PXE firmwares, then reports the duration of the transfer
+and the retransmissions of the server.
+"""
+import logging
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+
+from dyntftpd.backends.memory import MemoryBackend
+from dyntftpd.server import TFTPServer
+
+
+CLIENT_TIMEOUT = 1
+
+
+class LossyLink(object):
+    """ Relays datagrams between a client and `server_address`, dropping them
+    with the probability `loss` and delaying the others by `delay`.
+    """
+
+    def __init__(self, server_address, loss, delay, seed=0):
+        self.server_address = server_address
+        self.loss = loss
+        self.delay = delay
+        self.random = random.Random(seed)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.settimeout(0.1)
+        self.address = self.socket.getsockname()
+        self.client_address = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            try:
+                data, address = self.socket.recvfrom(65536)
+            except socket.timeout:
+                continue
+            if address == self.server_address:
+                destination = self.client_address
+            else:
+                self.client_address = address
+                destination = self.server_address
+            if self.random.random() < self.loss:
+                continue
+            time.sleep(self.delay)
+            self.socket.sendto(data, destination)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.socket.close()
+
+
+def download(address, filename):
+    """ Downloads `filename` in lock-step, resending the last packet after
+    CLIENT_TIMEOUT seconds without new data. Returns the bytes received.
+    """
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(CLIENT_TIMEOUT)
+    last = '\x00\x01%s\x00octet\x00' % filename
+    client.sendto(last, address)
+    server_address = address
+    expected = 1
+    received = 0
+    while True:
+        try:
+            data, server_address = client.recvfrom(1024)
+        except socket.timeout:
+            client.sendto(last, server_address)
+            continue
+        opcode, block_id = struct.unpack('!HH', data[:4])
+        if opcode != 3:
+            raise RuntimeError('Unexpected packet %r' % data[:64])
+        if block_id == expected:
+            received += len(data) - 4
+            expected = (expected + 1) % 65536
+        last = struct.pack('!HH', 4, block_id)
+        client.sendto(last, server_address)
+        if block_id == (expected - 1) % 65536 and len(data) < 516:
+            client.close()
+            return received
+
+
+def run(pacing, loss, delay, size):
+    server = TFTPServer(host='127.0.0.1', port=0, handler_args={
+        'pacing': {'enabled': pacing},
+        'log': {'summary': True},
+    })
+    server.timeout = 10
+    server.backends.register(
+        'memory', MemoryBackend({'boot.img': 'x' * size}), r''
+    )
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    link = LossyLink(server.socket.getsockname(), loss, delay)
+
+    transfers = []
+
+    class Summary(logging.Handler):
+        def emit(self, record):
+            if hasattr(record, 'transfer'):
+                transfers.append(record.transfer)
+
+    handler = Summary()
+    logging.getLogger('dyntftpd').addHandler(handler)
+    try:
+        start = time.time()
+        received = download(link.address, 'boot.img')
+        duration = time.time() - start
+        # Wait for the summary of the transfer
+        deadline = time.time() + 2
+        while not transfers and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        logging.getLogger('dyntftpd').removeHandler(handler)
+        link.close()
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+    print 'pacing %-3s: %.2fs, %.1f KB/s, %s server retransmits' % (
+        'on' if pacing else 'off', duration, received / duration / 1024,
+        transfers[0]['retransmits'] if transfers else '?'
+    )
+
+
+def main():
+    loss = float(sys.argv[1]) if len(sys.argv) > 1 else 0.02
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.002
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else 256 * 1024
+    logger = logging.getLogger('dyntftpd')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    print 'loss %.1f%%, delay %.1fms, %d bytes' % (
+        loss * 100, delay * 1000, size
+    )
+    for pacing in (False, True):
+        run(pacing, loss, delay, size)
+
+
+if __name__ == '__main__':
+    main()
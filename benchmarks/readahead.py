@@ -0,0 +1,109 @@
+""" Transfers from slow storage, with and without read-ahead.
+
+Usage: python benchmarks/readahead.py [LATENCY] [SIZE] [CLIENTS]
+
+CLIENTS clients (default 4) download a SIZE bytes file (default 512 KB) at
+the same time, from a backend whose reads take LATENCY seconds (default
+0.002), then reports the duration of the transfers and the ACK to DATA
+turnaround seen by the clients.
+"""
+import socket
+import struct
+import sys
+import threading
+import time
+
+from dyntftpd.backends import BackendFile
+from dyntftpd.backends.memory import MemoryBackend
+from dyntftpd.server import TFTPServer
+
+
+class SlowFile(BackendFile):
+
+    def __init__(self, data, latency):
+        self.data = data
+        self.size = len(data)
+        self.latency = latency
+
+    def read_block(self, offset, length):
+        time.sleep(self.latency)
+        return self.data[offset:offset + length]
+
+
+class SlowBackend(MemoryBackend):
+
+    def __init__(self, files, latency):
+        super(SlowBackend, self).__init__(files)
+        self.latency = latency
+
+    def open(self, name, session=None):
+        return SlowFile(self.files[name], self.latency)
+
+
+def download(address, filename, turnarounds):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(5)
+    client.sendto('\x00\x01%s\x00octet\x00' % filename, address)
+    while True:
+        data, server_address = client.recvfrom(1024)
+        block_id, = struct.unpack('!H', data[2:4])
+        if block_id > 1:
+            turnarounds.append(time.time() - sent_at)
+        client.sendto(struct.pack('!HH', 4, block_id), server_address)
+        sent_at = time.time()
+        if len(data) < 516:
+            client.close()
+            return
+
+
+def run(readahead, latency, size, clients):
+    server = TFTPServer(host='127.0.0.1', port=0, handler_args={
+        'readahead': {'size': readahead},
+    })
+    server.backends.register(
+        'slow', SlowBackend({'boot.img': 'x' * size}, latency), r''
+    )
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    turnarounds = []
+    downloads = [
+        threading.Thread(
+            target=download,
+            args=(server.socket.getsockname(), 'boot.img', turnarounds)
+        )
+        for _ in xrange(clients)
+    ]
+    start = time.time()
+    for download_thread in downloads:
+        download_thread.start()
+    for download_thread in downloads:
+        download_thread.join()
+    duration = time.time() - start
+
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+    turnarounds.sort()
+    print 'read-ahead %-6s: %.2fs, turnaround median %.2fms, p99 %.2fms' % (
+        readahead or 'off', duration,
+        turnarounds[len(turnarounds) // 2] * 1000,
+        turnarounds[int(len(turnarounds) * 0.99)] * 1000
+    )
+
+
+def main():
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.002
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 512 * 1024
+    clients = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    print 'latency %.1fms, %d bytes, %d clients' % (
+        latency * 1000, size, clients
+    )
+    for readahead in (0, 65536):
+        run(readahead, latency, size, clients)
+
+
+if __name__ == '__main__':
+    main()
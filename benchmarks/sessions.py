@@ -0,0 +1,92 @@
+""" Memory and lookup cost of sessions.
+
+Usage: python benchmarks/sessions.py [SESSIONS]
+
+Opens SESSIONS idle transfers (the first block is sent, but never acked)
+and SESSIONS active transfers (acked at each round) of a file served from
+memory, then reports the RSS of the process and the cost of a session
+lookup and of an ACK.
+"""
+import logging
+import sys
+import time
+import timeit
+
+from dyntftpd.backends.memory import MemoryBackend
+from dyntftpd.server import TFTPServer
+
+
+class NullSocket(object):
+
+    def sendto(self, data, address):
+        pass
+
+
+def rss():
+    """ Returns the resident set size of the process, in bytes.
+    """
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def addresses(first, count):
+    for i in xrange(first, first + count):
+        yield ('10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255),
+               1024 + i % 60000)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    logging.basicConfig(level=logging.WARNING)
+
+    server = TFTPServer(host='127.0.0.1', port=0, handler_args={
+        'fs': {'max_fds': 0}
+    })
+    server.backends.register(
+        'memory', MemoryBackend({'pxelinux.0': 'x' * 512 * 64}), r''
+    )
+    sock = NullSocket()
+
+    def dispatch(packet, address):
+        server.finish_request((packet, sock), address)
+
+    idle = list(addresses(0, count))
+    active = list(addresses(count, count))
+    base_rss = rss()
+
+    start = time.time()
+    for address in idle + active:
+        dispatch('\x00\x01pxelinux.0\x00octet\x00', address)
+    rrq_duration = time.time() - start
+    sessions_rss = rss() - base_rss
+
+    start = time.time()
+    for block_id in xrange(1, 11):
+        ack = '\x00\x04' + chr(block_id >> 8) + chr(block_id & 255)
+        for address in active:
+            dispatch(ack, address)
+    ack_duration = (time.time() - start) / (10 * count)
+
+    lookups = min(timeit.repeat(
+        lambda: [server.sessions.get(address) for address in active],
+        number=1, repeat=5
+    )) / count
+
+    print '%d sessions (%d idle, %d active)' % (
+        len(server.sessions), count, count
+    )
+    print 'RRQ: %.1f us' % (rrq_duration / (2 * count) * 1e6)
+    print 'RSS: %.1f MB, %d bytes per session' % (
+        sessions_rss / 1e6, sessions_rss / (2 * count)
+    )
+    print 'Lookup: %.3f us' % (lookups * 1e6)
+    print 'ACK: %.1f us' % (ack_duration * 1e6)
+
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+""" Storage backends from which files are served.
+
+A backend is registered in the server's BackendRegistry (server.backends)
+with a name and a regular expression. Sessions created by CleverHandler are
+served by the first backend whose expression matches the requested filename.
+"""
+import errno
+import os
+import re
+import urllib
+
+
+class BackendFile(object):
+    """ A file opened by a backend.
+
+    `size` is the size of the file in bytes, or None if unknown.
+
+    `version` identifies the content of the file: files opened by a backend
+    with the same name and version have the same content. None if unknown.
+
+    `in_memory` is True if reads never wait for a storage.
+    """
+    __slots__ = ()
+
+    size = None
+    version = None
+    in_memory = False
+
+    def read_block(self, offset, length):
+        """ Returns at most `length` bytes starting at `offset`. Returns less
+        than `length` bytes only at the end of the file.
+        """
+        raise NotImplementedError
+
+    def release(self, offset):
+        """ Called once the content before `offset` won't be read again, so
+        files keeping it in memory can drop it.
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class LocalFile(BackendFile):
+    """ Wraps a file object opened by the server. Its version is its
+    (st_dev, st_ino, st_mtime).
+    """
+
+    def __init__(self, handle, size=None):
+        self.handle = handle
+        st = os.fstat(handle.fileno())
+        self.size = size if size is not None else st.st_size
+        self.version = (st.st_dev, st.st_ino, st.st_mtime)
+
+    def read_block(self, offset, length):
+        self.handle.seek(offset)
+        return self.handle.read(length)
+
+    def close(self):
+        self.handle.close()
+
+
+class CachedFile(BackendFile):
+    """ Reads `backend_file` through the BlockCache `cache`, where it is
+    identified by `key`. If `low_priority` is set, chunks read are only
+    cached if the cache has room for them.
+    """
+
+    low_priority = False
+
+    def __init__(self, backend_file, cache, key):
+        self.backend_file = backend_file
+        self.cache = cache
+        self.key = key
+        self.size = backend_file.size
+        self.version = backend_file.version
+
+    def read_block(self, offset, length):
+        return self.cache.read(
+            self.key, offset, length, self.backend_file.read_block,
+            self.low_priority
+        )
+
+    def close(self):
+        self.backend_file.close()
+
+
+class Backend(object):
+    """ Base class of backends.
+
+    `name` and `server` are set when the backend is registered.
+
+    If `is_async` is True, open() is called from a separate thread so a slow
+    backend doesn't block the server while the file is loading. Backends
+    whose files are only slow to open sometimes override opens_async.
+    """
+    name = None
+    server = None
+    is_async = False
+
+    def get_config(self, name, default):
+        """ Fetchs `name` in handler_args[backend name], or return `default`.
+        """
+        return self.server.get_config(self.name, name, default)
+
+    def resolve(self, filename):
+        """ Returns the name under which the backend knows `filename`. Raise
+        ValueError if `filename` is invalid.
+        """
+        return filename
+
+    def opens_async(self, name):
+        """ Returns True if open(name) should be called from a separate
+        thread.
+        """
+        return self.is_async
+
+    def stat(self, name, session=None):
+        """ Returns the size of `name`, or None if unknown. Raise IOError if
+        `name` doesn't exist.
+        """
+        handle = self.open(name, session)
+        try:
+            return handle.size
+        finally:
+            handle.close()
+
+    def open(self, name, session=None):
+        """ Returns a BackendFile to read `name`. Raise IOError if `name`
+        cannot be read.
+
+        `session` is the TFTPSession reading the file, if any.
+        """
+        raise NotImplementedError
+
+    def open_prefetch(self, name):
+        """ Returns a BackendFile to warm the caches with `name`. Backends
+        whose caches track accesses override it so prefetching isn't taken
+        for client reads.
+        """
+        return self.open(name)
+
+    def prefetch_cost(self, name):
+        """ Returns the bytes to read to warm the caches with `name`, or None
+        if `name` shouldn't be prefetched: nothing would be cached, or more
+        valuable files could be evicted. Raise IOError if `name` doesn't
+        exist.
+        """
+        return None
+
+    def negative_cache_key(self, name):
+        return (self.name, name)
+
+    def is_missing_error(self, exc):
+        """ Returns True if the IOError `exc`, raised by open(), means the
+        file doesn't exist.
+        """
+        return exc.errno == errno.ENOENT
+
+    def close(self):
+        """ Called when the server is closed.
+        """
+        pass
+
+
+def missing(name):
+    """ Returns the IOError raised by backends when `name` doesn't exist.
+    """
+    return IOError(errno.ENOENT, os.strerror(errno.ENOENT), name)
+
+
+class BackendRegistry(object):
+    """ Maps regular expressions, matched against the url-decoded requested
+    filename, to backends.
+
+    The backends registered last are tried first.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.backends = {}
+        self.routes = []
+
+    def register(self, name, backend, pattern=None):
+        """ Register `backend` as `name`. If `pattern` is given, requests
+        matching it are served by `backend`.
+        """
+        backend.name = name
+        backend.server = self.server
+        self.backends[name] = backend
+        if pattern is not None:
+            self.routes.insert(0, (re.compile(pattern), backend))
+
+    def get(self, name):
+        return self.backends[name]
+
+    def match(self, filename):
+        """ Returns the backend serving `filename`, or None.
+        """
+        unquoted = urllib.unquote(filename)
+        for regex, backend in self.routes:
+            if regex.match(unquoted):
+                return backend
+        return None
+
+    def close(self):
+        for backend in self.backends.values():
+            backend.close()
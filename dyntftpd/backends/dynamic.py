@@ -0,0 +1,100 @@
+import re
+import string
+
+from ..cache import TTLCache
+from . import Backend, missing
+from .memory import MemoryFile
+
+
+class Template(object):
+    """ Returned by callbacks to render `template` with string.Template.
+    """
+
+    def __init__(self, template, **context):
+        self.template = template
+        self.context = context
+
+    def render(self):
+        return string.Template(self.template).substitute(self.context)
+
+
+def render(content):
+    """ Converts what a callback returned to a string.
+    """
+    if isinstance(content, Template):
+        content = content.render()
+    elif not isinstance(content, basestring):
+        content = ''.join(content)
+
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    return content
+
+
+class DynamicBackend(Backend):
+    """ Generates files with callbacks, without temporary files.
+
+    Callbacks are registered with route(), and called as
+    `callback(match, session)` where `match` is the match object of the
+    route's pattern and `session` the TFTPSession requesting the file, if
+    any. They return a string, an iterable of strings or a Template, or None
+    if the file doesn't exist.
+
+    Content is generated entirely before the transfer starts, so its size
+    can be sent with the tsize option. If the route has a `key` function,
+    content is cached under `key(match, session)` for `ttl` seconds, so
+    callbacks are only called once for each distinct key. If `key` returns
+    None, content is not cached.
+
+    Example, to serve the pxelinux configuration of each MAC address:
+
+        dynamic = DynamicBackend()
+        dynamic.route(
+            r'pxelinux.cfg/01-(?P<mac>[0-9a-f-]+)$',
+            lambda match, session: Template(PXE_TEMPLATE,
+                                            mac=match.group('mac')),
+            key=lambda match, session: match.group('mac')
+        )
+        server.backends.register('dynamic', dynamic, r'pxelinux.cfg/')
+    """
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.routes = []
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def route(self, pattern, callback, key=None, ttl=None):
+        """ Requests matching `pattern` are generated by `callback`.
+        """
+        self.routes.append((re.compile(pattern), callback, key, ttl))
+
+    def generate(self, name, session=None):
+        """ Returns the content of `name`. Raise IOError if no route matches
+        `name`, or if the callback returns None.
+        """
+        for route_id, (regex, callback, key, ttl) in enumerate(self.routes):
+            match = regex.match(name)
+            if match:
+                break
+        else:
+            raise missing(name)
+
+        cache_key = None
+        if key is not None:
+            cache_key = key(match, session)
+
+        if cache_key is not None:
+            content = self.cache.get((route_id, cache_key))
+            if content is not None:
+                return content
+
+        content = callback(match, session)
+        if content is None:
+            raise missing(name)
+        content = render(content)
+
+        if cache_key is not None:
+            self.cache.set((route_id, cache_key), content, ttl=ttl)
+        return content
+
+    def open(self, name, session=None):
+        return MemoryFile(self.generate(name, session))
@@ -0,0 +1,200 @@
+import errno
+import operator
+import os
+import threading
+
+from . import Backend, CachedFile, LocalFile, missing
+from .. import compressed
+from ..cache import BlockCache, TTLCache
+
+
+def is_under(path, root):
+    """ Returns whether `path` is `root` or in it, comparing path components.
+    """
+    return path == root or path.startswith(root + os.sep)
+
+
+class FileSystemBackend(Backend):
+    """ Serves files from the server root.
+
+    Uses the server's file index, descriptor pool and block cache if
+    enabled.
+
+    If a file is missing but foo.gz (or foo.zst, if zstandard is installed)
+    exists, its uncompressed content is served (see dyntftpd.compressed).
+    The index of a compressed file is built once per version, in a separate
+    thread, with a checkpoint every handler_args['fs']['compressed_span']
+    bytes. Indexes are kept within
+    handler_args['fs']['compressed_index_size'] bytes, an index bigger than
+    that is built again for each transfer. At most
+    handler_args['fs']['compressed_cache_size'] bytes of uncompressed data
+    are cached, in chunks of handler_args['fs']['compressed_chunk_size']
+    bytes.
+
+    Symlinks of the root may point out of it, unless
+    handler_args['fs']['confine_symlinks'] is true.
+    """
+
+    def __init__(self):
+        self._compressed_indexes = None
+        self._decompressed_cache = None
+        self._index_lock = threading.Lock()
+
+    @property
+    def compressed_indexes(self):
+        if self._compressed_indexes is None:
+            self._compressed_indexes = TTLCache(
+                maxsize=64, ttl=float('inf'),
+                max_bytes=self.get_config(
+                    'compressed_index_size', 16 * 1024 * 1024
+                ),
+                sizeof=operator.attrgetter('memory_size')
+            )
+        return self._compressed_indexes
+
+    @property
+    def decompressed_cache(self):
+        if self._decompressed_cache is None:
+            self._decompressed_cache = BlockCache(
+                self.get_config('compressed_cache_size', 64 * 1024 * 1024),
+                chunk_size=self.get_config(
+                    'compressed_chunk_size', 256 * 1024
+                )
+            )
+        return self._decompressed_cache
+
+    def resolve(self, filename):
+        """ Raise ValueError if trying to open a file out of the root folder
+        with '..', or through a symlink if the `confine_symlinks` option is
+        set.
+        """
+        server_root = os.path.abspath(self.server.root)
+        abs_path = os.path.abspath(os.path.join(server_root, filename))
+        if not is_under(abs_path, server_root):
+            raise ValueError('Directory traversal prevented')
+        if self.get_config('confine_symlinks', False) and not is_under(
+            os.path.realpath(abs_path), os.path.realpath(server_root)
+        ):
+            raise ValueError('Directory traversal prevented')
+        return abs_path
+
+    def opens_async(self, path):
+        """ Compressed files are opened in a separate thread until their
+        index is built.
+        """
+        if self.version(path) is not None:
+            return False
+        for suffix, _ in compressed.formats():
+            version = self.version(path + suffix)
+            if version is not None:
+                return version not in self.compressed_indexes
+        return False
+
+    def version(self, path):
+        """ Returns the (st_dev, st_ino, st_mtime) of `path`, or None if it
+        doesn't exist.
+        """
+        try:
+            entry = self.lookup(path)
+        except IOError:
+            return None
+        if entry is not None:
+            return (entry.dev, entry.ino, entry.mtime)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_mtime)
+
+    def lookup(self, path):
+        """ Returns the index entry of `path`, or None if the root is not
+        indexed. Raise IOError if `path` is not in the index.
+        """
+        if self.server.file_index is None:
+            return None
+        entry = self.server.file_index.lookup(path)
+        if entry is None:
+            raise missing(path)
+        return entry
+
+    def stat(self, path, session=None):
+        try:
+            entry = self.lookup(path)
+            if entry is not None:
+                return entry.size
+            try:
+                return os.stat(path).st_size
+            except OSError as exc:
+                raise IOError(exc.errno, exc.strerror, path)
+        except IOError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            return super(FileSystemBackend, self).stat(path, session)
+
+    def prefetch_cost(self, path):
+        """ Files are cached by the block cache if the server has one, and by
+        the page cache.
+        """
+        return self.stat(path) or 0
+
+    def open(self, path, session=None):
+        """ If the server indexes its root, missing files are reported without
+        calling open(). If the server has a descriptor pool, the file is read
+        from a descriptor shared with the other sessions reading it.
+        """
+        try:
+            handle = self.open_local(path)
+        except IOError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            handle = self.open_compressed(path)
+            if handle is None:
+                raise
+            return handle
+
+        if self.server.block_cache is not None:
+            return CachedFile(handle, self.server.block_cache, handle.version)
+        return handle
+
+    def open_local(self, path):
+        entry = self.lookup(path)
+        key = None
+        if entry is not None:
+            key = (entry.dev, entry.ino, entry.mtime)
+
+        if self.server.descriptor_pool is not None:
+            handle = self.server.descriptor_pool.acquire(path, key=key)
+            if entry is not None:
+                handle.size = entry.size
+            return handle
+        return LocalFile(open(path))
+
+    def open_compressed(self, path):
+        """ Returns a CompressedFile reading the compressed version of `path`,
+        or None if there is none.
+        """
+        for suffix, index_cls in compressed.formats():
+            try:
+                handle = self.open_local(path + suffix)
+            except IOError as exc:
+                if exc.errno == errno.ENOENT:
+                    continue
+                raise
+
+            try:
+                index = self.compressed_indexes.get(handle.version)
+                if index is None:
+                    with self._index_lock:
+                        index = self.compressed_indexes.get(handle.version)
+                        if index is None:
+                            index = index_cls(handle, self.get_config(
+                                'compressed_span', 4 * 1024 * 1024
+                            ))
+                            self.compressed_indexes.set(handle.version, index)
+            except Exception:
+                handle.close()
+                raise
+            return compressed.CompressedFile(
+                handle, index, self.decompressed_cache
+            )
+        return None
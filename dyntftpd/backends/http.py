@@ -0,0 +1,531 @@
+import contextlib
+import logging
+import os
+import re
+import threading
+import time
+import urllib
+
+import requests
+
+from . import Backend, BackendFile
+from .httpcache import HTTPCache
+
+
+class HTTPError(IOError):
+    """ Raised when the HTTP server returns an error status.
+    """
+    def __init__(self, message, status_code):
+        super(HTTPError, self).__init__(message)
+        self.status_code = status_code
+
+
+class StreamingFile(BackendFile):
+    """ Reads a HTTP response as the client requests blocks, without a
+    temporary file. Received data is kept in memory from the lowest offset
+    not released (see BackendFile.release), which is the block the client
+    didn't ack yet, to answer retransmissions, up to the blocks read ahead.
+    """
+
+    def __init__(self, response, chunks):
+        self.response = response
+        self.chunks = chunks
+        # Received data, starting at the offset `buffer_offset`
+        self.buffer = bytearray()
+        self.buffer_offset = 0
+        self.complete = False
+        # Blocks can be read ahead by another thread
+        self.lock = threading.Lock()
+        length = response.headers.get('content-length')
+        self.size = int(length) if length and length.isdigit() else None
+
+    def read_block(self, offset, length):
+        with self.lock:
+            if offset < self.buffer_offset:
+                raise IOError('Offset %s of the stream was released' % offset)
+            end = offset + length
+            while (not self.complete and
+                   self.buffer_offset + len(self.buffer) < end):
+                try:
+                    self.buffer += next(self.chunks)
+                except StopIteration:
+                    self.complete = True
+                    self.size = self.buffer_offset + len(self.buffer)
+            start = offset - self.buffer_offset
+            return str(self.buffer[start:start + length])
+
+    def release(self, offset):
+        with self.lock:
+            skip = min(offset - self.buffer_offset, len(self.buffer))
+            if skip > 0:
+                del self.buffer[:skip]
+                self.buffer_offset += skip
+
+    def close(self):
+        self.response.close()
+
+
+class ByteRange(object):
+    """ Part of a file downloaded with a ranged request. `position` is the
+    offset of the next byte to download, so an interrupted download can be
+    resumed.
+    """
+    __slots__ = ('position', 'end')
+
+    def __init__(self, start, end):
+        self.position = start
+        self.end = end
+
+
+class RangeProbe(object):
+    """ What a HEAD request told about a file.
+    """
+    __slots__ = ('size', 'etag', 'last_modified')
+
+    def __init__(self, size, etag, last_modified):
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class HTTPBackend(Backend):
+    """ Serves HTTP files by TFTP for clients that don't have a HTTP client
+    (a bootloader like u-boot, for example).
+
+    By default, files are downloaded to `cache_dir` before the transfer
+    starts. If the `stream` option is set, files are streamed to the client
+    as they are downloaded. If the `async` option is set, files are loaded
+    without blocking the server.
+
+    If the `range_workers` option is greater than 1, and if the origin accepts
+    ranged requests, files bigger than `range_min_size` are downloaded with
+    `range_workers` concurrent ranged requests. Each range is retried
+    `range_retries` times, resuming where the previous attempt stopped. If
+    the download fails, the next one only requests the missing ranges. The
+    `timeout` option applies to each network operation of these requests,
+    not to the whole download. Origins refusing the HEAD request probing
+    ranges are downloaded with a single request.
+
+    Downloaded files are kept in `cache_dir` (see HTTPCache), at most
+    `cache_size` bytes (0 for no limit). They are reused without contacting
+    the origin for `max_age` seconds (0 by default). After, they are
+    revalidated with a conditional request if the origin sent an ETag or a
+    Last-Modified header. Interrupted downloads are resumed with a ranged
+    request.
+
+    Small files read often are also kept in memory, at most
+    `memory_cache_size` bytes (16 MB by default, 0 to disable) of files of at
+    most `memory_max_object` bytes read at least `memory_promote_hits` times.
+    Files in memory are reused without contacting the origin for
+    `memory_max_age` seconds (10 by default) if `max_age` is shorter, so that
+    they are actually served from memory.
+    """
+
+    _cache = None
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = HTTPCache(
+                self.get_config(
+                    'cache_dir', '/var/cache/dyntftpd/handlers/http'
+                ),
+                max_bytes=self.get_config('cache_size', 0),
+                descriptor_pool=self.server.descriptor_pool,
+                memory_max_bytes=self.get_config(
+                    'memory_cache_size', 16 * 1024 * 1024
+                ),
+                memory_max_object=self.get_config(
+                    'memory_max_object', 256 * 1024
+                ),
+                promote_hits=self.get_config('memory_promote_hits', 2)
+            )
+        return self._cache
+
+    @property
+    def is_async(self):
+        return self.get_config('async', False)
+
+    def resolve(self, filename):
+        """ Cient needs to urlencode the filename he wants to request.
+        """
+        return urllib.unquote(filename)
+
+    def open(self, url, session=None):
+        if self.get_config('stream', False):
+            return self._open_stream(url)
+        return self._open_cached(url, session)
+
+    def stat(self, url, session=None):
+        with contextlib.closing(self._request(url, method='HEAD')) as res:
+            length = res.headers.get('content-length')
+        return int(length) if length and length.isdigit() else None
+
+    def is_missing_error(self, exc):
+        return isinstance(exc, HTTPError) and exc.status_code in (404, 410)
+
+    def prefetch_cost(self, url):
+        """ Files missing from the cache, or partially downloaded, are
+        prefetched unless they are streamed. Complete files are not, even
+        stale: they are revalidated when a client requests them. If the cache
+        size is bounded, files are only prefetched if the cache has room for
+        them, which costs a HEAD request.
+        """
+        if self.get_config('stream', False):
+            return None
+        entry = self.cache.peek(url)
+        if entry is not None and entry.complete:
+            return None
+        downloaded = entry.size if entry is not None else 0
+        if self.cache.max_bytes:
+            size = self.stat(url)
+            if (
+                size is None or
+                self.cache.size + size - downloaded > self.cache.max_bytes
+            ):
+                return None
+            return size - downloaded
+        return downloaded
+
+    def open_prefetch(self, url):
+        """ Downloads `url` to the cache if it isn't complete there. Cached
+        files are not revalidated, and reads are not recorded as accesses, so
+        prefetching neither promotes files to memory nor delays their
+        eviction.
+        """
+        if self.get_config('stream', False):
+            return self._open_stream(url)
+        with self.cache.lock(url):
+            entry = self.cache.peek(url)
+            if entry is not None and entry.complete:
+                handle = self.cache.open(entry, record_access=False)
+                if handle is not None:
+                    return handle
+                entry = None
+            return self._download_to_cache(url, entry, None,
+                                           record_access=False)
+
+    def _log(self, session, level, msg, exc_info=False):
+        if session is not None:
+            session._log(level, msg, exc_info=exc_info)
+
+    def _open_cached(self, url, session):
+        """ Returns the cached file of `url`, downloading it to the cache
+        directory if needed.
+        """
+        max_age = self.get_config('max_age', 0)
+        if self.cache.in_memory(url):
+            max_age = max(max_age, self.get_config('memory_max_age', 10))
+        with self.cache.lock(url):
+            entry = self.cache.get(url)
+            if entry is not None and entry.is_fresh(max_age):
+                handle = self.cache.open(entry)
+                if handle is not None:
+                    return handle
+                entry = None
+            return self._download_to_cache(url, entry, session)
+
+    def _download_to_cache(self, url, entry, session, record_access=True):
+        """ Downloads `url` to the cache. If `entry` is complete, it is
+        revalidated. If it is partial, the download is resumed.
+        `record_access` is given to HTTPCache.open.
+        """
+        headers = {}
+        if entry is not None and entry.complete:
+            headers = entry.validators
+        elif entry is not None and entry.resumable:
+            headers = {
+                'Range': 'bytes=%s-' % entry.size,
+                'If-Range': entry.etag or entry.last_modified,
+            }
+
+        workers = self.get_config('range_workers', 1)
+        if not headers and workers > 1:
+            probe = self._probe_ranges(url)
+            if (
+                probe is not None and
+                probe.size >= self.get_config('range_min_size', 1024 * 1024)
+            ):
+                return self._download_ranged(url, entry, probe, workers,
+                                             session, record_access)
+
+        self._log(session, logging.INFO, 'Downloading %s' % url)
+        deadline = time.time() + self.get_config('timeout', 3)
+        with contextlib.closing(
+            self._request(url, headers=headers, conditional=bool(headers))
+        ) as res:
+
+            if res.status_code == 304:
+                self.cache.revalidated(entry)
+                handle = self.cache.open(entry, record_access)
+                if handle is None:
+                    raise IOError('%s removed from cache' % url)
+                return handle
+
+            resume = res.status_code == 206
+            entry = self.cache.begin(
+                url, etag=res.headers.get('etag'),
+                last_modified=res.headers.get('last-modified'), resume=resume
+            )
+            if resume:
+                self._log(session, logging.INFO,
+                          'Resuming download of %s at byte %s' % (
+                              url, entry.size))
+
+            with open(self.cache.part_path(entry), 'a' if resume else 'w') \
+                    as part:
+                try:
+                    for data in self._iter_content(url, res, deadline,
+                                                   size=entry.size):
+                        part.write(data)
+                        entry.size += len(data)
+                except IOError:
+                    self._download_failed(url, entry, session)
+                    raise
+
+        return self._download_succeeded(url, entry, session, record_access)
+
+    def _download_failed(self, url, entry, session):
+        # Partial download kept to be resumed, display a message for
+        # investigation
+        self._log(
+            session, logging.ERROR,
+            'Error while downloading %s. Downloaded content has been '
+            'stored to %s' % (url, self.cache.part_path(entry)), exc_info=True
+        )
+        self.cache.save()
+
+    def _download_succeeded(self, url, entry, session, record_access=True):
+        self.cache.finish(entry)
+        self._log(
+            session, logging.INFO,
+            '%s successfully downloaded to %s' % (url, self.cache.path(entry))
+        )
+        handle = self.cache.open(entry, record_access)
+        if handle is None:
+            raise IOError('%s removed from cache' % url)
+        return handle
+
+    def _download_ranged(self, url, entry, probe, workers, session,
+                         record_access):
+        """ Downloads `url`, described by `probe`, to the cache with
+        `workers` concurrent ranged requests. If `entry` is a ranged download
+        of the same version of the file, only its missing ranges are
+        downloaded.
+        """
+        if (
+            entry is not None and entry.ranged and entry.ranges and
+            (probe.etag or probe.last_modified) and
+            (entry.size, entry.etag, entry.last_modified) ==
+            (probe.size, probe.etag, probe.last_modified) and
+            os.path.exists(self.cache.part_path(entry))
+        ):
+            self._log(session, logging.INFO,
+                      'Resuming download of %s, %s ranges missing' % (
+                          url, len(entry.ranges)))
+            mode = 'r+b'
+        else:
+            self._log(session, logging.INFO,
+                      'Downloading %s with %s ranged requests' % (
+                          url, workers))
+            entry = self.cache.begin(
+                url, etag=probe.etag, last_modified=probe.last_modified,
+                ranged=True
+            )
+            step = -(-probe.size // workers)
+            entry.size = probe.size
+            entry.ranges = [
+                [start, min(start + step, probe.size)]
+                for start in xrange(0, probe.size, step)
+            ]
+            self.cache.save()
+            mode = 'w+b'
+
+        ranges = [ByteRange(start, end) for start, end in entry.ranges]
+        with open(self.cache.part_path(entry), mode) as part:
+            if mode == 'w+b':
+                part.truncate(probe.size)
+                part.flush()
+            try:
+                self._download_ranges(url, part.name, ranges)
+            except IOError:
+                # Record the ranges downloaded, to only request the others
+                # next time
+                entry.ranges = [
+                    [byte_range.position, byte_range.end]
+                    for byte_range in ranges
+                    if byte_range.position < byte_range.end
+                ]
+                self._log(session, logging.ERROR,
+                          'Error while downloading %s, %s ranges missing' % (
+                              url, len(entry.ranges)), exc_info=True)
+                self.cache.save()
+                raise
+        entry.ranges = []
+        return self._download_succeeded(url, entry, session, record_access)
+
+    def _probe_ranges(self, url):
+        """ Returns a RangeProbe if the origin of `url` accepts ranged
+        requests, otherwise None. Raise IOError if the size is bigger than
+        the `maxsize` option.
+
+        Origins may refuse HEAD requests a GET would be served for, so a
+        failed HEAD request returns None rather than failing the download.
+        """
+        try:
+            res = self._request(url, method='HEAD')
+        except IOError:
+            return None
+        with contextlib.closing(res):
+            accept_ranges = res.headers.get('accept-ranges', '')
+            length = res.headers.get('content-length', '')
+            probe = RangeProbe(
+                int(length) if length.isdigit() else None,
+                res.headers.get('etag'), res.headers.get('last-modified')
+            )
+
+        if 'bytes' not in accept_ranges or probe.size is None:
+            return None
+
+        maxsize = self.get_config('maxsize', 1000000 * 50)
+        if probe.size > maxsize:
+            raise IOError('Failed to download %s. '
+                          'More than %s bytes.' % (url, maxsize))
+        return probe
+
+    def _download_ranges(self, url, filename, ranges):
+        """ Downloads the ByteRanges `ranges` of `url` to `filename`, with a
+        concurrent ranged request for each. The `timeout` option applies to
+        each network operation, not to the whole download.
+        """
+        errors = []
+        threads = [
+            threading.Thread(
+                target=self._download_range,
+                args=(url, filename, byte_range, errors)
+            )
+            for byte_range in ranges
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+    def _download_range(self, url, filename, byte_range, errors):
+        """ Downloads `byte_range` of `url` to `filename`, retrying the
+        `range_retries` option times. Errors are appended to `errors`.
+        """
+        retries = self.get_config('range_retries', 3)
+
+        with open(filename, 'r+b') as handle:
+            for attempt in xrange(retries + 1):
+                try:
+                    self._fetch_range(url, handle, byte_range)
+                    return
+                except IOError as exc:
+                    error = exc
+
+        errors.append(error)
+
+    def _fetch_range(self, url, handle, byte_range):
+        """ Downloads the remaining part of `byte_range` to `handle`. Raise
+        IOError if the download is interrupted.
+        """
+        headers = {
+            'Range': 'bytes=%s-%s' % (byte_range.position, byte_range.end - 1)
+        }
+        with contextlib.closing(self._request(url, headers=headers)) as res:
+            if res.status_code != 206:
+                raise IOError('%s ignored the Range header' % url)
+
+            handle.seek(byte_range.position)
+            for data in res.iter_content(chunk_size=65536):
+                data = data[:byte_range.end - byte_range.position]
+                handle.write(data)
+                byte_range.position += len(data)
+
+                if byte_range.position >= byte_range.end:
+                    break
+
+        if byte_range.position < byte_range.end:
+            raise IOError('Range download of %s interrupted at %s' % (
+                url, byte_range.position
+            ))
+
+    def _open_stream(self, url):
+        """ Starts downloading `url`, and return a StreamingFile reading the
+        response as the client requests blocks.
+
+        The `timeout` option only applies to each network operation, since the
+        download goes at the pace of the TFTP client.
+        """
+        res = self._request(url)
+        return StreamingFile(res, self._iter_content(url, res, deadline=None))
+
+    def _request(self, url, method='GET', headers=None, conditional=False):
+        """ Sends the request for `url`, and return the response once headers
+        are received. If `conditional` is True, a 304 response is returned.
+
+        To limit DoS, a timeout is set, redirections are denied, and it is
+        possible to set a whitelist of sites where downloads are authorized.
+        """
+        timeout = self.get_config('timeout', 3)
+        requests_kwargs = self.get_config('requests_kwargs', {
+            'allow_redirects': False
+        })
+        if headers:
+            requests_kwargs = dict(requests_kwargs, headers=dict(
+                requests_kwargs.get('headers', {}), **headers
+            ))
+        whitelist = self.get_config('whitelist', [r'.*'])
+
+        for domain in whitelist:
+            if re.match(domain, url):
+                break
+        else:
+            raise IOError('Forbidden domain (not whitelisted)')
+
+        res = requests.request(method, url, stream=True, timeout=timeout,
+                               **requests_kwargs)
+
+        if conditional and res.status_code == 304:
+            return res
+
+        # can only be true if redirection and allow_redirects is False
+        if 300 <= res.status_code <= 400:
+            res.close()
+            raise IOError('Redirections are forbidden. Download aborted.')
+
+        if not res.ok:
+            res.close()
+            raise HTTPError('%s %s returned HTTP/%s' % (method, url,
+                                                        res.status_code),
+                            res.status_code)
+        return res
+
+    def _iter_content(self, url, res, deadline, size=0):
+        """ Yields the content of `res` block by block. Raise IOError if the
+        content, after the `size` bytes already downloaded, is bigger than the
+        `maxsize` option, or if it is still downloading after `deadline`.
+        """
+        maxsize = self.get_config('maxsize', 1000000 * 50)  # 50M
+        timeout = self.get_config('timeout', 3)
+
+        for data in res.iter_content(chunk_size=8192):
+            yield data
+
+            size += len(data)
+
+            if deadline is not None and time.time() > deadline:
+                raise IOError(
+                    '%s took more than %s seconds to download. Abort.' % (
+                        url, timeout
+                    ))
+
+            if size > maxsize:
+                raise IOError('Failed to download %s. '
+                              'More than %s bytes.' % (url, size))
@@ -0,0 +1,413 @@
+""" On-disk cache of the files downloaded by the HTTP backend.
+"""
+import contextlib
+import errno
+import hashlib
+import json
+import os
+import threading
+import time
+
+from . import LocalFile
+from .memory import MemoryFile
+
+
+class CacheEntry(object):
+    """ A file of the cache. While the file is downloading or if the
+    download failed, `complete` is False and `size` is the number of bytes
+    downloaded so far. `hits` counts the reads of the complete file.
+
+    If `ranged` is True, the file is downloaded with ranged requests into a
+    file preallocated to its full `size`, and `ranges` lists the [start, end)
+    byte ranges still to download. The download is resumed by requesting
+    these ranges only, not with `resumable`.
+    """
+    __slots__ = ('url', 'filename', 'size', 'complete', 'etag',
+                 'last_modified', 'fetched_at', 'last_access', 'hits',
+                 'ranged', 'ranges')
+
+    def __init__(self, url, filename, size=0, complete=False, etag=None,
+                 last_modified=None, fetched_at=None, last_access=None,
+                 hits=0, ranged=False, ranges=None):
+        self.url = url
+        self.filename = filename
+        self.size = size
+        self.complete = complete
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at or time.time()
+        self.last_access = last_access or self.fetched_at
+        self.hits = hits
+        self.ranged = ranged
+        self.ranges = ranges or []
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    @property
+    def validators(self):
+        """ Headers of a conditional request for this entry.
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    @property
+    def resumable(self):
+        """ True if the download can be resumed with a single ranged
+        request.
+        """
+        return (
+            not self.complete and not self.ranged and self.size > 0 and
+            bool(self.etag or self.last_modified)
+        )
+
+    def is_fresh(self, max_age):
+        return self.complete and self.fetched_at + max_age >= time.time()
+
+
+class HTTPCache(object):
+    """ Files downloaded by the HTTP backend, stored in `cache_dir` with the
+    index of the cache, `cache_dir`/index.json.
+
+    The index is loaded the first time the cache is used, and saved every
+    time a download starts, completes or fails, and at most every
+    `save_interval` seconds to record accesses. Nothing is ever fsync'ed:
+    a cache file not referenced by the index is ignored, and an index entry
+    whose file is missing is dropped.
+
+    If `max_bytes` is not 0, the least recently accessed files are removed
+    when the cache holds more than `max_bytes` bytes.
+
+    If a DescriptorPool is given, sessions reading the same complete file
+    share its descriptor.
+
+    Files of at most `memory_max_object` bytes read at least `promote_hits`
+    times are also kept in memory, at most `memory_max_bytes` bytes (0 to
+    disable). When memory is full, a file is only promoted if it has been
+    read more often than the files it would demote, which are then only
+    read from disk.
+    """
+
+    index_name = 'index.json'
+    save_interval = 10
+
+    def __init__(self, cache_dir, max_bytes=0, descriptor_pool=None,
+                 memory_max_bytes=0, memory_max_object=256 * 1024,
+                 promote_hits=2):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.descriptor_pool = descriptor_pool
+        self.memory_max_bytes = memory_max_bytes
+        self.memory_max_object = memory_max_object
+        self.promote_hits = promote_hits
+        self.entries = None
+        self.memory = {}
+        self.memory_size = 0
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.last_save = 0
+        self.dirty = False
+        self._lock = threading.RLock()
+        self._url_locks = {}
+
+    @property
+    def index_path(self):
+        return os.path.join(self.cache_dir, self.index_name)
+
+    @property
+    def size(self):
+        self._load()
+        return sum(entry.size for entry in self.entries.values())
+
+    def _load(self):
+        """ Loads the index of the cache, if not already loaded.
+        """
+        if self.entries is not None:
+            return
+        with self._lock:
+            if self.entries is not None:
+                return
+
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+
+            entries = {}
+            try:
+                with open(self.index_path) as index:
+                    for data in json.load(index):
+                        data = dict(
+                            (str(key), value) for key, value in data.items()
+                        )
+                        entry = CacheEntry(**data)
+                        entries[entry.url] = entry
+            except (IOError, ValueError, TypeError):
+                pass
+            self.entries = entries
+
+    def save(self):
+        """ Writes the index of the cache.
+        """
+        with self._lock:
+            self._load()
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w') as index:
+                json.dump(
+                    [entry.to_dict() for entry in self.entries.values()],
+                    index
+                )
+            os.rename(tmp_path, self.index_path)
+            self.last_save = time.time()
+            self.dirty = False
+
+    @contextlib.contextmanager
+    def lock(self, url):
+        """ Holds the lock of `url` while it is downloaded. Locks are
+        forgotten once no thread holds or waits for them, so that there is
+        no lock per URL ever requested.
+        """
+        with self._lock:
+            url_lock = self._url_locks.get(url)
+            if url_lock is None:
+                url_lock = self._url_locks[url] = [threading.Lock(), 0]
+            # Threads holding or waiting for the lock
+            url_lock[1] += 1
+        try:
+            with url_lock[0]:
+                yield
+        finally:
+            with self._lock:
+                url_lock[1] -= 1
+                if not url_lock[1]:
+                    del self._url_locks[url]
+
+    def path(self, entry):
+        return os.path.join(self.cache_dir, entry.filename)
+
+    def part_path(self, entry):
+        return self.path(entry) + '.part'
+
+    def get(self, url):
+        """ Returns the CacheEntry of `url`, or None.
+        """
+        self._load()
+        with self._lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            self._refresh_size(entry)
+            entry.last_access = time.time()
+            self.dirty = True
+            if self.last_save + self.save_interval < time.time():
+                self.save()
+            return entry
+
+    def peek(self, url):
+        """ Returns the CacheEntry of `url`, or None, without recording an
+        access.
+        """
+        self._load()
+        with self._lock:
+            entry = self.entries.get(url)
+            if entry is not None:
+                self._refresh_size(entry)
+            return entry
+
+    def _refresh_size(self, entry):
+        if not entry.complete and not entry.ranged:
+            # Trust the partial file rather than the index, which may not
+            # have been saved since the last write.
+            try:
+                entry.size = os.path.getsize(self.part_path(entry))
+            except OSError:
+                entry.size = 0
+
+    def open(self, entry, record_access=True):
+        """ Returns a BackendFile reading the complete `entry`, or None if the
+        file is missing. If `record_access` is False, the read isn't counted:
+        it neither promotes `entry` to memory nor changes the statistics.
+        """
+        with self._lock:
+            data = self.memory.get(entry.url)
+            if record_access:
+                entry.hits += 1
+            promote = (
+                record_access and data is None and self._promotable(entry)
+            )
+        if promote:
+            data = self._promote(entry)
+        if data is not None:
+            if record_access:
+                with self._lock:
+                    self.hits += 1
+                    self.memory_hits += 1
+            return MemoryFile(data, version=(entry.url, entry.fetched_at))
+
+        try:
+            if self.descriptor_pool is not None:
+                handle = self.descriptor_pool.acquire(self.path(entry))
+            else:
+                handle = LocalFile(open(self.path(entry)), size=entry.size)
+        except IOError:
+            if record_access:
+                self.misses += 1
+            self.invalidate(entry.url)
+            return None
+        if record_access:
+            self.hits += 1
+        return handle
+
+    def _promotable(self, entry):
+        """ Returns whether `entry` is small and read often enough to be
+        kept in memory.
+        """
+        return bool(
+            self.memory_max_bytes and
+            entry.size <= min(self.memory_max_object, self.memory_max_bytes)
+            and entry.hits >= self.promote_hits
+        )
+
+    def _promote(self, entry):
+        """ Loads `entry` in memory, demoting files read less often if
+        memory is full. Returns the content of `entry`, or None if it was not
+        promoted.
+
+        The file is read without holding the lock of the cache, so that other
+        files can be opened meanwhile.
+        """
+        with self._lock:
+            if self._promotion_victims(entry) is None:
+                return None
+        try:
+            with open(self.path(entry), 'rb') as handle:
+                data = handle.read()
+        except IOError:
+            return None
+
+        with self._lock:
+            if entry.url in self.memory:
+                return self.memory[entry.url]
+            if self.entries.get(entry.url) is not entry:
+                # Replaced or removed while reading
+                return None
+            victims = self._promotion_victims(entry)
+            if victims is None:
+                return None
+            for url in victims:
+                self._demote(url)
+            self.memory[entry.url] = data
+            self.memory_size += len(data)
+            return data
+
+    def _promotion_victims(self, entry):
+        """ Returns the URLs to demote to promote `entry`, or None if it
+        would demote files read more often. Called with the lock held.
+        """
+        victims = []
+        free = self.memory_max_bytes - self.memory_size
+        for url in sorted(self.memory, key=self._memory_rank):
+            if free >= entry.size:
+                break
+            if self._memory_rank(url) >= (entry.hits, entry.last_access):
+                return None
+            victims.append(url)
+            free += self.entries[url].size
+        if free < entry.size:
+            return None
+        return victims
+
+    def in_memory(self, url):
+        """ Returns whether `url` is in the memory tier.
+        """
+        with self._lock:
+            return url in self.memory
+
+    def _memory_rank(self, url):
+        entry = self.entries[url]
+        return (entry.hits, entry.last_access)
+
+    def _demote(self, url):
+        data = self.memory.pop(url, None)
+        if data is not None:
+            self.memory_size -= len(data)
+
+    def begin(self, url, etag=None, last_modified=None, resume=False,
+              ranged=False):
+        """ Returns the entry to record the download of `url`. If `resume` is
+        True, the partial download of the current entry is continued.
+        `ranged` is True for downloads with ranged requests.
+        """
+        self._load()
+        with self._lock:
+            entry = self.entries.get(url)
+            if resume and entry is not None and entry.resumable:
+                return entry
+
+            entry = CacheEntry(
+                url, hashlib.sha1(url).hexdigest(), etag=etag,
+                last_modified=last_modified, ranged=ranged
+            )
+            self._demote(url)
+            self.entries[url] = entry
+            self.save()
+            return entry
+
+    def finish(self, entry):
+        """ Marks `entry` as complete.
+        """
+        with self._lock:
+            os.rename(self.part_path(entry), self.path(entry))
+            entry.complete = True
+            entry.fetched_at = entry.last_access = time.time()
+            self.evict()
+            self.save()
+
+    def revalidated(self, entry):
+        """ Called when the origin confirmed `entry` is up-to-date.
+        """
+        with self._lock:
+            entry.fetched_at = time.time()
+            self.save()
+
+    def invalidate(self, url):
+        with self._lock:
+            self._load()
+            entry = self.entries.pop(url, None)
+            self._demote(url)
+            if entry is not None:
+                self._remove_files(entry)
+                self.save()
+
+    def _remove_files(self, entry):
+        for path in (self.path(entry), self.part_path(entry)):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def evict(self):
+        """ Removes the least recently accessed files until the cache holds
+        less than `max_bytes`. Files being downloaded are not removed.
+        """
+        if not self.max_bytes:
+            return
+        with self._lock:
+            size = self.size
+            for entry in sorted(
+                self.entries.values(), key=lambda entry: entry.last_access
+            ):
+                if size <= self.max_bytes:
+                    break
+                if entry.url in self._url_locks:
+                    continue
+                del self.entries[entry.url]
+                self._demote(entry.url)
+                self._remove_files(entry)
+                size -= entry.size
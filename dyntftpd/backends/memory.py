@@ -0,0 +1,37 @@
+from . import Backend, BackendFile, missing
+
+
+class MemoryFile(BackendFile):
+
+    __slots__ = ('data', 'size', 'version')
+
+    in_memory = True
+
+    def __init__(self, data, version=None):
+        self.data = data
+        self.size = len(data)
+        self.version = version
+
+    def read_block(self, offset, length):
+        return self.data[offset:offset + length]
+
+
+class MemoryBackend(Backend):
+    """ Serves the files of the dictionary `files`, which maps filenames to
+    their content.
+    """
+
+    def __init__(self, files=None):
+        self.files = files if files is not None else {}
+
+    def stat(self, name, session=None):
+        try:
+            return len(self.files[name])
+        except KeyError:
+            raise missing(name)
+
+    def open(self, name, session=None):
+        try:
+            return MemoryFile(self.files[name])
+        except KeyError:
+            raise missing(name)
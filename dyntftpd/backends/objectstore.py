@@ -0,0 +1,43 @@
+from . import Backend, BackendFile, missing
+
+
+class ObjectFile(BackendFile):
+
+    def __init__(self, client, key, size):
+        self.client = client
+        self.key = key
+        self.size = size
+
+    def read_block(self, offset, length):
+        if offset >= self.size:
+            return ''
+        return self.client.get_range(self.key, offset, length)
+
+
+class ObjectStoreBackend(Backend):
+    """ Serves objects from an object store. Blocks are fetched with ranged
+    reads, so objects are never downloaded as a whole.
+
+    `client` wraps the object store API and must implement:
+
+    - head(key): returns the size of the object `key`, or raise KeyError if
+      it doesn't exist.
+    - get_range(key, offset, length): returns `length` bytes of `key`
+      starting at `offset` (less at the end of the object).
+
+    The object key is `prefix` followed by the requested filename.
+    """
+
+    def __init__(self, client, prefix=''):
+        self.client = client
+        self.prefix = prefix
+
+    def stat(self, name, session=None):
+        try:
+            return self.client.head(self.prefix + name)
+        except KeyError:
+            raise missing(name)
+
+    def open(self, name, session=None):
+        key = self.prefix + name
+        return ObjectFile(self.client, key, self.stat(name, session))
@@ -0,0 +1,159 @@
+import collections
+import threading
+import time
+
+
+class TTLCache(object):
+    """ Mapping of at most `maxsize` entries, which expire `ttl` seconds after
+    they have been set. When full, the oldest entries are evicted first.
+
+    If `max_bytes` is not 0, at most `max_bytes` bytes of values are kept,
+    as measured by `sizeof` (len by default, for strings). A value bigger
+    than `max_bytes` is not set.
+
+    `hits` and `misses` count the results of get().
+    """
+
+    def __init__(self, maxsize=10000, ttl=10, max_bytes=0, sizeof=len):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.time()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= time.time():
+                self._pop(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._pop(key)
+            if self.max_bytes:
+                size = self.sizeof(value)
+                if size > self.max_bytes:
+                    return
+                self.size += size
+            self._data[key] = (time.time() + ttl, value)
+            while (
+                len(self._data) > self.maxsize or
+                (self.max_bytes and self.size > self.max_bytes)
+            ):
+                self._pop(next(iter(self._data)))
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None and self.max_bytes:
+            self.size -= self.sizeof(entry[1])
+
+    def invalidate(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+class BlockCache(object):
+    """ LRU cache of the content of files, split in chunks of `chunk_size`
+    bytes, holding at most `max_bytes` bytes.
+
+    Files are identified by a key given by the caller, which must change when
+    the file content changes.
+    """
+
+    def __init__(self, max_bytes, chunk_size=65536):
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._chunks = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def get(self, key, index):
+        """ Returns the chunk `index` of the file `key`, or None.
+        """
+        with self._lock:
+            chunk = self._chunks.pop((key, index), None)
+            if chunk is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._chunks[(key, index)] = chunk
+            return chunk
+
+    def put(self, key, index, chunk, low_priority=False):
+        """ Caches `chunk`, evicting the least recently used chunks if
+        needed. If `low_priority` is True, the chunk is only cached if it
+        fits without evicting other chunks.
+        """
+        with self._lock:
+            if low_priority:
+                if (key, index) in self._chunks or (
+                    self.size + len(chunk) > self.max_bytes
+                ):
+                    return
+            old = self._chunks.pop((key, index), None)
+            if old is not None:
+                self.size -= len(old)
+            if len(chunk) > self.max_bytes:
+                return
+            self._chunks[(key, index)] = chunk
+            self.size += len(chunk)
+            while self.size > self.max_bytes:
+                _, evicted = self._chunks.popitem(last=False)
+                self.size -= len(evicted)
+
+    def read(self, key, offset, length, read_chunk, low_priority=False):
+        """ Returns `length` bytes of the file `key` starting at `offset`.
+        Missing chunks are read with `read_chunk(offset, length)`, and cached
+        with `low_priority` (see put).
+        """
+        data = []
+        first = offset // self.chunk_size
+        last = (offset + length - 1) // self.chunk_size if length else first
+
+        for index in xrange(first, last + 1):
+            chunk = self.get(key, index)
+            if chunk is None:
+                chunk = read_chunk(index * self.chunk_size, self.chunk_size)
+                self.put(key, index, chunk, low_priority)
+            data.append(chunk)
+            if len(chunk) < self.chunk_size:  # end of file
+                break
+
+        start = offset - first * self.chunk_size
+        return ''.join(data)[start:start + length]
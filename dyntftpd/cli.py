@@ -1,7 +1,12 @@
 import argparse
+import json
 import logging
 import logging.config
+import signal
 
+from .handoff import inherited_fds
+from .logqueue import queue_handlers
+from .preload import Preloader, read_manifest
 from .server import TFTPServer
 
 
@@ -14,15 +19,85 @@ def arguments_parser():
     parser.add_argument(
         '--root', '-r', default='/var/lib/tftpboot/', help='TFTP root folder'
     )
+    parser.add_argument(
+        '--block-cache-size', default=0, type=int,
+        help='Bytes of files of the TFTP root cached in memory'
+    )
+    parser.add_argument(
+        '--readahead-size', default=0, type=int,
+        help='Bytes of each file being transferred read ahead in background'
+    )
+    parser.add_argument(
+        '--http-max-age', default=0, type=int,
+        help='Seconds during which downloaded HTTP files are reused '
+             '(files kept in memory are reused for at least 10 seconds)'
+    )
+    parser.add_argument(
+        '--preload', metavar='MANIFEST',
+        help='File listing paths, glob patterns (relative to the TFTP root) '
+             'and URLs to load in cache at startup'
+    )
+    parser.add_argument(
+        '--preload-concurrency', default=4, type=int,
+        help='Maximum number of files preloaded at the same time'
+    )
+    parser.add_argument(
+        '--prefetch', action='store_true',
+        help='Warm the caches with the files clients are likely to request '
+             'next, learned from the order of their requests'
+    )
+    parser.add_argument(
+        '--prefetch-budget', default=64 * 1024 * 1024, type=int,
+        help='Bytes prefetched per minute at most'
+    )
+    parser.add_argument(
+        '--reload-deadline', default=30, type=int,
+        help='On SIGHUP, seconds given to transfers in progress to complete '
+             'before the new process takes over'
+    )
+    parser.add_argument(
+        '--log-queue-size', default=10000, type=int,
+        help='Log records waiting to be written before new records are '
+             'dropped. 0 to write records synchronously'
+    )
+    parser.add_argument(
+        '--log-summary', action='store_true',
+        help='Log one summary record per transfer'
+    )
+    parser.add_argument(
+        '--log-ack-sample', default=1, type=int, metavar='N',
+        help='In verbose mode, log only one ACK out of N. 0 to log none'
+    )
+    parser.add_argument(
+        '--trace', metavar='FILE',
+        help='Record the datagrams received to FILE, to replay them with '
+             'dyntftpd-replay'
+    )
+    parser.add_argument(
+        '--ready-file',
+        help='Once preloading is done, write its status (JSON) to this file'
+    )
     return parser
 
 
+def write_ready_file(path):
+    """ Returns a callback for Preloader.on_ready, writing the status of the
+    preloader to `path`.
+    """
+    def on_ready(preloader):
+        with open(path, 'w') as ready_file:
+            json.dump(preloader.status(), ready_file)
+    return on_ready
+
+
 def main():
     parser = arguments_parser()
     parser.add_argument(
         '-v', dest='verbose', action='count', default=0, help='Verbose mode'
     )
     args = parser.parse_args()
+    if args.log_ack_sample < 0:
+        parser.error('--log-ack-sample must be positive or 0')
 
     log_level = logging.DEBUG if args.verbose else logging.INFO
     logging.config.dictConfig({
@@ -59,6 +134,44 @@ def main():
             }
         }
     })
+    if args.log_queue_size:
+        for name in ('', 'dyntftpd'):
+            queue_handlers(logging.getLogger(name), args.log_queue_size)
+
+    # Started by a server reloading on SIGHUP
+    listen_fd, predecessor_fd = inherited_fds()
+
+    tftp_server = TFTPServer(
+        args.host, args.port, root=args.root, handler_args={
+            'block_cache': {'size': args.block_cache_size},
+            'readahead': {'size': args.readahead_size},
+            'prefetch': {
+                'enabled': args.prefetch,
+                'budget': args.prefetch_budget,
+            },
+            'http': {'max_age': args.http_max_age},
+            'log': {
+                'summary': args.log_summary,
+                'ack_sample': args.log_ack_sample,
+            },
+            'trace': {'path': args.trace},
+        }, listen_fd=listen_fd, predecessor_fd=predecessor_fd
+    )
+    tftp_server.reload_deadline = args.reload_deadline
+    signal.signal(signal.SIGHUP,
+                  lambda signum, frame: tftp_server.request_reload())
+
+    if args.preload or args.ready_file:
+        preloader = Preloader(
+            tftp_server,
+            read_manifest(args.preload) if args.preload else [],
+            concurrency=args.preload_concurrency,
+            on_ready=write_ready_file(args.ready_file) if args.ready_file
+            else None
+        )
+        preloader.start()
 
-    tftp_server = TFTPServer(args.host, args.port, root=args.root)
-    tftp_server.serve_forever()
+    try:
+        tftp_server.serve_forever()
+    finally:
+        tftp_server.server_close()
@@ -0,0 +1,344 @@
+""" Random access to files compressed with gzip or zstd.
+
+The file is decompressed once to build an index of checkpoints, from which
+decompression can restart, so reading at any offset only decompresses the
+data between the previous checkpoint and this offset:
+
+- gzip: the state of the decompressor (zlib's decompressobj.copy()) is saved
+  every `span` bytes of uncompressed data. Each open file also keeps the
+  state where its last read stopped (GzipCursor), so sequential reads don't
+  restart from the previous checkpoint,
+- zstd: frames are decompressed independently, so checkpoints are the start
+  of each frame. Files compressed with a single frame are decompressed from
+  the start for every read: compress them with multiple frames (pzstd,
+  zstd --adapt, or the seekable format).
+
+zstd files are only supported if the zstandard module is installed.
+
+Indexes give an estimate of their memory usage, `memory_size`, so that
+their cache can be bounded in bytes.
+"""
+import bisect
+import errno
+import os
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .backends import BackendFile, CachedFile
+
+
+READ_SIZE = 65536
+
+# Approximate memory used by a checkpoint, and by a saved zlib decompressor:
+# its inflate state and its 32 KB window
+CHECKPOINT_SIZE = 128
+DECOMPRESSOR_SIZE = 44 * 1024
+
+
+def invalid(msg):
+    return IOError(errno.EIO, msg)
+
+
+class GzipCursor(object):
+    """ State of the decompressor where the last read of a file stopped.
+    """
+    __slots__ = ('position', 'in_offset', 'decompressor', 'pending')
+
+    def __init__(self):
+        self.position = None
+        self.in_offset = None
+        self.decompressor = None
+        self.pending = ''
+
+
+class GzipIndex(object):
+    """ Checkpoints of a gzip file, as (uncompressed offset, compressed
+    offset, decompressor state or None to start a new member).
+    """
+
+    def __init__(self, compressed, span):
+        self.offsets = []
+        self.checkpoints = []
+        self.size = 0
+        self.memory_size = 0
+        try:
+            self._build(compressed, span)
+        except zlib.error as exc:
+            raise invalid('Invalid gzip file: %s' % exc)
+
+    @staticmethod
+    def decompressor():
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def cursor(self):
+        return GzipCursor()
+
+    def _add(self, position, in_offset, state):
+        self.offsets.append(position)
+        self.checkpoints.append((position, in_offset, state))
+        self.memory_size += CHECKPOINT_SIZE
+        if state is not None:
+            self.memory_size += DECOMPRESSOR_SIZE
+
+    def _build(self, compressed, span):
+        self._add(0, 0, None)
+        decompressor = self.decompressor()
+        position = in_offset = 0
+        pending = ''
+
+        while True:
+            if not pending:
+                pending = compressed.read_block(in_offset, READ_SIZE)
+                in_offset += len(pending)
+                if not pending:
+                    break
+
+            boundary = (position // span + 1) * span
+            data = decompressor.decompress(pending, boundary - position)
+            position += len(data)
+
+            if decompressor.unused_data:
+                # End of a member, the next one starts a new stream
+                pending = decompressor.unused_data
+                decompressor = self.decompressor()
+                state = None
+            else:
+                pending = decompressor.unconsumed_tail
+                state = decompressor
+
+            if position == boundary:
+                self._add(
+                    position, in_offset - len(pending),
+                    state.copy() if state is not None else None
+                )
+
+        self.size = position
+
+    def read(self, compressed, offset, length, cursor=None):
+        """ Returns `length` bytes of uncompressed data starting at `offset`.
+        The read starts from `cursor` if it is closer to `offset` than the
+        previous checkpoint, and `cursor` is moved to where the read stops.
+        """
+        index = bisect.bisect_right(self.offsets, offset) - 1
+        position, in_offset, state = self.checkpoints[index]
+        pending = ''
+        if (
+            cursor is not None and cursor.decompressor is not None and
+            position < cursor.position <= offset
+        ):
+            position, in_offset = cursor.position, cursor.in_offset
+            decompressor, pending = cursor.decompressor, cursor.pending
+            # Not usable again if the read fails
+            cursor.decompressor = None
+        elif state is not None:
+            decompressor = state.copy()
+        else:
+            decompressor = self.decompressor()
+
+        end = offset + length
+        chunks = []
+        try:
+            while position < end:
+                if not pending:
+                    pending = compressed.read_block(in_offset, READ_SIZE)
+                    in_offset += len(pending)
+                    if not pending:
+                        break
+
+                data = decompressor.decompress(pending, end - position)
+                if decompressor.unused_data:
+                    pending = decompressor.unused_data
+                    decompressor = self.decompressor()
+                else:
+                    pending = decompressor.unconsumed_tail
+
+                if position + len(data) > offset:
+                    chunks.append(data[max(offset - position, 0):])
+                position += len(data)
+        except zlib.error as exc:
+            raise invalid('Invalid gzip file: %s' % exc)
+
+        if cursor is not None:
+            cursor.position, cursor.in_offset = position, in_offset
+            cursor.decompressor, cursor.pending = decompressor, pending
+        return ''.join(chunks)
+
+
+class ZstdIndex(object):
+    """ Frames of a zstd file, as (uncompressed offset, compressed offset,
+    compressed length).
+    """
+
+    MAGIC = 0xFD2FB528
+    SKIPPABLE_MAGICS = xrange(0x184D2A50, 0x184D2A60)
+
+    def __init__(self, compressed, span=None):
+        self.offsets = []
+        self.frames = []
+        self.size = 0
+        try:
+            self._build(compressed)
+        except zstandard.ZstdError as exc:
+            raise invalid('Invalid zstd file: %s' % exc)
+
+    @property
+    def memory_size(self):
+        return len(self.frames) * CHECKPOINT_SIZE
+
+    def cursor(self):
+        # Frames are decompressed independently
+        return None
+
+    def frame_length(self, compressed, in_offset):
+        """ Returns the compressed length of the frame starting at `in_offset`
+        and whether it contains data, from its header and block headers.
+        """
+        header = compressed.read_block(in_offset, 14)
+        if len(header) < 8:
+            raise invalid('Truncated zstd frame')
+
+        magic, = struct.unpack('<I', header[:4])
+        if magic in self.SKIPPABLE_MAGICS:
+            return 8 + struct.unpack('<I', header[4:8])[0], False
+        if magic != self.MAGIC:
+            raise invalid('Invalid zstd magic number')
+
+        descriptor = ord(header[4])
+        single_segment = descriptor >> 5 & 1
+        position = in_offset + 5
+        position += 0 if single_segment else 1  # window descriptor
+        position += (0, 1, 2, 4)[descriptor & 3]  # dictionary id
+        position += (single_segment, 2, 4, 8)[descriptor >> 6]  # content size
+
+        while True:
+            block = compressed.read_block(position, 3)
+            if len(block) < 3:
+                raise invalid('Truncated zstd frame')
+            value = ord(block[0]) | ord(block[1]) << 8 | ord(block[2]) << 16
+            block_type = value >> 1 & 3
+            position += 3 + (1 if block_type == 1 else value >> 3)
+            if value & 1:  # last block
+                break
+
+        if descriptor >> 2 & 1:  # checksum
+            position += 4
+        return position - in_offset, True
+
+    def decompress_frame(self, compressed, in_offset, length):
+        """ Yields the uncompressed data of the frame at `in_offset`.
+        """
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        end = in_offset + length
+        while in_offset < end:
+            data = compressed.read_block(
+                in_offset, min(READ_SIZE, end - in_offset)
+            )
+            if not data:
+                raise invalid('Truncated zstd frame')
+            in_offset += len(data)
+            yield decompressor.decompress(data)
+
+    def _build(self, compressed):
+        position = in_offset = 0
+        while compressed.read_block(in_offset, 1):
+            length, has_data = self.frame_length(compressed, in_offset)
+            if has_data:
+                self.offsets.append(position)
+                self.frames.append((position, in_offset, length))
+                for data in self.decompress_frame(
+                    compressed, in_offset, length
+                ):
+                    position += len(data)
+            in_offset += length
+        self.size = position
+
+    def read(self, compressed, offset, length, cursor=None):
+        """ Returns `length` bytes of uncompressed data starting at `offset`.
+        """
+        index = max(bisect.bisect_right(self.offsets, offset) - 1, 0)
+        end = offset + length
+        chunks = []
+        try:
+            for position, in_offset, frame_length in self.frames[index:]:
+                if position >= end:
+                    break
+                for data in self.decompress_frame(
+                    compressed, in_offset, frame_length
+                ):
+                    if position + len(data) > offset:
+                        chunks.append(
+                            data[max(offset - position, 0):end - position]
+                        )
+                    position += len(data)
+                    if position >= end:
+                        break
+        except zstandard.ZstdError as exc:
+            raise invalid('Invalid zstd file: %s' % exc)
+        return ''.join(chunks)
+
+
+def formats():
+    """ Returns the supported (suffix, index class) of compressed files.
+    """
+    supported = [('.gz', GzipIndex)]
+    if zstandard is not None:
+        supported.append(('.zst', ZstdIndex))
+    return supported
+
+
+def uncompressed_name(path):
+    """ Returns `path` without its compression suffix, or None.
+    """
+    root, ext = os.path.splitext(path)
+    if ext in ('.gz', '.zst'):
+        return root
+    return None
+
+
+class CompressedFile(BackendFile):
+    """ Uncompressed content of the BackendFile `compressed`, read with its
+    `index` through the BlockCache `cache`. Chunks of the cache should be
+    smaller than the span between checkpoints, and divide it.
+
+    If `low_priority` is set, chunks read are only cached if the caches of
+    the uncompressed and compressed content have room for them (see
+    CachedFile).
+    """
+
+    def __init__(self, compressed, index, cache):
+        self.compressed = compressed
+        self.index = index
+        self.cache = cache
+        self.cursor = index.cursor()
+        self.size = index.size
+        self.version = compressed.version
+        self._low_priority = False
+
+    @property
+    def low_priority(self):
+        return self._low_priority
+
+    @low_priority.setter
+    def low_priority(self, value):
+        self._low_priority = value
+        if isinstance(self.compressed, CachedFile):
+            self.compressed.low_priority = value
+
+    def read_block(self, offset, length):
+        if self.version is None:
+            return self._read_chunk(offset, length)
+        return self.cache.read(
+            self.version, offset, length, self._read_chunk,
+            self._low_priority
+        )
+
+    def _read_chunk(self, offset, length):
+        return self.index.read(self.compressed, offset, length, self.cursor)
+
+    def close(self):
+        self.compressed.close()
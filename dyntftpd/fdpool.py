@@ -0,0 +1,178 @@
+import collections
+import os
+import threading
+
+
+class SharedDescriptor(object):
+    """ A read-only file descriptor shared by all the sessions reading the
+    same file.
+    """
+    __slots__ = ('key', 'fd', 'size', 'refcount', 'lock')
+
+    def __init__(self, key, fd, size):
+        self.key = key
+        self.fd = fd
+        self.size = size
+        self.refcount = 0
+        self.lock = threading.Lock()
+
+    if hasattr(os, 'pread'):
+        def read_at(self, offset, size):
+            return os.pread(self.fd, size, offset)
+    else:
+        def read_at(self, offset, size):
+            # Without pread, seeking and reading must not be interleaved with
+            # another reader.
+            with self.lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                return os.read(self.fd, size)
+
+
+class PooledFile(object):
+    """ File-like object returned by DescriptorPool.acquire. Each PooledFile
+    has its own position, and reads with positional reads on the shared
+    descriptor.
+
+    Also implements the BackendFile interface (`size`, read_block and
+    release).
+    """
+    __slots__ = ('name', 'size', 'position', '_pool', '_descriptor')
+
+    def __init__(self, pool, descriptor, name):
+        self.name = name
+        self.size = descriptor.size
+        self.position = 0
+        self._pool = pool
+        self._descriptor = descriptor
+
+    @property
+    def key(self):
+        return self._descriptor.key
+
+    version = key
+
+    @property
+    def closed(self):
+        return self._descriptor is None
+
+    def fileno(self):
+        return self._descriptor.fd
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += os.fstat(self._descriptor.fd).st_size
+        self.position = offset
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size < 0:
+            size = max(
+                os.fstat(self._descriptor.fd).st_size - self.position, 0
+            )
+        data = self._descriptor.read_at(self.position, size)
+        self.position += len(data)
+        return data
+
+    def read_block(self, offset, length):
+        return self._descriptor.read_at(offset, length)
+
+    def release(self, offset):
+        pass
+
+    def close(self):
+        if self._descriptor is not None:
+            self._pool.release(self._descriptor)
+            self._descriptor = None
+
+
+class DescriptorPool(object):
+    """ Reference-counted pool of read-only file descriptors, keyed by
+    (st_dev, st_ino, st_mtime) so a file replaced or modified is not served
+    from a stale descriptor.
+
+    Descriptors no longer used by any session are kept open for the next
+    session, and the least recently used ones are closed when the pool holds
+    more than `max_fds` descriptors. Descriptors in use are never closed, so
+    the pool can exceed `max_fds` if more than `max_fds` distinct files are
+    transferred at the same time.
+    """
+
+    def __init__(self, max_fds=128):
+        self.max_fds = max_fds
+        self.descriptors = {}
+        self.idle = collections.OrderedDict()
+        self.opens = 0
+        self.reuses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.descriptors)
+
+    def acquire(self, path, key=None):
+        """ Returns a PooledFile reading `path`. If the caller already knows
+        the (st_dev, st_ino, st_mtime) of `path`, it can give it as `key` to
+        avoid calling os.stat(path).
+
+        Raise IOError if `path` cannot be opened.
+        """
+        try:
+            if key is None:
+                st = os.stat(path)
+                key = (st.st_dev, st.st_ino, st.st_mtime)
+
+            with self._lock:
+                descriptor = self.descriptors.get(key)
+                if descriptor is not None:
+                    self.reuses += 1
+                    self.idle.pop(key, None)
+                    descriptor.refcount += 1
+                    return PooledFile(self, descriptor, path)
+
+            fd = os.open(path, os.O_RDONLY)
+        except OSError as exc:
+            raise IOError(exc.errno, exc.strerror, path)
+
+        with self._lock:
+            self.opens += 1
+            # The file may have been replaced between stat() and open()
+            st = os.fstat(fd)
+            key = (st.st_dev, st.st_ino, st.st_mtime)
+
+            descriptor = self.descriptors.get(key)
+            if descriptor is None:
+                descriptor = SharedDescriptor(key, fd, st.st_size)
+                self.descriptors[key] = descriptor
+                self._close_idle(self.max_fds)
+            else:
+                # Concurrently opened by another thread
+                os.close(fd)
+                self.idle.pop(key, None)
+
+            descriptor.refcount += 1
+            return PooledFile(self, descriptor, path)
+
+    def release(self, descriptor):
+        with self._lock:
+            descriptor.refcount -= 1
+            if descriptor.refcount == 0:
+                self.idle[descriptor.key] = descriptor
+                self._close_idle(self.max_fds)
+
+    def _close_idle(self, max_fds):
+        """ Close idle descriptors, least recently used first, until the pool
+        holds at most `max_fds` descriptors.
+        """
+        while len(self.descriptors) > max_fds and self.idle:
+            key, descriptor = self.idle.popitem(last=False)
+            del self.descriptors[key]
+            os.close(descriptor.fd)
+
+    def close(self):
+        """ Close all idle descriptors.
+        """
+        with self._lock:
+            self._close_idle(0)
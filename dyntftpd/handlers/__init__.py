@@ -1,37 +1,189 @@
 import errno
+import functools
 import logging
 import os
 import struct
+import sys
+import time
 
 import SocketServer
 
+from .. import netascii
+from ..backends.memory import MemoryFile
+from ..pacing import Pacer
+
 
 logger = logging.getLogger(__name__)
 
 
 class TFTPSession(object):
     """ Represents a file transfert for a client.
+
+    Sessions are slotted and only reference the server, not the handler of
+    the datagram which created them, so that a server can hold 100k+
+    transfers: with its entry in server.sessions, its client address and an
+    in-memory file, a session costs less than 400 bytes (see
+    benchmarks/sessions.py). Filenames are interned, so sessions of the same
+    file share their name.
     """
+    __slots__ = ('server', 'client_address', 'filename', 'handle',
+                 'block_id', 'last_read_is_eof', 'blksize', 'loading',
+                 'netascii', 'pacer', 'readahead', 'started_at',
+                 'blocks_sent', 'bytes_sent', 'retransmits')
+
+    # Key of the handler arguments where get_config looks up values
+    config_section = None
+
+    # If True, load_file is called from a separate thread
+    load_async = False
+
     def __init__(self, tftp_handler, filename):
-        self.tftp_handler = tftp_handler
+        self.server = tftp_handler.server
+        self.client_address = tftp_handler.client_address
+        if isinstance(filename, str):
+            filename = intern(filename)
         self.filename = filename
         self.handle = None
         self.block_id = 0
         self.last_read_is_eof = False
         self.blksize = 512
+        self.loading = False
+
+        # BackendFile of the content sent in netascii mode
+        self.netascii = None
+
+        # Pacing state, if enabled by the server
+        self.pacer = None
+
+        # ReadAhead of the file, if enabled by the server
+        self.readahead = None
+
+        # Statistics of the transfer, retransmissions included
+        self.started_at = time.time()
+        self.blocks_sent = 0
+        self.bytes_sent = 0
+        self.retransmits = 0
 
     def load_file(self):
         raise NotImplementedError
 
+    def read_block(self, offset, length):
+        """ Returns `length` bytes of the loaded file, starting at `offset`.
+        """
+        self.handle.seek(offset)
+        return self.handle.read(length)
+
+    def release(self, offset):
+        """ Called once the blocks before `offset` are acked: they won't be
+        read again.
+        """
+        pass
+
     def unload_file(self):
         raise NotImplementedError
 
+    def close(self):
+        """ Stops the read-ahead of the file, then unloads it.
+        """
+        if self.readahead is not None:
+            self.readahead.cancel()
+            self.readahead = None
+        self.unload_file()
+
+    def is_in_memory(self):
+        """ Returns True if the loaded file is read from memory, and doesn't
+        need read-ahead.
+        """
+        return False
+
+    def negative_cache_key(self):
+        """ Returns the key under which a miss of this session is remembered by
+        the server's negative cache, or None to never cache misses.
+        """
+        return None
+
+    def is_missing_error(self, exc):
+        """ Returns True if the IOError `exc`, raised by load_file, means the
+        file doesn't exist.
+        """
+        return exc.errno == errno.ENOENT
+
+    def get_config(self, name, default):
+        """ Fetchs `name` in handler arguments, or return `default`.
+        """
+        return self.server.get_config(self.config_section, name, default)
+
+    def _log(self, level, msg, exc_info=False):
+        logger.log(level, msg, extra={'client_ip': self.client_address[0]},
+                   exc_info=exc_info)
+
+    def get_size(self):
+        """ Returns the size of the loaded file, used to answer the tsize
+        option. Returns None if the size is unknown.
+        """
+        self.handle.seek(0, os.SEEK_END)
+        return self.handle.tell()
+
+    def get_version(self):
+        """ Returns a value identifying the content of the loaded file (see
+        BackendFile.version), or None if unknown.
+        """
+        return None
+
+    def summary(self):
+        """ Returns the statistics of the transfer. If the transfer is paced,
+        `rtt` is its smoothed RTT and `loss` the ratio of retransmitted
+        blocks.
+        """
+        summary = {
+            'file': self.filename,
+            'bytes': self.bytes_sent,
+            'blocks': self.blocks_sent,
+            'retransmits': self.retransmits,
+            'duration': time.time() - self.started_at,
+        }
+        if self.pacer is not None:
+            summary['rtt'] = self.pacer.srtt
+            summary['loss'] = (
+                float(self.retransmits) / self.blocks_sent
+                if self.blocks_sent else 0.
+            )
+        return summary
+
+
+def log_transfer(session, client_address, handler_name, status):
+    """ Logs the summary record of the transfer of `session`. `status` is
+    'complete', 'error' or 'timeout'.
+
+    The fields of the summary are given in the `transfer` attribute of the
+    record, for structured formatters.
+    """
+    transfer = session.summary()
+    transfer.update({
+        'client': '%s:%s' % client_address,
+        'handler': handler_name,
+        'status': status,
+    })
+    msg = (
+        'Transfer of %(file)s %(status)s: %(bytes)s bytes, %(blocks)s '
+        'blocks, %(retransmits)s retransmits in %(duration).3fs' % transfer
+    )
+    if transfer.get('rtt') is not None:
+        msg += ', RTT %(rtt).3fs, loss %(loss).1f%%' % dict(
+            transfer, loss=transfer['loss'] * 100
+        )
+    logger.info(
+        '%s (%s)' % (msg, handler_name),
+        extra={'client_ip': client_address[0], 'transfer': transfer}
+    )
+
 
 class TFTPUDPHandler(SocketServer.BaseRequestHandler):
     """ Mixin. Implementation of the TFTP protocol.
 
     http://tools.ietf.org/html/rfc1350
     http://tools.ietf.org/html/rfc1782
+    http://tools.ietf.org/html/rfc2349
     """
 
     # opcodes
@@ -54,9 +206,36 @@ class TFTPUDPHandler(SocketServer.BaseRequestHandler):
 
     session_cls = None
 
+    @property
+    def log_summary(self):
+        """ If handler_args['log']['summary'] is True, one record summarizing
+        each transfer is logged instead of the request and completion
+        records.
+        """
+        return self.server.get_config('log', 'summary', False)
+
     def make_session(self, filename):
         return self.session_cls(self, filename)
 
+    def load_session_file(self, session):
+        """ Calls session.load_file(), unless the file is known to be missing
+        by the negative cache.
+        """
+        cache = self.server.negative_cache
+        key = session.negative_cache_key() if cache is not None else None
+
+        if key is not None:
+            error = cache.get(key)
+            if error is not None:
+                raise IOError(*error)
+
+        try:
+            return session.load_file()
+        except IOError as exc:
+            if key is not None and session.is_missing_error(exc):
+                cache.set(key, exc.args)
+            raise
+
     def _log(self, level, msg, extra=None, exc_info=False):
         """ Add client_ip to extra.
         """
@@ -65,6 +244,19 @@ class TFTPUDPHandler(SocketServer.BaseRequestHandler):
             log_extra.update(extra)
         logger.log(level, msg, extra=log_extra, exc_info=exc_info)
 
+    def _log_ack(self, block_id):
+        """ Logs the ACK of `block_id`. Only one ACK out of
+        handler_args['log']['ack_sample'] is logged, none if it is 0.
+        """
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        sample = self.server.get_config('log', 'ack_sample', 1)
+        if sample < 1:
+            return
+        self.server.ack_count += 1
+        if self.server.ack_count % sample == 0:
+            self._log(logging.DEBUG, 'ACK (block %s)' % block_id)
+
     def get_current_session(self):
         """ Gets the client's session, or returns None.
         """
@@ -82,7 +274,7 @@ class TFTPUDPHandler(SocketServer.BaseRequestHandler):
         """
         session = self.get_current_session()
         if session:
-            session.unload_file()
+            session.close()
 
         try:
             del self.server.sessions[self.client_address]
@@ -92,8 +284,14 @@ class TFTPUDPHandler(SocketServer.BaseRequestHandler):
     def handle(self):
         """ Called when data are received. Extract header info and dispatch to
         handle_* methods.
+
+        Called with None instead of data when the timer of the client's
+        session is due.
         """
         data = self.request[0]
+        if data is None:
+            return self.handle_timer()
+
         opcode, = struct.unpack('!H', data[0:2])
 
         data = data[2:]  # skip opcode
@@ -145,51 +343,120 @@ class TFTPUDPHandler(SocketServer.BaseRequestHandler):
 
         Create a new session.
         """
-        self._log(logging.INFO, 'GET %s (%s)' % (filename, mode))
+        self._log(
+            logging.DEBUG if self.log_summary else logging.INFO,
+            'GET %s (%s)' % (filename, mode)
+        )
 
-        if mode.lower() != 'octet':
+        mode = mode.lower()
+        if mode not in ('octet', 'netascii'):
             self.send_error(
                 self.ERR_ILLEGAL_OPERATION,
-                'Only octet mode is supported by the server'
+                'Only octet and netascii modes are supported by the server'
             )
             return
 
+        if self.server.prefetcher is not None:
+            self.server.prefetcher.on_request(self.client_address[0], filename)
+
+        # The client retransmitted its request while the file is loading
+        current = self.get_current_session()
+        if current is not None and current.loading:
+            return
+
+        # Pending index updates may add the file, or invalidate cached misses
+        self.server.refresh_file_index()
+
         try:
             session = self.make_session(filename)
         except ValueError as exc:  # if filename is invalid
             self.send_error(self.ERR_PERM, str(exc))
             return
 
+        if not session.load_async:
+            return self.start_session(session, options, mode)
+
+        # The file is loaded by a worker of the load pool, and the request
+        # answered by the serve loop
+        session.loading = True
+        self.set_current_session(session)
+        if not self.server.load_pool.submit(
+            functools.partial(self.load_session_file, session),
+            functools.partial(self.file_loaded, session, options, mode)
+        ):
+            session.loading = False
+            self.send_error(self.ERR_UNDEFINED, 'Server busy')
+
+    def start_session(self, session, options, mode='octet'):
+        """ Loads the file of `session`, then answers the read request.
+        """
         try:
-            session.handle = session.load_file()
-        except IOError as exc:
+            handle = self.load_session_file(session)
+        except Exception:
+            self.file_loaded(session, options, mode, None, sys.exc_info())
+        else:
+            self.file_loaded(session, options, mode, handle)
+
+    def file_loaded(self, session, options, mode, handle, exc_info=None):
+        """ Answers the read request of `session` once its file is loaded:
+        `handle` is the loaded BackendFile, or None if loading raised
+        `exc_info`. Called by the serve loop.
+        """
+        try:
+            self._start_session(session, options, mode, handle, exc_info)
+        finally:
+            # Expired sessions are not reaped until the first packet is sent
+            session.loading = False
+
+    def _start_session(self, session, options, mode, handle, exc_info):
+        exc = exc_info[1] if exc_info is not None else None
+        if isinstance(exc, IOError):
             # If ENOENT, consider the file is missing. Otherwise, consider we
             # don't have the permission to read it.
             err_msg = exc.strerror or str(exc)
             if exc.errno == errno.ENOENT:
                 self.send_error(
-                    self.ERR_NOT_FOUND, '%s (%s)' % (err_msg, filename)
+                    self.ERR_NOT_FOUND, '%s (%s)' % (err_msg, session.filename)
                 )
             else:
                 self.send_error(
-                    self.ERR_PERM, '%s (%s)' % (err_msg, filename)
+                    self.ERR_PERM, '%s (%s)' % (err_msg, session.filename)
                 )
             return
         # The file cannot be loaded for any (critical) reason. Log the
         # traceback.
-        except Exception as exc:
-            self._log(logging.ERROR, 'Internal error', exc_info=True)
+        if exc is not None:
+            self._log(logging.ERROR, 'Internal error', exc_info=exc_info)
             self.send_error(self.ERR_UNDEFINED, 'Internal error')
             return
 
+        session.handle = handle
+
+        if mode == 'netascii':
+            try:
+                session.netascii = self.convert_netascii(session)
+            except IOError as exc:
+                self._log(logging.ERROR, 'Read error', exc_info=True)
+                session.unload_file()
+                self.send_error(self.ERR_UNDEFINED, exc.strerror or str(exc))
+                return
+
+        if session.loading and self.get_current_session() is not session:
+            # Session expired while the file was loading
+            session.unload_file()
+            return
+
         self.set_current_session(session)
+        if self.server.pacing is not None:
+            session.pacer = Pacer(self.server.pacing)
 
         # If there is a supported option, return a OACK, otherwise return the
         # first packet.
-        # For now, only 'blksize' is supported.
+        # For now, only 'blksize' and 'tsize' are supported.
+        oack = {}
         blksize = options.get('blksize')
 
-        # Set the block size and return a OACK
+        # Set the block size
         if blksize:
             try:
                 session.blksize = int(blksize)
@@ -197,41 +464,157 @@ class TFTPUDPHandler(SocketServer.BaseRequestHandler):
                 return self.send_error(
                     self.ERR_ILLEGAL_OPERATION, 'Bad option value'
                 )
-            return self.send_oack(blksize=blksize)
+            oack['blksize'] = blksize
+
+        readahead = self.server.readahead
+        if (
+            readahead is not None and session.netascii is None and
+            not session.is_in_memory()
+        ):
+            session.readahead = readahead.attach(
+                session.read_block, session.blksize
+            )
+
+        # Client wants to know the size of the file
+        if 'tsize' in options:
+            if session.netascii is not None:
+                size = session.netascii.size
+            else:
+                size = session.get_size()
+            if size is not None:
+                oack['tsize'] = str(size)
+
+        if oack:
+            return self.send_oack(**oack)
 
         # No options, return the first part of the file
         self.send_data()
 
+    def convert_netascii(self, session):
+        """ Returns a BackendFile reading the netascii form of the file
+        loaded by `session`.
+
+        Files of at most handler_args['netascii']['max_memory_size'] bytes
+        are converted in memory. If their version is known, they are
+        converted once, and kept in the server's netascii cache. Bigger
+        files, and files of unknown size, are converted as they are sent.
+        """
+        size = session.get_size()
+        if size is None or size > self.server.get_config(
+            'netascii', 'max_memory_size', 1024 * 1024
+        ):
+            return netascii.NetasciiFile(session.read_block)
+
+        version = session.get_version()
+        key = None
+        if version is not None:
+            key = (session.config_section, session.filename, version)
+            data = self.server.netascii_cache.get(key)
+            if data is not None:
+                return MemoryFile(data)
+
+        chunks = []
+        offset = 0
+        while True:
+            chunk = session.read_block(offset, 65536)
+            chunks.append(chunk)
+            offset += len(chunk)
+            if len(chunk) < 65536:
+                break
+
+        data = netascii.encode(''.join(chunks))
+        if key is not None:
+            self.server.netascii_cache.set(key, data)
+        return MemoryFile(data)
+
     def handle_ack(self, block_id):
         """ Client has aknowledged a block id. Can be a retransmission or the
         next packet to send.
         """
-        self._log(logging.DEBUG, 'ACK (block %s)' % block_id)
+        self._log_ack(block_id)
         session = self.get_current_session()
 
-        # If the ACK does not correspond to a read request
+        # If the ACK does not correspond to a read request, it may belong to a
+        # transfer of the process we replaced.
         if not session:
+            self.server.forward_to_predecessor(
+                self.request[0], self.client_address
+            )
+            return
+        if session.handle is None:
             return
 
+        pacer = session.pacer
+        now = time.time()
+
         # Last packet was received
         if block_id == session.block_id + 1:
+            if pacer is not None:
+                pacer.on_ack(now)
 
             # Final ACK from the client, kill the session
             if session.last_read_is_eof:
-                self._log(
-                    logging.INFO,
-                    'Transfer of %s successful' % session.filename
-                )
+                if self.log_summary:
+                    log_transfer(session, self.client_address,
+                                 self.__class__.__name__, 'complete')
+                else:
+                    self._log(
+                        logging.INFO,
+                        'Transfer of %s successful' % session.filename
+                    )
                 self.cleanup_session()
                 return
 
-            # Next packet
+            # Next packet. The previous blocks won't be retransmitted.
             session.block_id += 1
+            if session.netascii is None:
+                session.release(session.block_id * session.blksize)
+
+        # Second ACK of a block the server retransmitted on timeout
+        elif pacer is not None and pacer.is_stale_ack(block_id):
+            return
+
+        # Unless this is the ACK of an OACK
+        elif session.blocks_sent:
+            session.retransmits += 1
+            if pacer is not None:
+                pacer.on_loss(now)
+                # The packet was already retransmitted on timeout
+                if pacer.recently_retransmitted(now):
+                    return
 
         # Send the next packet, or retransmit the last packet if there was an
         # error
         self.send_data()
 
+    def handle_timer(self):
+        """ The timer of the client's session is due: send the packet delayed
+        by pacing, or retransmit the last packet if it was not acked in time.
+        """
+        session = self.get_current_session()
+        if session is None or session.pacer is None or session.handle is None:
+            return
+
+        now = time.time()
+        action = session.pacer.due(now)
+        if action == Pacer.RTO:
+            if not session.pacer.on_timeout(now):
+                self._log(
+                    logging.WARNING,
+                    'Transfer of %s abandoned after %s retransmissions' % (
+                        session.filename, session.pacer.retries - 1
+                    )
+                )
+                if self.log_summary:
+                    log_transfer(session, self.client_address,
+                                 self.__class__.__name__, 'timeout')
+                self.cleanup_session()
+                return
+            session.retransmits += 1
+            self.send_data()
+        elif action == Pacer.SEND:
+            self.send_data()
+
     def send_oack(self, **options):
         """ Send options acknowledgement.
         """
@@ -246,8 +629,28 @@ class TFTPUDPHandler(SocketServer.BaseRequestHandler):
         """ Send the next data packet to the client.
         """
         session = self.get_current_session()
-        session.handle.seek(session.block_id * session.blksize)
-        data = session.handle.read(session.blksize)
+
+        pacer = session.pacer
+        if pacer is not None:
+            now = time.time()
+            delay = pacer.delay(now)
+            if delay:
+                pacer.set_timer(self.server.timers, self.client_address,
+                                now + delay, Pacer.SEND)
+                return
+
+        offset = session.block_id * session.blksize
+        try:
+            if session.netascii is not None:
+                data = session.netascii.read_block(offset, session.blksize)
+            elif session.readahead is not None:
+                data = session.readahead.read(offset, session.blksize)
+            else:
+                data = session.read_block(offset, session.blksize)
+        except IOError as exc:
+            self._log(logging.ERROR, 'Read error', exc_info=True)
+            self.send_error(self.ERR_UNDEFINED, exc.strerror or str(exc))
+            return
         session.last_read_is_eof = len(data) < session.blksize
 
         try:
@@ -260,10 +663,17 @@ class TFTPUDPHandler(SocketServer.BaseRequestHandler):
             return
 
         packed += data
+        session.blocks_sent += 1
+        session.bytes_sent += len(data)
 
         socket = self.request[1]
         socket.sendto(packed, self.client_address)
 
+        if pacer is not None:
+            pacer.on_send(now, session.block_id)
+            pacer.set_timer(self.server.timers, self.client_address,
+                            now + pacer.rto, Pacer.RTO)
+
     def send_error(self, error_code, error_msg):
         """ Send error packet to the client.
         """
@@ -272,4 +682,9 @@ class TFTPUDPHandler(SocketServer.BaseRequestHandler):
         packed = struct.pack('!HH', self.OP_ERROR, error_code)
         packed += error_msg + '\x00'
         socket.sendto(packed, self.client_address)
+
+        session = self.get_current_session()
+        if session is not None and self.log_summary:
+            log_transfer(session, self.client_address, self.__class__.__name__,
+                         'error')
         self.cleanup_session()
@@ -0,0 +1,57 @@
+from . import TFTPSession
+
+
+class Session(TFTPSession):
+    """ Session reading its file from a backend (see dyntftpd.backends).
+
+    If `backend` is not given, the backend registered as `backend_name` is
+    used.
+    """
+
+    __slots__ = ('backend',)
+
+    backend_name = None
+
+    def __init__(self, tftp_handler, filename, backend=None):
+        """ Raise ValueError if the backend rejects `filename`.
+        """
+        if backend is None:
+            backend = tftp_handler.server.backends.get(self.backend_name)
+        self.backend = backend
+        super(Session, self).__init__(tftp_handler, backend.resolve(filename))
+
+    @property
+    def config_section(self):
+        return self.backend.name
+
+    @property
+    def load_async(self):
+        return self.backend.opens_async(self.filename)
+
+    def load_file(self):
+        return self.backend.open(self.filename, self)
+
+    def unload_file(self):
+        if self.handle is not None:
+            self.handle.close()
+
+    def read_block(self, offset, length):
+        return self.handle.read_block(offset, length)
+
+    def release(self, offset):
+        self.handle.release(offset)
+
+    def get_size(self):
+        return self.handle.size
+
+    def get_version(self):
+        return self.handle.version
+
+    def is_in_memory(self):
+        return getattr(self.handle, 'in_memory', False)
+
+    def negative_cache_key(self):
+        return self.backend.negative_cache_key(self.filename)
+
+    def is_missing_error(self, exc):
+        return self.backend.is_missing_error(exc)
@@ -1,18 +1,15 @@
-import urllib
-
 from . import TFTPUDPHandler
-from .fs import FileSystemHandler, Session as FSSession
-from .http import HTTPHandler, Session as HTTPSession
+from .backend import Session as BackendSession
 
 
 class CleverHandler(TFTPUDPHandler):
+    """ Serves each file from the first backend of server.backends matching
+    the requested filename: HTTP for URLs, the filesystem otherwise by
+    default.
+    """
 
     def make_session(self, filename):
-        maybe_url = urllib.unquote(filename)
-
-        if (
-            maybe_url.startswith('http://') or
-            maybe_url.startswith('https://')
-        ):
-            return HTTPSession(self, filename)
-        return FSSession(self, filename)
+        backend = self.server.backends.match(filename)
+        if backend is None:
+            raise ValueError('No backend for %s' % filename)
+        return BackendSession(self, filename, backend)
@@ -0,0 +1,44 @@
+""" Handoff of the listening socket to a new process, to restart the server
+without dropping transfers in progress.
+
+The old process starts the new one with two inherited file descriptors: the
+listening socket, and one end of a socket pair connected to the old process.
+Once started, the new process sends READY on the socket pair, and the old
+process stops reading the listening socket. The new process serves new
+requests, and forwards to the old process the datagrams of clients it
+doesn't know, so the old process can complete its transfers.
+"""
+import os
+import struct
+
+
+LISTEN_FD_ENV = 'DYNTFTPD_LISTEN_FD'
+PREDECESSOR_FD_ENV = 'DYNTFTPD_PREDECESSOR_FD'
+
+READY = 'READY'
+
+
+def inherited_fds(environ=os.environ):
+    """ Returns the (listening socket fd, predecessor fd) given by the
+    process that started us, or (None, None).
+    """
+    try:
+        return int(environ[LISTEN_FD_ENV]), int(environ[PREDECESSOR_FD_ENV])
+    except (KeyError, ValueError):
+        return None, None
+
+
+def encode(data, client_address):
+    """ Encodes the datagram `data` received from `client_address`, to be
+    forwarded to the predecessor.
+    """
+    ip, port = client_address
+    return struct.pack('!HH', len(ip), port) + ip + data
+
+
+def decode(message):
+    """ Reverse of encode(). Returns (data, client_address).
+    """
+    ip_len, port = struct.unpack('!HH', message[:4])
+    ip = message[4:4 + ip_len]
+    return message[4 + ip_len:], (ip, port)
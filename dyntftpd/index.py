@@ -0,0 +1,236 @@
+import os
+import stat
+import threading
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+class IndexEntry(object):
+    """ What we know about a file of the TFTP root without calling stat().
+    """
+    __slots__ = ('size', 'mtime', 'dev', 'ino')
+
+    def __init__(self, size, mtime, dev, ino):
+        self.size = size
+        self.mtime = mtime
+        self.dev = dev
+        self.ino = ino
+
+    @classmethod
+    def from_stat(cls, st):
+        return cls(st.st_size, st.st_mtime, st.st_dev, st.st_ino)
+
+
+class FileIndex(object):
+    """ In-memory index of the regular files under `root`, keyed by absolute
+    path.
+
+    If pyinotify is installed, the index is updated from inotify events.
+    Otherwise, the whole tree is rescanned in a background thread when the
+    index is older than `poll_interval` seconds, and the new index replaces
+    the old one at the next refresh. Lookups use the old index meanwhile.
+
+    Updates are only applied, and listeners called, by refresh(), which the
+    server calls from its serve loop.
+
+    Only files found under `root` are indexed, so a path missing from the
+    index is either missing or outside of the TFTP root.
+    """
+
+    if pyinotify is not None:
+        WATCH_MASK = (
+            pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+            pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MODIFY |
+            pyinotify.IN_ATTRIB | pyinotify.IN_MOVED_FROM |
+            pyinotify.IN_MOVED_TO
+        )
+
+    def __init__(self, root, poll_interval=1, use_inotify=True):
+        self.root = os.path.abspath(root)
+        self.poll_interval = poll_interval
+        self.entries = {}
+        self.last_scan = None
+        self.listeners = []
+
+        self._lock = threading.Lock()
+        self._rescan_thread = None
+        self._rescanned = None
+        self._notifier = None
+        if use_inotify and pyinotify is not None:
+            watch_manager = pyinotify.WatchManager()
+            self._notifier = pyinotify.Notifier(
+                watch_manager, default_proc_fun=self._process_event, timeout=0
+            )
+            watch_manager.add_watch(
+                self.root, self.WATCH_MASK, rec=True, auto_add=True
+            )
+
+        self.scan()
+
+    @property
+    def uses_inotify(self):
+        return self._notifier is not None
+
+    def add_listener(self, callback):
+        """ `callback(path)` is called each time `path` is added to, updated in
+        or removed from the index.
+        """
+        self.listeners.append(callback)
+
+    def _notify(self, path):
+        for callback in self.listeners:
+            callback(path)
+
+    def scan(self):
+        """ Rebuilds the index from scratch.
+        """
+        started = time.time()
+        self._apply(self._walk(), started)
+
+    def _walk(self):
+        """ Returns the entries of the files under `root`.
+        """
+        entries = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                entry = self._stat(path)
+                if entry:
+                    entries[path] = entry
+        return entries
+
+    def _rescan(self):
+        """ Walks the tree in the rescan thread. The result is applied by the
+        next refresh().
+        """
+        started = time.time()
+        entries = self._walk()
+        with self._lock:
+            self._rescanned = (entries, started)
+            self._rescan_thread = None
+
+    def _apply(self, entries, started):
+        """ Replaces the index with `entries`, walked from `started`, unless
+        a more recent scan has already been applied.
+        """
+        if self.last_scan is not None and started < self.last_scan:
+            return
+        old_entries, self.entries = self.entries, entries
+        self.last_scan = started
+
+        if self.listeners:
+            for path in set(old_entries) | set(entries):
+                old, new = old_entries.get(path), entries.get(path)
+                if (
+                    old is None or new is None or
+                    (old.size, old.mtime, old.ino) !=
+                    (new.size, new.mtime, new.ino)
+                ):
+                    self._notify(path)
+
+    def _stat(self, path):
+        """ Returns an IndexEntry for `path`, or None if `path` is not a
+        readable regular file.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return IndexEntry.from_stat(st)
+
+    def _update(self, path):
+        entry = self._stat(path)
+        if entry:
+            self.entries[path] = entry
+        else:
+            self.entries.pop(path, None)
+        self._notify(path)
+
+    def _remove_tree(self, path):
+        prefix = path + os.sep
+        for indexed in [p for p in self.entries if p.startswith(prefix)]:
+            del self.entries[indexed]
+            self._notify(indexed)
+
+    def _add_tree(self, path):
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                self._update(os.path.join(dirpath, filename))
+
+    def _process_event(self, event):
+        """ Called by pyinotify for each event received.
+        """
+        if event.mask & pyinotify.IN_Q_OVERFLOW:
+            # Events have been lost, nothing better to do than a full rescan.
+            self.scan()
+            return
+
+        path = event.pathname
+        if event.dir:
+            if event.mask & (pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM):
+                self._remove_tree(path)
+            elif event.mask & pyinotify.IN_MOVED_TO:
+                self._add_tree(path)
+            return
+
+        if event.mask & (pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM):
+            if self.entries.pop(path, None) is not None:
+                self._notify(path)
+        else:
+            self._update(path)
+
+    def refresh(self):
+        """ Applies pending inotify events, or the result of the last rescan.
+        Starts a rescan if the index is too old.
+        """
+        with self._lock:
+            if self._notifier is not None:
+                while self._notifier.check_events():
+                    self._notifier.read_events()
+                    self._notifier.process_events()
+                return
+            if self._apply_rescanned() or self._rescan_thread is not None:
+                return
+            if time.time() - self.last_scan >= self.poll_interval:
+                self._rescan_thread = threading.Thread(target=self._rescan)
+                self._rescan_thread.daemon = True
+                self._rescan_thread.start()
+
+    def join(self):
+        """ Blocks until the rescan in progress, if any, is done, and applies
+        it.
+        """
+        thread = self._rescan_thread
+        if thread is not None:
+            thread.join()
+        with self._lock:
+            self._apply_rescanned()
+
+    def _apply_rescanned(self):
+        """ Applies the result of the last rescan, if any, and returns
+        whether there was one. Called with the lock held.
+        """
+        if self._rescanned is None:
+            return False
+        entries, started = self._rescanned
+        self._rescanned = None
+        self._apply(entries, started)
+        return True
+
+    def lookup(self, path):
+        """ Returns the IndexEntry of the absolute path `path`, or None if the
+        file does not exist. Pending updates are only applied by refresh(), so
+        lookups can be done from any thread.
+        """
+        return self.entries.get(path)
+
+    def close(self):
+        if self._notifier is not None:
+            self._notifier.stop()
+            self._notifier = None
@@ -0,0 +1,110 @@
+""" Worker threads loading the files which backends open asynchronously.
+
+Files whose loading may block the serve loop (see Backend.opens_async) are
+loaded by at most `workers` threads, so a burst of requests for slow files
+doesn't start a thread per request. At most `max_pending` loads wait for a
+worker, further requests are refused until the queue drains.
+
+Workers only load files: the callback answering the client is run by the
+serve loop, which is woken up through a socket pair (see LoadPool.fileno),
+so that sessions and timers are only changed by the serve loop.
+"""
+import collections
+import logging
+import Queue
+import socket
+import sys
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class LoadPool(object):
+    """ Worker threads running the loads submitted to the pool. Workers are
+    started on first use.
+    """
+
+    def __init__(self, workers=8, max_pending=1024):
+        self.workers = workers
+        self.queue = Queue.Queue(max_pending)
+        # (callback, result, exc_info) of the loads done
+        self.done = collections.deque()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._wakeup, self._waker = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._waker.setblocking(False)
+
+    def fileno(self):
+        """ Readable when loads are done, to be selected by the serve loop.
+        """
+        return self._wakeup.fileno()
+
+    def submit(self, load, callback):
+        """ Queues the call of `load()` by a worker. Once it returns, the
+        serve loop calls `callback(result, exc_info)`, with exc_info the
+        sys.exc_info() of the exception raised by `load`, or None.
+
+        Returns False if too many loads are pending.
+        """
+        self._start()
+        try:
+            self.queue.put_nowait((load, callback))
+        except Queue.Full:
+            return False
+        return True
+
+    def _start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for _ in xrange(self.workers):
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            load, callback = self.queue.get()
+            try:
+                result, exc_info = load(), None
+            except Exception:
+                result, exc_info = None, sys.exc_info()
+            self.done.append((callback, result, exc_info))
+            try:
+                self._waker.send('\x00')
+            except socket.error:
+                # The socket is full: the serve loop is already woken up
+                pass
+            self.queue.task_done()
+
+    def run_callbacks(self):
+        """ Calls the callbacks of the loads done. Called by the serve loop
+        when the pool is readable.
+        """
+        try:
+            while self._wakeup.recv(4096):
+                pass
+        except socket.error:
+            pass
+        while self.done:
+            callback, result, exc_info = self.done.popleft()
+            try:
+                callback(result, exc_info)
+            except Exception:
+                logger.error('Load error', exc_info=True,
+                             extra={'client_ip': 'server'})
+
+    def join(self):
+        """ Blocks until the queued loads are done. Their callbacks may not
+        have been called yet.
+        """
+        self.queue.join()
+
+    def close(self):
+        self._wakeup.close()
+        self._waker.close()
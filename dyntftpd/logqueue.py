@@ -0,0 +1,98 @@
+""" Logging without blocking the server on slow outputs.
+"""
+import logging
+import Queue
+import threading
+
+
+class QueueHandler(logging.Handler):
+    """ Hands records off to a background thread writing them to `target`, so
+    a stderr or a pipe backing up doesn't stall the server.
+
+    At most `maxsize` records are queued. When the queue is full, records are
+    dropped and counted in `dropped`, and a warning with the number of
+    records dropped is written once the queue is drained. Records below the
+    level of `target` are not queued.
+    """
+
+    def __init__(self, target, maxsize=10000):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.queue = Queue.Queue(maxsize)
+        self.dropped = 0
+        # Dropped records already reported by a warning
+        self.reported = 0
+        self._thread = threading.Thread(target=self._write)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def prepare(self, record):
+        """ Formats the message and the traceback of `record` now, as the
+        objects they reference may change before the record is written.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info
+            )
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        if record.levelno < self.target.level:
+            return
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _write(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if record is None:
+                    return
+                self.target.handle(record)
+                if self.dropped != self.reported and self.queue.empty():
+                    self._report_dropped()
+            finally:
+                self.queue.task_done()
+
+    def _report_dropped(self):
+        """ Writes a warning with the number of records dropped since the
+        last one.
+        """
+        dropped = self.dropped - self.reported
+        if not dropped:
+            return
+        self.reported += dropped
+        self.target.handle(logging.makeLogRecord({
+            'name': __name__, 'levelno': logging.WARNING,
+            'levelname': 'WARNING', 'client_ip': '-',
+            'msg': '%s log records dropped' % dropped,
+        }))
+
+    def flush(self):
+        """ Blocks until the queued records are written.
+        """
+        self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join()
+        self._report_dropped()
+        self.target.close()
+        logging.Handler.close(self)
+
+
+def queue_handlers(logger, maxsize=10000):
+    """ Replaces the handlers of `logger` by QueueHandlers writing to them.
+    """
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        logger.addHandler(QueueHandler(handler, maxsize))
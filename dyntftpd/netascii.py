@@ -0,0 +1,72 @@
+""" Netascii transfer mode (RFC 764, RFC 1350): lines end with CR LF, and a
+CR not followed by LF is followed by NUL.
+"""
+from .backends import BackendFile
+
+
+def encode(data):
+    """ Returns the netascii form of `data`.
+    """
+    return data.replace('\r', '\r\x00').replace('\n', '\r\n')
+
+
+class NetasciiFile(BackendFile):
+    """ Netascii form of a file read with `read_block(offset, length)`,
+    converted as it is read, for files too big to be converted in memory.
+
+    Blocks are expected to be read in order: the block last read is kept for
+    retransmissions, and reading backward converts the file again from its
+    start. `size` is computed with a pass over the file the first time it is
+    needed.
+    """
+    __slots__ = ('read_source', 'in_offset', 'eof', 'buffer',
+                 'buffer_offset', '_size')
+
+    read_size = 65536
+
+    def __init__(self, read_block):
+        self.read_source = read_block
+        self._size = None
+        self._restart()
+
+    def _restart(self):
+        self.in_offset = 0
+        self.eof = False
+        # Converted data, starting at the offset `buffer_offset`
+        self.buffer = ''
+        self.buffer_offset = 0
+
+    @property
+    def size(self):
+        if self._size is None:
+            size = offset = 0
+            while True:
+                chunk = self.read_source(offset, self.read_size)
+                offset += len(chunk)
+                size += len(chunk) + chunk.count('\r') + chunk.count('\n')
+                if len(chunk) < self.read_size:
+                    break
+            self._size = size
+        return self._size
+
+    def _trim(self, offset):
+        """ Drops the converted data before `offset`.
+        """
+        skip = min(offset - self.buffer_offset, len(self.buffer))
+        if skip > 0:
+            self.buffer = self.buffer[skip:]
+            self.buffer_offset += skip
+
+    def read_block(self, offset, length):
+        if offset < self.buffer_offset:
+            self._restart()
+        end = offset + length
+        while self.buffer_offset + len(self.buffer) < end and not self.eof:
+            chunk = self.read_source(self.in_offset, self.read_size)
+            self.in_offset += len(chunk)
+            self.eof = len(chunk) < self.read_size
+            self.buffer += encode(chunk)
+            self._trim(offset)
+        self._trim(offset)
+        start = offset - self.buffer_offset
+        return self.buffer[start:start + length]
@@ -0,0 +1,190 @@
+""" Adaptive pacing of DATA packets.
+
+TFTP is lock-step: the server sends a block when the previous one is acked,
+and only clients retransmit, after a timeout usually counted in seconds. With
+pacing enabled, the server:
+
+- estimates the RTT of each transfer from ACK timing (RFC 6298, ignoring
+  samples of retransmitted blocks), and retransmits a block itself when it
+  is not acked within the retransmission timeout,
+- keeps a minimum interval between two DATA packets of a transfer, adjusted
+  with AIMD: the rate increases additively with each acked block, and is
+  halved, at most once per RTT, when a block is lost (retransmission
+  timeout or duplicate ACK).
+
+When the server retransmits a block on timeout and the client acks both
+copies, the second ACK is ignored: answering it would send the next block
+twice, and every following block after it (sorcerer's apprentice).
+"""
+import heapq
+import threading
+
+
+class PacingPolicy(object):
+    """ Parameters shared by the pacers of a server. Rates are in packets per
+    second, durations in seconds.
+    """
+
+    def __init__(self, rate=1000, min_rate=10, max_rate=100000, increase=20,
+                 decrease=0.5, rto=1, min_rto=0.05, max_rto=5, max_retries=5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.rto = rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.max_retries = max_retries
+
+
+class Pacer(object):
+    """ Pacing state of a transfer.
+
+    The timer of the transfer is due at `deadline`, to send a paced packet
+    (SEND) or to retransmit an unacked packet (RTO).
+    """
+    __slots__ = ('policy', 'rate', 'srtt', 'rttvar', 'rto', 'block',
+                 'sent_at', 'retransmitted_at', 'timed_out', 'next_send',
+                 'last_decrease', 'retries', 'deadline', 'action')
+
+    SEND = 'send'
+    RTO = 'rto'
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.rate = float(policy.rate)
+        self.srtt = None
+        self.rttvar = None
+        self.rto = policy.rto
+        self.block = None
+        self.sent_at = None
+        self.retransmitted_at = None
+        # Id of the last DATA packet retransmitted on timeout
+        self.timed_out = None
+        self.next_send = 0
+        self.last_decrease = 0
+        self.retries = 0
+        self.deadline = None
+        self.action = None
+
+    def delay(self, now):
+        """ Returns the seconds to wait before sending the next packet.
+        """
+        return max(self.next_send - now, 0)
+
+    def on_send(self, now, block):
+        """ Called when `block` is sent.
+        """
+        if block == self.block:
+            self.retransmitted_at = now
+        else:
+            self.block = block
+            self.sent_at = now
+            self.retransmitted_at = None
+            # The duplicate ACK of a block retransmitted on timeout follows
+            # the first one, while the next block is in flight
+            if self.timed_out is not None and block > self.timed_out:
+                self.timed_out = None
+        self.next_send = now + 1. / self.rate
+
+    def on_ack(self, now):
+        """ Called when the last block sent is acked.
+        """
+        self.retries = 0
+        self.deadline = self.action = None
+        if self.retransmitted_at is None:
+            self._sample(now - self.sent_at)
+        self.rate = min(self.rate + self.policy.increase, self.policy.max_rate)
+
+    def _sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(
+            max(self.srtt + 4 * self.rttvar, self.policy.min_rto),
+            self.policy.max_rto
+        )
+
+    def on_loss(self, now):
+        """ Called when a block is lost. The rate is decreased at most once
+        per RTT, as the losses of a round trip come from the same congestion.
+        """
+        if now - self.last_decrease < (self.srtt or 0):
+            return
+        self.last_decrease = now
+        self.rate = max(self.rate * self.policy.decrease, self.policy.min_rate)
+
+    def on_timeout(self, now):
+        """ Called when the last block sent was not acked in time. Returns
+        False if the transfer should be abandoned.
+        """
+        self.retries += 1
+        self.timed_out = self.block + 1
+        self.rto = min(self.rto * 2, self.policy.max_rto)
+        self.on_loss(now)
+        return self.retries <= self.policy.max_retries
+
+    def is_stale_ack(self, block_id):
+        """ Called with the ACKs of blocks already acked. True if `block_id`
+        acks the second copy of a DATA packet the server retransmitted on
+        timeout.
+        """
+        return block_id == self.timed_out
+
+    def recently_retransmitted(self, now):
+        """ True if the last block was retransmitted less than a RTT ago: a
+        duplicate ACK then doesn't call for another retransmission.
+        """
+        return (
+            self.retransmitted_at is not None and self.srtt is not None and
+            now - self.retransmitted_at < self.srtt
+        )
+
+    def set_timer(self, timers, client_address, deadline, action):
+        self.deadline = deadline
+        self.action = action
+        timers.schedule(deadline, client_address)
+
+    def due(self, now):
+        """ Returns the action of the timer if it is due, and clears it.
+        """
+        if self.deadline is None or self.deadline > now:
+            return None
+        action = self.action
+        self.deadline = self.action = None
+        return action
+
+
+class Timers(object):
+    """ Heap of (deadline, client address), run by the serve loop. Timers
+    are not cancelled: the session decides, when its timer runs, if it is
+    still due.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, deadline, client_address):
+        with self._lock:
+            heapq.heappush(self._heap, (deadline, client_address))
+
+    def next_deadline(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """ Returns the client addresses whose timers are due.
+        """
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[1])
+        return due
@@ -0,0 +1,309 @@
+""" Prefetching of the files clients are likely to request next.
+
+Network boot clients request their files in a predictable order: a PXE
+client requests pxelinux.0, then ldlinux.c32, then probes its configuration
+files, then requests a kernel and an initrd. The server learns, for each
+client subnet, how often a file follows another one, and when a file is
+requested, warms the caches with the files which are likely to follow it.
+
+Prefetching never displaces more valuable content: chunks are only added to
+the block cache if it has room for them, backends decide which files are
+worth prefetching (see Backend.prefetch_cost), and at most `budget` bytes are
+prefetched every `interval` seconds.
+"""
+import binascii
+import collections
+import logging
+import Queue
+import socket
+import threading
+import time
+
+from .cache import TTLCache
+from .preload import Preloader
+
+
+logger = logging.getLogger(__name__)
+
+
+def subnet(ip, prefix=24, prefix6=64):
+    """ Returns the subnet of `ip`, as 'address/prefix'.
+    """
+    for family, bits in ((socket.AF_INET, prefix), (socket.AF_INET6, prefix6)):
+        try:
+            packed = socket.inet_pton(family, ip)
+            break
+        except socket.error:
+            continue
+    else:
+        return ip
+
+    size = len(packed) * 8
+    value = int(binascii.hexlify(packed), 16) >> (size - bits) << (size - bits)
+    network = binascii.unhexlify('%0*x' % (len(packed) * 2, value))
+    return '%s/%s' % (socket.inet_ntop(family, network), bits)
+
+
+class TransitionModel(object):
+    """ Counts, for each client subnet, the files requested right after each
+    file by the clients of the subnet, at most `window` seconds later.
+
+    At most `max_subnets` subnets are kept, the least recently active are
+    forgotten first. For each subnet, transitions from at most `max_files`
+    files are counted, to at most `max_successors` files each. Counts are
+    halved when they reach `max_count` for a file, so the model follows the
+    changes of the boot sequences.
+    """
+
+    def __init__(self, prefix=24, prefix6=64, window=60, max_subnets=1024,
+                 max_files=256, max_successors=8, max_count=1000):
+        self.prefix = prefix
+        self.prefix6 = prefix6
+        self.max_subnets = max_subnets
+        self.max_files = max_files
+        self.max_successors = max_successors
+        self.max_count = max_count
+        # Last file requested by each client
+        self.last = TTLCache(maxsize=100000, ttl=window)
+        # subnet -> {filename: {next filename: count}}
+        self.subnets = collections.OrderedDict()
+
+    def subnet(self, ip):
+        return subnet(ip, self.prefix, self.prefix6)
+
+    def observe(self, ip, filename):
+        """ Records that the client `ip` requested `filename`.
+        """
+        previous = self.last.get(ip)
+        self.last.set(ip, filename)
+        # Retransmitted request
+        if previous is None or previous == filename:
+            return
+
+        key = self.subnet(ip)
+        files = self.subnets.pop(key, None)
+        if files is None:
+            files = {}
+        self.subnets[key] = files
+        while len(self.subnets) > self.max_subnets:
+            self.subnets.popitem(last=False)
+
+        successors = files.get(previous)
+        if successors is None:
+            if len(files) >= self.max_files:
+                return
+            successors = files[previous] = {}
+
+        successors[filename] = successors.get(filename, 0) + 1
+        if len(successors) > self.max_successors:
+            rarest = min(
+                (name for name in successors if name != filename),
+                key=successors.get
+            )
+            del successors[rarest]
+        if sum(successors.itervalues()) >= self.max_count:
+            for name, count in successors.items():
+                if count > 1:
+                    successors[name] = count // 2
+                else:
+                    del successors[name]
+
+    def predict(self, key, filename, min_probability=0.5, min_count=2,
+                depth=2):
+        """ Returns the files likely to be requested after `filename` by the
+        clients of the subnet `key`, following the chain of requests up to
+        `depth` files ahead.
+
+        A file is likely if the probability of its chain is at least
+        `min_probability`, each transition being estimated from at least
+        `min_count` observations.
+        """
+        files = self.subnets.get(key)
+        if not files:
+            return []
+
+        predictions = []
+        seen = set([filename])
+        frontier = [(filename, 1.)]
+        for _ in xrange(depth):
+            next_frontier = []
+            for name, probability in frontier:
+                successors = files.get(name)
+                if not successors:
+                    continue
+                total = sum(successors.itervalues())
+                if total < min_count:
+                    continue
+                for successor, count in successors.iteritems():
+                    chain_probability = probability * count / total
+                    if (
+                        chain_probability < min_probability or
+                        successor in seen
+                    ):
+                        continue
+                    seen.add(successor)
+                    predictions.append(successor)
+                    next_frontier.append((successor, chain_probability))
+            frontier = next_frontier
+        return predictions
+
+
+class Prefetcher(object):
+    """ Warms the caches of `server` with the files predicted by a
+    TransitionModel, in a background thread.
+
+    Predicted files wait in a queue of at most `max_pending` files, and are
+    dropped when the queue is full or when `budget` bytes have already been
+    prefetched in the current `interval` seconds. A file prefetched less
+    than `interval` seconds ago is not read again.
+
+    A prefetch is useful if a client of the subnet requests the file less
+    than `window` seconds later. `accuracy` is the ratio of useful
+    prefetches.
+    """
+
+    def __init__(self, server, budget=64 * 1024 * 1024, interval=60,
+                 min_probability=0.5, min_count=2, depth=2, max_pending=64,
+                 prefix=24, prefix6=64, window=60):
+        self.server = server
+        self.budget = budget
+        self.interval = interval
+        self.min_probability = min_probability
+        self.min_count = min_count
+        self.depth = depth
+        self.window = window
+        self.model = TransitionModel(prefix, prefix6, window)
+        self.loader = Preloader(server, [], low_priority=True)
+        self.queue = Queue.Queue(max_pending)
+
+        self.predicted = 0
+        self.prefetched = 0
+        self.useful = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.spent = 0
+        self.budget_start = time.time()
+        # (subnet, filename) prefetched and not requested yet
+        self.outstanding = TTLCache(maxsize=10000, ttl=window)
+        # Files prefetched during the last `interval` seconds
+        self.recent = TTLCache(maxsize=10000, ttl=interval)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _log(self, level, msg, exc_info=False):
+        logger.log(level, msg, extra={'client_ip': 'prefetch'},
+                   exc_info=exc_info)
+
+    @property
+    def accuracy(self):
+        return float(self.useful) / self.prefetched if self.prefetched else 0.
+
+    def status(self):
+        return {
+            'predicted': self.predicted,
+            'prefetched': self.prefetched,
+            'useful': self.useful,
+            'accuracy': self.accuracy,
+            'dropped': self.dropped,
+            'errors': self.loader.errors,
+            'bytes': self.bytes,
+        }
+
+    def on_request(self, ip, filename):
+        """ Called when the client `ip` requests `filename`. Learns from the
+        request, and prefetches the files likely to follow.
+        """
+        key = self.model.subnet(ip)
+        if (key, filename) in self.outstanding:
+            self.outstanding.invalidate((key, filename))
+            with self._lock:
+                self.useful += 1
+
+        self.model.observe(ip, filename)
+        for name in self.model.predict(
+            key, filename, self.min_probability, self.min_count, self.depth
+        ):
+            self.schedule(key, name)
+
+    def schedule(self, key, filename):
+        """ Queues the prefetch of `filename` for the subnet `key`.
+        """
+        if (key, filename) in self.outstanding:
+            return
+        self._start()
+        with self._lock:
+            self.predicted += 1
+        try:
+            self.queue.put_nowait((key, filename))
+        except Queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._work)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            key, filename = self.queue.get()
+            try:
+                self.prefetch(key, filename)
+            except Exception:
+                self._log(logging.ERROR, 'Unable to prefetch %s' % filename,
+                          exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        """ Blocks until the queued files are prefetched.
+        """
+        self.queue.join()
+
+    def prefetch(self, key, filename):
+        """ Warms the caches with `filename`, predicted for the subnet `key`,
+        unless it would exceed the budget.
+        """
+        if filename in self.recent:
+            # Already warmed for another subnet
+            self.outstanding.set((key, filename), True)
+            with self._lock:
+                self.prefetched += 1
+            return
+
+        backend = self.server.backends.match(filename)
+        if backend is None:
+            return
+        try:
+            cost = backend.prefetch_cost(backend.resolve(filename))
+        except (IOError, ValueError):
+            # Missing or invalid file: nothing to prefetch
+            cost = None
+        if cost is None:
+            return
+
+        now = time.time()
+        with self._lock:
+            if now - self.budget_start >= self.interval:
+                self.budget_start = now
+                self.spent = 0
+            if self.spent + cost > self.budget:
+                self.dropped += 1
+                return
+            self.spent += cost
+
+        size = self.loader.warm(filename)
+        if size is None:
+            return
+        self._log(logging.DEBUG, 'Prefetched %s (%s bytes) for %s' % (
+            filename, size, key
+        ))
+        self.recent.set(filename, True)
+        self.outstanding.set((key, filename), True)
+        with self._lock:
+            # The size may differ from the cost, when the cost is unknown
+            self.spent += size - cost
+            self.prefetched += 1
+            self.bytes += size
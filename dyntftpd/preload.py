@@ -0,0 +1,190 @@
+""" Warm the caches of the server before clients request files.
+"""
+import glob
+import logging
+import os
+import Queue
+import threading
+import time
+
+from .backends import CachedFile
+from .compressed import CompressedFile
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_manifest(path):
+    """ Returns the entries of the manifest `path`, one per line: a URL, a
+    path relative to the TFTP root or a glob pattern relative to the TFTP
+    root. Empty lines and lines starting with # are ignored.
+    """
+    entries = []
+    with open(path) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                entries.append(line)
+    return entries
+
+
+class Preloader(object):
+    """ Reads the files of `entries` in the background, with at most
+    `concurrency` files read at the same time, so they are in the server
+    caches when clients request them: downloaded files for the HTTP backend,
+    block cache and page cache for the filesystem backend.
+
+    `ready` is set, and `on_ready(preloader)` is called, once all the files
+    have been read.
+
+    If `low_priority` is True, files are opened with Backend.open_prefetch,
+    chunks are only added to the block cache, and to the cache of
+    decompressed files, if they have room for them, and errors are only
+    logged in verbose mode.
+    """
+
+    chunk_size = 65536
+
+    def __init__(self, server, entries, concurrency=4, on_ready=None,
+                 low_priority=False):
+        self.server = server
+        self.entries = entries
+        self.concurrency = concurrency
+        self.on_ready = on_ready
+        self.low_priority = low_priority
+        self.ready = threading.Event()
+
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def _log(self, level, msg):
+        logger.log(level, msg, extra={'client_ip': 'preload'})
+
+    @property
+    def duration(self):
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    def status(self):
+        return {
+            'ready': self.ready.is_set(),
+            'files': self.files,
+            'bytes': self.bytes,
+            'errors': self.errors,
+            'duration': self.duration,
+        }
+
+    def expand(self):
+        """ Returns the filenames to preload. Entries served by the filesystem
+        backend are expanded as glob patterns.
+        """
+        root = os.path.abspath(self.server.root)
+        fs_backend = self.server.backends.get('fs')
+        filenames = []
+
+        for entry in self.entries:
+            if self.server.backends.match(entry) is not fs_backend:
+                filenames.append(entry)
+                continue
+
+            matches = sorted(
+                os.path.relpath(path, root)
+                for path in glob.glob(os.path.join(root, entry))
+                if os.path.isfile(path)
+            )
+            filenames.extend(matches or [entry])
+        return filenames
+
+    def start(self):
+        """ Starts preloading in background threads.
+        """
+        self.started_at = time.time()
+        queue = Queue.Queue()
+        for filename in self.expand():
+            queue.put(filename)
+
+        workers = [
+            threading.Thread(target=self._work, args=(queue,))
+            for _ in xrange(self.concurrency)
+        ]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        monitor = threading.Thread(target=self._wait_workers, args=(workers,))
+        monitor.daemon = True
+        monitor.start()
+
+    def wait(self, timeout=None):
+        """ Blocks until preloading is done, or until `timeout` seconds have
+        passed. Returns True if preloading is done.
+        """
+        self.ready.wait(timeout)
+        return self.ready.is_set()
+
+    def _work(self, queue):
+        while True:
+            try:
+                filename = queue.get_nowait()
+            except Queue.Empty:
+                return
+            self.warm(filename)
+
+    def _wait_workers(self, workers):
+        for worker in workers:
+            worker.join()
+
+        self.finished_at = time.time()
+        self.ready.set()
+        self._log(
+            logging.INFO,
+            'Preloaded %s files (%s bytes) in %.2f seconds, %s errors' % (
+                self.files, self.bytes, self.duration, self.errors
+            )
+        )
+        if self.on_ready is not None:
+            self.on_ready(self)
+
+    def warm(self, filename):
+        """ Reads `filename` entirely from its backend. Returns its size, or
+        None if it couldn't be read.
+        """
+        backend = self.server.backends.match(filename)
+        try:
+            if backend is None:
+                raise ValueError('No backend for %s' % filename)
+
+            if self.low_priority:
+                handle = backend.open_prefetch(backend.resolve(filename))
+                if isinstance(handle, (CachedFile, CompressedFile)):
+                    handle.low_priority = True
+            else:
+                handle = backend.open(backend.resolve(filename))
+            try:
+                size = 0
+                while True:
+                    data = handle.read_block(size, self.chunk_size)
+                    size += len(data)
+                    if len(data) < self.chunk_size:
+                        break
+            finally:
+                handle.close()
+
+        except (IOError, ValueError) as exc:
+            self._log(
+                logging.DEBUG if self.low_priority else logging.WARNING,
+                'Unable to preload %s: %s' % (filename, exc)
+            )
+            with self._lock:
+                self.errors += 1
+            return None
+
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+        return size
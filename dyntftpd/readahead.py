@@ -0,0 +1,234 @@
+""" Asynchronous read-ahead of the files being transferred.
+
+Without read-ahead, the serve loop reads each block when the previous one
+is acked, so on slow storage (NFS, spinning disks) every block waits for the
+storage. With read-ahead, worker threads read the blocks following the block
+being sent into a buffer of the session, and the serve loop only reads the
+storage itself when a block isn't buffered yet.
+
+The window of a transfer starts at `min_blocks` blocks, doubles every time
+a block is found in the buffer, up to `size` bytes, and is reset when the
+client asks for a block which isn't buffered. Read-ahead stops when the
+session ends, and the buffer of a transfer is released when its client
+didn't ask for a block for `stall` seconds.
+"""
+import logging
+import Queue
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReadAheadPool(object):
+    """ Worker threads filling the buffers of the ReadAhead objects it
+    creates. Workers are started on first use.
+    """
+
+    def __init__(self, size=65536, min_blocks=2, workers=4, stall=2):
+        self.size = size
+        self.min_blocks = min_blocks
+        self.workers = workers
+        self.stall = stall
+        self.queue = Queue.Queue()
+        self.hits = 0
+        self.misses = 0
+        self.last_sweep = 0
+        # ReadAhead objects with buffered blocks
+        self._buffering = set()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def attach(self, read_block, blksize):
+        """ Returns the ReadAhead of a transfer of `blksize` blocks, read with
+        `read_block(offset, length)`, and starts reading its first blocks.
+        """
+        self._start()
+        readahead = ReadAhead(self, read_block, blksize)
+        readahead.schedule()
+        return readahead
+
+    def _start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for _ in xrange(self.workers):
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            readahead = self.queue.get()
+            try:
+                readahead.fill()
+            except Exception:
+                logger.error('Read-ahead error', exc_info=True,
+                             extra={'client_ip': 'server'})
+
+    def buffering(self, readahead, active):
+        with self._lock:
+            if active:
+                self._buffering.add(readahead)
+            else:
+                self._buffering.discard(readahead)
+
+    def sweep(self, now):
+        """ Releases the buffers of stalled transfers. Does nothing if the
+        last sweep was less than `stall` seconds ago.
+        """
+        if now - self.last_sweep < self.stall:
+            return
+        self.last_sweep = now
+        with self._lock:
+            stalled = [
+                readahead for readahead in self._buffering
+                if readahead.stalled(now)
+            ]
+        for readahead in stalled:
+            readahead.release()
+
+
+class ReadAhead(object):
+    """ Read-ahead state of a transfer. Blocks are buffered by offset, from
+    the block last asked by the client, `offset`, to `next_offset`.
+    """
+    __slots__ = ('pool', 'read_block', 'blksize', 'blocks', 'offset',
+                 'next_offset', 'window', 'eof', 'queued', 'cancelled',
+                 'last_read', 'lock', 'io_lock')
+
+    def __init__(self, pool, read_block, blksize):
+        self.pool = pool
+        self.read_block = read_block
+        self.blksize = blksize
+        self.blocks = {}
+        self.offset = 0
+        self.next_offset = 0
+        self.window = min(pool.min_blocks, self.max_blocks)
+        self.eof = False
+        self.queued = False
+        self.cancelled = False
+        self.last_read = time.time()
+        # Protects the buffer, held for short periods by the serve loop
+        self.lock = threading.Lock()
+        # Held while reading the file, which may not support concurrent
+        # reads
+        self.io_lock = threading.Lock()
+
+    @property
+    def max_blocks(self):
+        return max(self.pool.size // self.blksize, 1)
+
+    def _full(self):
+        ahead = self.next_offset - self.offset
+        return ahead >= (self.window + 1) * self.blksize
+
+    def read(self, offset, length):
+        """ Returns `length` bytes starting at `offset`, from the buffer if the
+        block was read ahead.
+        """
+        self.last_read = time.time()
+        data = self._take(offset)
+        if data is not None:
+            self.pool.hits += 1
+        else:
+            with self.io_lock:
+                # The block may have been read while we waited for the lock
+                data = self._take(offset)
+                if data is None:
+                    self.pool.misses += 1
+                    data = self.read_block(offset, length)
+                    with self.lock:
+                        self.blocks.clear()
+                        self.window = min(self.pool.min_blocks,
+                                          self.max_blocks)
+                        self.next_offset = offset + len(data)
+                        self.eof = len(data) < length
+        self.schedule()
+        return data
+
+    def _take(self, offset):
+        """ Returns the buffered block at `offset`, or None. Blocks before
+        `offset` are dropped, the current block is kept for retransmissions.
+        """
+        with self.lock:
+            self.offset = offset
+            for block_offset in self.blocks.keys():
+                if block_offset < offset:
+                    del self.blocks[block_offset]
+            data = self.blocks.get(offset)
+            if data is not None:
+                self.window = min(self.window * 2, self.max_blocks)
+            return data
+
+    def schedule(self):
+        """ Asks a worker to fill the buffer, unless it is full.
+        """
+        with self.lock:
+            if self.queued or self.cancelled or self.eof or self._full():
+                return
+            self.queued = True
+        self.pool.queue.put(self)
+
+    def stalled(self, now):
+        return now - self.last_read > self.pool.stall
+
+    def fill(self):
+        """ Reads blocks until the window is full. Called by the workers.
+        """
+        while True:
+            with self.lock:
+                if (
+                    self.cancelled or self.eof or self._full() or
+                    self.stalled(time.time())
+                ):
+                    self.queued = False
+                    return
+                offset = self.next_offset
+
+            with self.io_lock:
+                if self.cancelled:
+                    continue
+                try:
+                    data = self.read_block(offset, self.blksize)
+                except IOError:
+                    # Reported to the client when the serve loop reads the
+                    # block itself
+                    with self.lock:
+                        self.queued = False
+                        self.eof = True
+                    return
+
+            with self.lock:
+                # Skip the block if the buffer was reset meanwhile
+                if self.cancelled or offset != self.next_offset:
+                    continue
+                self.blocks[offset] = data
+                self.next_offset = offset + len(data)
+                self.eof = len(data) < self.blksize
+            self.pool.buffering(self, True)
+
+    def release(self):
+        """ Drops the buffered blocks. Read-ahead resumes when the client asks
+        for a block.
+        """
+        with self.lock:
+            self.blocks.clear()
+            self.next_offset = self.offset
+            self.window = min(self.pool.min_blocks, self.max_blocks)
+        self.pool.buffering(self, False)
+
+    def cancel(self):
+        """ Stops read-ahead, and waits for the read in progress, if any, so
+        the file can be closed.
+        """
+        with self.lock:
+            self.cancelled = True
+            self.blocks.clear()
+        self.pool.buffering(self, False)
+        with self.io_lock:
+            self.read_block = None
@@ -0,0 +1,418 @@
+""" Replays a trace recorded by the server (see dyntftpd.trace) against a
+server, and reports its throughput, latencies and errors.
+
+Each client address of the trace is replayed from its own socket. Packets
+are sent at their time in the trace, divided by `speed` (0 to send them as
+soon as possible), but a request is only sent once the previous request
+was answered, and an ACK once the packet it acknowledges has been received:
+if the server is slower than the traced server, the transfers are delayed.
+A transfer is given up when the server doesn't answer within `timeout`
+seconds, and clients which abandoned their transfer in the trace abandon it
+in the replay.
+
+Latencies are measured from the RRQ to the first answer of the server, and
+from an ACK to the DATA packet following it.
+
+Usage: dyntftpd-replay TRACE [--speed N] [--server HOST:PORT | --root DIR
+[--handler DOTTED.PATH] [--handler-args JSON]]
+"""
+import argparse
+import errno
+import heapq
+import importlib
+import itertools
+import json
+import select
+import socket
+import struct
+import threading
+import time
+
+from .trace import OP_ACK, OP_RRQ, encode, read_trace
+
+
+OP_DATA = 3
+OP_ERROR = 5
+OP_OACK = 6
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """ Returns {'p50': ..., 'p90': ..., 'p99': ...} of `values`, or None for
+    each point if `values` is empty.
+    """
+    values = sorted(values)
+    result = {}
+    for point in points:
+        result['p%s' % point] = (
+            values[min(len(values) * point // 100, len(values) - 1)]
+            if values else None
+        )
+    return result
+
+
+class ReplayClient(object):
+    """ Replays the `packets` of one client address of the trace, as
+    (seconds, opcode, fields).
+    """
+
+    def __init__(self, replayer, packets):
+        self.replayer = replayer
+        self.packets = packets
+        self.index = 0
+        self.socket = None
+        # State of the current transfer
+        self.active = False
+        self.complete = False
+        self.blksize = 512
+        self.received = set()
+        self.last_sent_at = None
+        self.first_answer = False
+        # When the replayer steps the client next
+        self.wake_at = None
+
+    def due(self, packet):
+        speed = self.replayer.speed
+        if not speed:
+            return self.replayer.started_at
+        return self.replayer.started_at + packet[0] / speed
+
+    def step(self, now):
+        """ Sends the packets which are due. Returns when to step again, or
+        None once the client is done.
+        """
+        replayer = self.replayer
+        while self.index < len(self.packets):
+            packet = self.packets[self.index]
+            seconds, opcode, fields = packet
+            due = self.due(packet)
+            if now < due:
+                return due
+
+            if opcode == OP_RRQ and not self.waiting(opcode, fields):
+                self.start(fields)
+            elif not self.active:
+                # Packets of a transfer which failed or was given up
+                self.index += 1
+                continue
+            elif self.waiting(opcode, fields):
+                deadline = max(due, self.last_sent_at) + replayer.timeout
+                if now < deadline:
+                    return deadline
+                replayer.timeouts += 1
+                self.active = False
+                continue
+
+            self.send(encode(opcode, fields), now)
+            self.index += 1
+
+        # Wait for the answer to the last packet
+        if self.active and not self.complete:
+            deadline = self.last_sent_at + replayer.timeout
+            if now < deadline:
+                return deadline
+        self.close()
+        return None
+
+    def waiting(self, opcode, fields):
+        """ Returns True if the packet can't be sent before an answer of the
+        server: a request waits for the answer to the previous request, and
+        an ACK for the packet it acknowledges.
+        """
+        if not self.active:
+            return False
+        if opcode == OP_RRQ:
+            return not self.first_answer
+        if opcode == OP_ACK and fields:
+            return not self.acknowledges(fields[0])
+        return False
+
+    def acknowledges(self, block_id):
+        """ Returns True if the client received the packet acknowledged by an
+        ACK of `block_id`. ACK 0 acknowledges the OACK, or asks again for the
+        first block if the client didn't receive it in time.
+        """
+        return block_id in self.received or (
+            block_id == 0 and self.first_answer
+        )
+
+    def start(self, fields):
+        self.active = bool(fields)
+        self.complete = False
+        self.blksize = 512
+        self.received = set()
+        self.first_answer = False
+        self.replayer.requests += 1
+        if fields:
+            try:
+                self.blksize = int(fields[2].get('blksize', 512))
+            except ValueError:
+                pass
+
+    def send(self, data, now):
+        if self.socket is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.replayer.register(self)
+        self.socket.sendto(data, self.replayer.server_address)
+        self.last_sent_at = now
+
+    def receive(self, now):
+        """ Handles a packet of the server.
+        """
+        try:
+            data = self.socket.recv(65536)
+        except socket.error as exc:
+            # ICMP port unreachable: the transfer times out
+            if exc.errno != errno.ECONNREFUSED:
+                raise
+            return
+        if len(data) < 2 or not self.active:
+            return
+        replayer = self.replayer
+        opcode, = struct.unpack('!H', data[:2])
+
+        if opcode == OP_ERROR:
+            code = struct.unpack('!H', data[2:4])[0] if len(data) >= 4 else 0
+            replayer.errors[code] = replayer.errors.get(code, 0) + 1
+            self.active = False
+            return
+
+        if opcode == OP_OACK:
+            block_id = 0
+            options = data[2:].split('\x00')
+            for name, value in zip(options[::2], options[1::2]):
+                if name.lower() == 'blksize' and value.isdigit():
+                    self.blksize = int(value)
+        elif opcode == OP_DATA and len(data) >= 4:
+            block_id, = struct.unpack('!H', data[2:4])
+        else:
+            return
+
+        if block_id in self.received:
+            return
+        self.received.add(block_id)
+
+        latency = now - self.last_sent_at
+        if not self.first_answer:
+            self.first_answer = True
+            replayer.first_latencies.append(latency)
+        else:
+            replayer.block_latencies.append(latency)
+
+        if opcode == OP_DATA:
+            replayer.bytes += len(data) - 4
+            if len(data) - 4 < self.blksize:
+                self.complete = True
+                replayer.completed += 1
+
+    def close(self):
+        if self.socket is not None:
+            self.replayer.unregister(self)
+            self.socket.close()
+            self.socket = None
+
+
+class Replayer(object):
+    """ Replays the records of a trace (see dyntftpd.trace.read_trace) against
+    the server listening on `server_address`.
+    """
+
+    def __init__(self, records, server_address, speed=1, timeout=5):
+        self.server_address = server_address
+        self.speed = speed
+        self.timeout = timeout
+
+        clients = {}
+        for seconds, client_address, opcode, fields in records:
+            clients.setdefault(client_address, []).append(
+                (seconds, opcode, fields)
+            )
+        self.clients = [
+            ReplayClient(self, packets) for packets in clients.values()
+        ]
+
+        self.started_at = None
+        self.finished_at = None
+        self.requests = 0
+        self.completed = 0
+        self.bytes = 0
+        self.timeouts = 0
+        self.errors = {}
+        self.first_latencies = []
+        self.block_latencies = []
+        self._poller = select.poll()
+        self._sockets = {}
+
+    def register(self, client):
+        fd = client.socket.fileno()
+        self._sockets[fd] = client
+        self._poller.register(fd, select.POLLIN)
+
+    def unregister(self, client):
+        fd = client.socket.fileno()
+        self._poller.unregister(fd)
+        del self._sockets[fd]
+
+    def run(self):
+        """ Replays the trace. Returns the report of report().
+        """
+        self.started_at = time.time()
+        sequence = itertools.count()
+        # (time to step, sequence, client). Entries whose time isn't the
+        # client's wake_at anymore are outdated and skipped.
+        schedule = []
+
+        def wake(client, at):
+            client.wake_at = at
+            if at is not None:
+                heapq.heappush(schedule, (at, next(sequence), client))
+
+        for client in self.clients:
+            wake(client, self.started_at)
+
+        while schedule:
+            now = time.time()
+            while schedule and (
+                schedule[0][0] <= now or
+                schedule[0][0] != schedule[0][2].wake_at
+            ):
+                at, _, client = heapq.heappop(schedule)
+                if at == client.wake_at:
+                    wake(client, client.step(now))
+            if not schedule:
+                break
+
+            timeout = max(schedule[0][0] - time.time(), 0)
+            for fd, _ in self._poller.poll(timeout * 1000):
+                client = self._sockets.get(fd)
+                if client is None:
+                    continue
+                client.receive(time.time())
+                # The answer may unblock the next packet
+                wake(client, time.time())
+
+        self.finished_at = time.time()
+        return self.report()
+
+    def report(self):
+        duration = (self.finished_at or time.time()) - self.started_at
+        return {
+            'duration': duration,
+            'requests': self.requests,
+            'completed': self.completed,
+            'bytes': self.bytes,
+            'throughput': self.bytes / duration if duration else 0.,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'first_latency': percentiles(self.first_latencies),
+            'block_latency': percentiles(self.block_latencies),
+        }
+
+
+def format_report(report):
+    """ Returns the report of Replayer.run() as text.
+    """
+    def ms(value):
+        return '-' if value is None else '%.2fms' % (value * 1000)
+
+    lines = [
+        '%(requests)s requests, %(completed)s transfers completed in '
+        '%(duration).2fs' % report,
+        '%.1f KB/s (%s bytes)' % (report['throughput'] / 1024,
+                                  report['bytes']),
+    ]
+    for name, label in (('first_latency', 'First answer'),
+                        ('block_latency', 'ACK to DATA')):
+        latency = report[name]
+        lines.append('%s: p50 %s, p90 %s, p99 %s' % (
+            label, ms(latency['p50']), ms(latency['p90']),
+            ms(latency['p99'])
+        ))
+    lines.append('Errors: %s, timeouts: %s' % (
+        ', '.join('%s x%s' % item for item in sorted(report['errors'].items()))
+        or 'none', report['timeouts']
+    ))
+    return '\n'.join(lines)
+
+
+def import_handler(path):
+    """ Returns the handler class at the dotted path `path`, such as
+    dyntftpd.handlers.fs.FileSystemHandler.
+    """
+    module_name, _, name = path.rpartition('.')
+    try:
+        return getattr(importlib.import_module(module_name), name)
+    except (ImportError, AttributeError, ValueError) as exc:
+        raise argparse.ArgumentTypeError(
+            'Invalid handler %s: %s' % (path, exc)
+        )
+
+
+def arguments_parser():
+    parser = argparse.ArgumentParser(
+        description='Replay a trace recorded with dyntftpd --trace'
+    )
+    parser.add_argument('trace')
+    parser.add_argument(
+        '--speed', default=1, type=float,
+        help='Replay speed, 0 to send packets as soon as possible'
+    )
+    parser.add_argument(
+        '--timeout', default=5, type=float,
+        help='Seconds after which a transfer without answer is given up'
+    )
+    parser.add_argument(
+        '--server', metavar='HOST:PORT',
+        help='Server to replay the trace against. By default, a local server '
+             'is started'
+    )
+    parser.add_argument(
+        '--root', default='/var/lib/tftpboot/',
+        help='TFTP root folder of the local server'
+    )
+    parser.add_argument(
+        '--handler', default='dyntftpd.handlers.clever.CleverHandler',
+        type=import_handler, metavar='DOTTED.PATH',
+        help='Handler class of the local server'
+    )
+    parser.add_argument(
+        '--handler-args', default='{}', type=json.loads,
+        help='handler_args of the local server, as JSON'
+    )
+    parser.add_argument(
+        '--json', action='store_true', help='Print the report as JSON'
+    )
+    return parser
+
+
+def main():
+    args = arguments_parser().parse_args()
+    records = read_trace(args.trace)
+
+    server = None
+    if args.server:
+        host, port = args.server.rsplit(':', 1)
+        server_address = (host, int(port))
+    else:
+        from .server import TFTPServer
+
+        server = TFTPServer(host='127.0.0.1', port=0, root=args.root,
+                            handler=args.handler,
+                            handler_args=args.handler_args)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        server_address = server.socket.getsockname()
+
+    try:
+        report = Replayer(
+            records, server_address, speed=args.speed, timeout=args.timeout
+        ).run()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    if args.json:
+        print json.dumps(report, indent=2, sort_keys=True)
+    else:
+        print format_report(report)
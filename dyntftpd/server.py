@@ -1,6 +1,31 @@
+import errno
+import logging
+import os
+import select
+import socket
+import subprocess
+import sys
+import time
+
 import SocketServer
 
+from . import compressed, handoff
+from .backends import BackendRegistry
+from .backends.fs import FileSystemBackend
+from .backends.http import HTTPBackend
+from .cache import BlockCache, TTLCache
+from .fdpool import DescriptorPool
+from .handlers import log_transfer
 from .handlers.clever import CleverHandler
+from .index import FileIndex
+from .pacing import PacingPolicy, Timers
+from .prefetch import Prefetcher
+from .loadpool import LoadPool
+from .readahead import ReadAheadPool
+from .trace import TraceRecorder
+
+
+logger = logging.getLogger(__name__)
 
 
 class TFTPServer(SocketServer.UDPServer):
@@ -8,17 +33,253 @@ class TFTPServer(SocketServer.UDPServer):
 
     Can also provide `handler_args`, a dictionary used by handlers to lookup
     their configuration.
+
+    Files are read from the backends of `self.backends` (see
+    dyntftpd.backends). By default, URLs are served by the HTTP backend and
+    other files from `root`.
+
+    If handler_args['fs']['index'] is true, the files of `root` are indexed in
+    memory (see dyntftpd.index.FileIndex) and requests for missing files are
+    answered without touching the filesystem.
+
+    Files of `root` are read from descriptors shared between sessions, at
+    most handler_args['fs']['max_fds'] are kept open when idle (128 by
+    default, 0 to open a new descriptor for each session).
+
+    If handler_args['block_cache']['size'] is set, up to this many bytes of
+    the files of `root` are cached in memory.
+
+    If handler_args['negative_cache']['ttl'] is set, filesystem and HTTP
+    misses are remembered for this many seconds (see
+    TFTPSession.negative_cache_key).
+
+    Files sent in netascii mode are converted once per version, and at most
+    handler_args['netascii']['cache_size'] converted files, of at most
+    handler_args['netascii']['cache_bytes'] bytes in total, are kept for
+    handler_args['netascii']['ttl'] seconds. Files bigger than
+    handler_args['netascii']['max_memory_size'] are converted as they are
+    sent (see dyntftpd.handlers.TFTPUDPHandler.convert_netascii).
+
+    If handler_args['pacing']['enabled'] is true, DATA packets are paced and
+    retransmitted by the server (see dyntftpd.pacing). The other keys of
+    handler_args['pacing'] are the parameters of PacingPolicy.
+
+    If handler_args['readahead']['size'] is set, blocks of the files being
+    transferred are read ahead by background threads, up to this many bytes
+    per transfer (see dyntftpd.readahead). The other keys of
+    handler_args['readahead'] are the parameters of ReadAheadPool.
+
+    Files which backends open asynchronously are loaded by a pool of
+    handler_args['load_pool']['workers'] threads (see dyntftpd.loadpool). The
+    other keys of handler_args['load_pool'] are the parameters of LoadPool.
+
+    If handler_args['prefetch']['enabled'] is true, the server learns the
+    order in which the clients of each subnet request files, and warms its
+    caches with the files likely to be requested next (see
+    dyntftpd.prefetch). The other keys of handler_args['prefetch'] are the
+    parameters of Prefetcher.
+
+    If handler_args['trace']['path'] is set, the datagrams received are
+    recorded to this file, to be replayed with dyntftpd.replay.
+
+    If handler_args['log']['summary'] is true, one record is logged per
+    transfer (see dyntftpd.handlers.log_transfer). Only one ACK record out of
+    handler_args['log']['ack_sample'] is logged, none if it is 0.
+
+    To restart without dropping transfers (see dyntftpd.handoff), the new
+    server is given `listen_fd`, the listening socket of the old server, and
+    `predecessor_fd`, the socket to forward it unknown clients' datagrams.
     """
 
     timeout = 5
 
+    # Seconds given to transfers in progress to complete after a handoff
+    reload_deadline = 30
+
     def __init__(self, host='', port=69, root='/var/lib/tftpboot',
-                 handler=CleverHandler, handler_args=None):
+                 handler=CleverHandler, handler_args=None, listen_fd=None,
+                 predecessor_fd=None):
 
         self.sessions = {}
         self.root = root
         self.handler_args = handler_args or {}
-        SocketServer.UDPServer.__init__(self, (host, port), handler)
+        self.file_index = self.make_file_index()
+        self.negative_cache = self.make_negative_cache()
+        self.descriptor_pool = self.make_descriptor_pool()
+        self.block_cache = self.make_block_cache()
+        self.netascii_cache = self.make_netascii_cache()
+        self.backends = self.make_backends()
+        self.prefetcher = self.make_prefetcher()
+        self.reload_args = None
+        self.ack_count = 0
+        self.pacing = self.make_pacing()
+        self.timers = Timers()
+        self.readahead = self.make_readahead()
+        self.load_pool = self.make_load_pool()
+        self.last_request = time.time()
+        self.trace = self.make_trace()
+
+        if listen_fd is None:
+            SocketServer.UDPServer.__init__(self, (host, port), handler)
+        else:
+            SocketServer.UDPServer.__init__(self, (host, port), handler,
+                                            bind_and_activate=False)
+            self.socket.close()
+            self.socket = socket.fromfd(
+                listen_fd, self.address_family, self.socket_type
+            )
+            os.close(listen_fd)
+            self.server_address = self.socket.getsockname()
+
+        self.predecessor = None
+        if predecessor_fd is not None:
+            self.predecessor = socket.fromfd(
+                predecessor_fd, socket.AF_UNIX, socket.SOCK_DGRAM
+            )
+            os.close(predecessor_fd)
+
+    def _log(self, level, msg, exc_info=False):
+        logger.log(level, msg, extra={'client_ip': 'server'},
+                   exc_info=exc_info)
+
+    def get_config(self, section, name, default):
+        """ Fetchs handler_args[`section`][`name`], or return `default`.
+        """
+        return self.handler_args.get(section, {}).get(name, default)
+
+    def make_file_index(self):
+        """ Returns the FileIndex of `self.root`, or None if disabled.
+        """
+        if not self.get_config('fs', 'index', False):
+            return None
+        return FileIndex(
+            self.root,
+            poll_interval=self.get_config('fs', 'index_poll_interval', 1)
+        )
+
+    def refresh_file_index(self):
+        """ Applies pending updates to the file index, if any. Only called
+        from the serve loop, so that index listeners don't run concurrently.
+        """
+        if self.file_index is not None:
+            self.file_index.refresh()
+
+    def make_pacing(self):
+        """ Returns the PacingPolicy of the transfers, or None if disabled.
+        """
+        options = dict(self.handler_args.get('pacing', {}))
+        if not options.pop('enabled', False):
+            return None
+        return PacingPolicy(**options)
+
+    def make_prefetcher(self):
+        """ Returns the Prefetcher of the server, or None if disabled.
+        """
+        options = dict(self.handler_args.get('prefetch', {}))
+        if not options.pop('enabled', False):
+            return None
+        return Prefetcher(self, **options)
+
+    def make_trace(self):
+        """ Returns the TraceRecorder of the server, or None if disabled.
+        """
+        path = self.get_config('trace', 'path', None)
+        if not path:
+            return None
+        return TraceRecorder(path)
+
+    def make_readahead(self):
+        """ Returns the ReadAheadPool of the transfers, or None if disabled.
+        """
+        options = dict(self.handler_args.get('readahead', {}))
+        if not options.get('size'):
+            return None
+        return ReadAheadPool(**options)
+
+    def make_load_pool(self):
+        """ Returns the LoadPool of the files opened asynchronously.
+        """
+        return LoadPool(**self.handler_args.get('load_pool', {}))
+
+    def make_netascii_cache(self):
+        """ Returns the cache of files converted for netascii transfers, keyed
+        by file version.
+        """
+        return TTLCache(
+            maxsize=self.get_config('netascii', 'cache_size', 64),
+            ttl=self.get_config('netascii', 'ttl', 300),
+            max_bytes=self.get_config(
+                'netascii', 'cache_bytes', 16 * 1024 * 1024
+            )
+        )
+
+    def make_negative_cache(self):
+        """ Returns the cache of missing files, or None if disabled.
+
+        If the root is indexed, entries are invalidated as soon as the file
+        appears. Otherwise, they expire after `ttl` seconds.
+        """
+        ttl = self.get_config('negative_cache', 'ttl', 0)
+        if not ttl:
+            return None
+        cache = TTLCache(
+            maxsize=self.get_config('negative_cache', 'maxsize', 10000),
+            ttl=ttl
+        )
+        if self.file_index is not None:
+            def invalidate(path):
+                cache.invalidate(('fs', path))
+                # foo is served from foo.gz if it exists
+                uncompressed = compressed.uncompressed_name(path)
+                if uncompressed is not None:
+                    cache.invalidate(('fs', uncompressed))
+            self.file_index.add_listener(invalidate)
+        return cache
+
+    def make_descriptor_pool(self):
+        """ Returns the pool of descriptors of `root`, or None if disabled.
+        """
+        max_fds = self.get_config('fs', 'max_fds', 128)
+        if not max_fds:
+            return None
+        return DescriptorPool(max_fds=max_fds)
+
+    def make_block_cache(self):
+        """ Returns the cache of file blocks, or None if disabled.
+        """
+        size = self.get_config('block_cache', 'size', 0)
+        if not size:
+            return None
+        chunk_size = self.get_config('block_cache', 'chunk_size', 65536)
+        return BlockCache(size, chunk_size=chunk_size)
+
+    def make_backends(self):
+        """ Returns the BackendRegistry of the server.
+        """
+        backends = BackendRegistry(self)
+        backends.register('fs', FileSystemBackend(), r'')
+        backends.register('http', HTTPBackend(), r'https?://')
+        return backends
+
+    def server_close(self):
+        SocketServer.UDPServer.server_close(self)
+        if self.file_index is not None:
+            self.file_index.close()
+        self.backends.close()
+        if self.descriptor_pool is not None:
+            self.descriptor_pool.close()
+        if self.predecessor is not None:
+            self.predecessor.close()
+        if self.trace is not None:
+            self.trace.close()
+        self.load_pool.close()
+
+    def verify_request(self, request, client_address):
+        """ Records the datagram in the trace, if enabled.
+        """
+        if self.trace is not None:
+            self.trace.record(request[0], client_address)
+        return True
 
     def serve_forever(self):
         """ The base method BaseServer.serve_forever doesn't handle timeouts. I
@@ -26,13 +287,60 @@ class TFTPServer(SocketServer.UDPServer):
         more or less a copy/paste of the base class.
         """
         self._BaseServer__is_shut_down.clear()
+        if self.predecessor is not None:
+            self.forward_to_predecessor(handoff.READY)
         try:
             while not self._BaseServer__shutdown_request:
                 self.handle_request()
+                if self.reload_args is not None:
+                    args, self.reload_args = self.reload_args, None
+                    if self.handoff(args):
+                        break
         finally:
             self._BaseServer__shutdown_request = False
         self._BaseServer__is_shut_down.set()
 
+    def _select(self, sockets, timeout):
+        """ Waits at most `timeout` seconds, or until the next timer is due,
+        for one of `sockets` to be readable. Returns the readable sockets.
+        """
+        deadline = self.timers.next_deadline()
+        if deadline is not None:
+            timeout = max(min(timeout, deadline - time.time()), 0)
+        try:
+            return select.select(sockets, [], [], timeout)[0]
+        except select.error as exc:
+            if exc.args[0] != errno.EINTR:
+                raise
+            return []
+
+    def handle_request(self):
+        """ Handles one datagram, the files loaded asynchronously, then the
+        timers which are due. Calls handle_timeout if no datagram was received
+        for `timeout` seconds.
+        """
+        readable = self._select([self, self.load_pool], self.timeout)
+        if readable:
+            self.last_request = time.time()
+        if self.load_pool in readable:
+            self.load_pool.run_callbacks()
+        if self in readable:
+            self._handle_request_noblock()
+        elif time.time() - self.last_request >= self.timeout:
+            self.handle_timeout()
+            self.last_request = time.time()
+        self.run_timers()
+
+    def run_timers(self):
+        """ Lets the handler process the sessions whose timer is due, and
+        releases the read-ahead buffers of stalled transfers.
+        """
+        now = time.time()
+        for client_address in self.timers.pop_due(now):
+            self.process_datagram(None, client_address)
+        if self.readahead is not None:
+            self.readahead.sweep(now)
+
     def handle_timeout(self):
         """ Called when the server didn't have a request for the last `timeout`
         seconds. If `self.seessions` isn't empty, it means clients asked for
@@ -40,5 +348,129 @@ class TFTPServer(SocketServer.UDPServer):
         let's free the resources.
         """
         for client_address, session in self.sessions.items():
-            session.unload_file()
+            if session.loading:
+                continue
+            if self.get_config('log', 'summary', False):
+                log_transfer(session, client_address,
+                             self.RequestHandlerClass.__name__, 'timeout')
+            session.close()
             del self.sessions[client_address]
+
+    def request_reload(self, args=None):
+        """ Asks the server to hand off its socket to a new process running
+        `args` (by default, the command line of the current process). Can be
+        called from a signal handler.
+        """
+        self.reload_args = args or [sys.executable] + sys.argv
+
+    def spawn_successor(self, args, env):
+        """ Starts the process replacing this server. Returns an object with
+        the poll() and terminate() methods of subprocess.Popen.
+        """
+        return subprocess.Popen(args, env=env, close_fds=False)
+
+    def handoff(self, args):
+        """ Starts `args` in a new process inheriting the listening socket.
+
+        Once the new process is ready, stop reading the listening socket, and
+        serve the datagrams the new process forwards until the transfers in
+        progress are complete, or until `reload_deadline` seconds have
+        passed.
+
+        Returns False, and keeps serving, if the new process failed to start
+        before the deadline.
+        """
+        channel, successor_end = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_DGRAM
+        )
+        env = dict(os.environ)
+        env[handoff.LISTEN_FD_ENV] = str(self.socket.fileno())
+        env[handoff.PREDECESSOR_FD_ENV] = str(successor_end.fileno())
+
+        self._log(logging.INFO, 'Reloading: starting %s' % ' '.join(args))
+        try:
+            successor = self.spawn_successor(args, env)
+        finally:
+            successor_end.close()
+
+        deadline = time.time() + self.reload_deadline
+        ready = False
+        try:
+            while time.time() < deadline:
+                if ready and not self.sessions:
+                    break
+                if not ready and successor.poll() is not None:
+                    break
+
+                readable = self._select(
+                    [channel, self.load_pool] if ready
+                    else [channel, self.load_pool, self.socket],
+                    min(self.timeout, max(deadline - time.time(), 0))
+                )
+                if self.load_pool in readable:
+                    self.load_pool.run_callbacks()
+
+                if readable:
+                    self.last_request = time.time()
+                elif time.time() - self.last_request >= self.timeout:
+                    self.handle_timeout()
+                    self.last_request = time.time()
+
+                if channel in readable:
+                    message = channel.recv(65536)
+                    if message == handoff.READY:
+                        ready = True
+                        self._log(logging.INFO, 'New process is ready')
+                    else:
+                        self.process_datagram(*handoff.decode(message))
+
+                if self.socket in readable and not ready:
+                    self._handle_request_noblock()
+
+                self.run_timers()
+        finally:
+            channel.close()
+
+        if not ready:
+            self._log(logging.ERROR,
+                      'New process failed to start, reload aborted')
+            if successor.poll() is None:
+                successor.terminate()
+            return False
+
+        if self.sessions:
+            self._log(logging.WARNING,
+                      'Reload deadline reached, dropping %s transfers' %
+                      len(self.sessions))
+        for client_address, session in self.sessions.items():
+            session.close()
+            del self.sessions[client_address]
+        return True
+
+    def process_datagram(self, data, client_address):
+        """ Handles `data` as a datagram received from `client_address`: a
+        datagram forwarded by the process which replaced this server, or None
+        when the timer of the client's session is due.
+        """
+        request = (data, self.socket)
+        try:
+            self.process_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+
+    def forward_to_predecessor(self, data, client_address=None):
+        """ Sends `data`, received from `client_address`, to the process this
+        server replaced. Returns False if there is no such process.
+        """
+        if self.predecessor is None:
+            return False
+        if client_address is not None:
+            data = handoff.encode(data, client_address)
+        try:
+            self.predecessor.send(data)
+        except socket.error:
+            # The predecessor exited
+            self.predecessor.close()
+            self.predecessor = None
+            return False
+        return True
@@ -0,0 +1,161 @@
+""" Traces of the datagrams received by the server, to replay real workloads
+(see dyntftpd.replay).
+
+A trace is a text file: a JSON header, then one JSON array per datagram,
+[seconds since the start of the trace, client ip, client port, opcode,
+fields...]. The fields are the filename, the mode and the options for a
+read request, the block id for an ACK, and the error code for an ERROR.
+Strings are decoded as latin-1, so filenames of any encoding are kept.
+
+Recorders append to the trace: after a SIGHUP (see dyntftpd.handoff), the
+new server records after the old server, which may still be recording its
+last transfers. Each batch of records is written after a copy of the header
+of its recorder, and read_trace merges these segments.
+"""
+import json
+import struct
+import threading
+import time
+
+
+VERSION = 1
+
+OP_RRQ = 1
+OP_ACK = 4
+OP_ERROR = 5
+
+
+def parse(data):
+    """ Returns the opcode and the fields of the datagram `data`. Fields of
+    malformed datagrams are not parsed.
+    """
+    if len(data) < 2:
+        return None, []
+    opcode, = struct.unpack('!H', data[:2])
+
+    if opcode == OP_RRQ:
+        args = data[2:].split('\x00')
+        if len(args) < 3 or args[-1] != '' or len(args) % 2 == 0:
+            return opcode, []
+        options = args[2:-1]
+        return opcode, [
+            args[0], args[1],
+            dict(options[i:i + 2] for i in xrange(0, len(options), 2))
+        ]
+
+    if opcode in (OP_ACK, OP_ERROR) and len(data) >= 4:
+        return opcode, [struct.unpack('!H', data[2:4])[0]]
+
+    return opcode, []
+
+
+def encode(opcode, fields):
+    """ Returns the datagram of a record, reverse of parse().
+    """
+    if opcode is None:
+        return ''
+    if opcode == OP_RRQ and fields:
+        filename, mode, options = fields
+        return struct.pack('!H', opcode) + ''.join(
+            '%s\x00' % value for value in [filename, mode] + [
+                item for option in sorted(options.items()) for item in option
+            ]
+        )
+    if opcode == OP_ACK and fields:
+        return struct.pack('!HH', opcode, fields[0])
+    if opcode == OP_ERROR and fields:
+        return struct.pack('!HH', opcode, fields[0]) + '\x00'
+    return struct.pack('!H', opcode)
+
+
+class TraceRecorder(object):
+    """ Records the datagrams received by the server at the end of the file
+    `path`. Records are buffered, and written with their header every
+    `flush_interval` seconds in a single write, so that batches of two
+    servers appending to the same trace don't interleave.
+    """
+
+    flush_interval = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.started_at = self.last_flush = time.time()
+        self.records = 0
+        self._file = open(path, 'a', 0)
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._header = json.dumps({
+            'version': VERSION, 'start': self.started_at
+        }) + '\n'
+        self._file.write(self._header)
+
+    def record(self, data, client_address):
+        now = time.time()
+        opcode, fields = parse(data)
+        line = json.dumps(
+            [round(now - self.started_at, 6),
+             client_address[0], client_address[1], opcode] + fields,
+            separators=(',', ':'), encoding='latin-1'
+        )
+        with self._lock:
+            if self._file is None:
+                return
+            self._buffer.append(line + '\n')
+            self.records += 1
+            if now - self.last_flush >= self.flush_interval:
+                self._flush()
+                self.last_flush = now
+
+    def _flush(self):
+        if self._buffer:
+            self._file.write(self._header + ''.join(self._buffer))
+            self._buffer = []
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._flush()
+                self._file.close()
+                self._file = None
+
+
+def read_trace(path):
+    """ Returns the records of the trace `path`, as tuples (seconds, (ip,
+    port), opcode, fields), ordered by time. Seconds are counted from the
+    start of the first segment of the trace.
+    """
+    records = []
+    start = offset = None
+    with open(path) as trace:
+        for line in trace:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict) or start is None:
+                # Header of a segment
+                header = record if isinstance(record, dict) else {}
+                if header.get('version') != VERSION:
+                    raise ValueError('Unsupported trace version: %s' %
+                                     header.get('version'))
+                if start is None:
+                    start = header['start']
+                offset = header['start'] - start
+                continue
+            fields = [
+                field.encode('latin-1') if isinstance(field, unicode)
+                else field
+                for field in record[4:]
+            ]
+            if record[3] == OP_RRQ and fields:
+                fields[2] = dict(
+                    (key.encode('latin-1'), value.encode('latin-1'))
+                    for key, value in fields[2].items()
+                )
+            records.append(
+                (round(record[0] + offset, 6),
+                 (record[1].encode('latin-1'), record[2]), record[3], fields)
+            )
+    if start is None:
+        raise ValueError('Unsupported trace version: None')
+    records.sort(key=lambda record: record[0])
+    return records
@@ -62,7 +62,8 @@ setup(
     ],
     entry_points={
         'console_scripts': [
-            'dyntftpd = dyntftpd.cli:main'
+            'dyntftpd = dyntftpd.cli:main',
+            'dyntftpd-replay = dyntftpd.replay:main',
         ]
     }
 )
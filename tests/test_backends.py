@@ -0,0 +1,172 @@
+import shutil
+import tempfile
+
+from httmock import HTTMock
+
+from dyntftpd.backends.dynamic import DynamicBackend, Template
+from dyntftpd.backends.memory import MemoryBackend
+from dyntftpd.backends.objectstore import ObjectStoreBackend
+from dyntftpd.handlers.clever import CleverHandler
+
+from . import TFTPServerTestCase
+
+
+class DictObjectStore(object):
+    """ Local stand-in for an object store client.
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.requests = []
+
+    def head(self, key):
+        return len(self.objects[key])
+
+    def get_range(self, key, offset, length):
+        self.requests.append((key, offset, length))
+        return self.objects[key][offset:offset + length]
+
+
+def get_big_file(url, request):
+    return 'A' * 512 + 'B' * 10
+
+
+class TestBackends(TFTPServerTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        super(TestBackends, self).setUp(
+            handler=CleverHandler, handler_args={
+                'http': {'cache_dir': self.cache_dir}
+            })
+        self.store = DictObjectStore({'images/vmlinuz': 'K' * 600})
+        self.server.backends.register(
+            'images', ObjectStoreBackend(self.store), r'images/'
+        )
+        self.server.backends.register(
+            'memory', MemoryBackend({'ipxe/boot.ipxe': '#!ipxe'}), r'ipxe/'
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        super(TestBackends, self).tearDown()
+
+    def test_memory(self):
+        self.get_file('ipxe/boot.ipxe', options={'tsize': 0})
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x06tsize\x006\x00')
+        self.ack_n(0)
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01#!ipxe')
+        self.ack_n(1)
+
+        self.get_file('ipxe/missing')
+        data, _ = self.recv()
+        self.assertTrue(data.startswith('\x00\x05\x00\x01'))
+
+    def test_object_store(self):
+        self.get_file('images/vmlinuz')
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01' + 'K' * 512)
+        self.ack_n(1)
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x02' + 'K' * 88)
+        self.ack_n(2)
+        self.assertEqual(self.store.requests, [
+            ('images/vmlinuz', 0, 512), ('images/vmlinuz', 512, 512)
+        ])
+
+        self.get_file('images/missing')
+        data, _ = self.recv()
+        self.assertTrue(data.startswith('\x00\x05\x00\x01'))
+
+    def test_http_stream(self):
+        self.server.handler_args['http']['stream'] = True
+        with HTTMock(get_big_file):
+            self.get_file('http://www.download.tld/superfile')
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x01' + 'A' * 512)
+            handle = self.server.sessions[
+                ('127.0.0.1', self.client_socket.getsockname()[1])
+            ].handle
+            self.ack_n(1)
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x02' + 'B' * 10)
+            # Acked blocks are dropped, the last block is kept
+            self.assertEqual(handle.buffer_offset, 512)
+            self.assertEqual(handle.buffer, 'B' * 10)
+            self.assertRaises(IOError, handle.read_block, 0, 512)
+            self.assertEqual(handle.read_block(512, 512), 'B' * 10)
+            self.ack_n(2)
+
+    def test_http_async(self):
+        self.server.handler_args['http']['async'] = True
+        with HTTMock(get_big_file):
+            self.get_file('http://www.download.tld/superfile',
+                          options={'tsize': 0})
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x06tsize\x00522\x00')
+            self.ack_n(0)
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x01' + 'A' * 512)
+            self.ack_n(1)
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x02' + 'B' * 10)
+            self.ack_n(2)
+
+    def test_http_async_missing(self):
+        self.server.handler_args['http']['async'] = True
+        with HTTMock(lambda url, request: {'status_code': 404}):
+            self.get_file('http://www.download.tld/missing')
+            data, _ = self.recv()
+            self.assertTrue(data.startswith('\x00\x05\x00\x02'))
+
+
+class TestDynamicBackend(TFTPServerTestCase):
+
+    def setUp(self):
+        super(TestDynamicBackend, self).setUp(handler=CleverHandler)
+        self.calls = 0
+        self.dynamic = DynamicBackend()
+        self.dynamic.route(
+            r'pxelinux.cfg/01-(?P<mac>[0-9a-f-]+)$', self.pxe_config,
+            key=lambda match, session: match.group('mac')
+        )
+        self.dynamic.route(r'client-ip$', self.client_ip)
+        self.server.backends.register('dynamic', self.dynamic, r'')
+
+    def pxe_config(self, match, session):
+        self.calls += 1
+        if match.group('mac') == '00-00-00-00-00-00':
+            return None
+        return Template('DEFAULT $mac', mac=match.group('mac'))
+
+    def client_ip(self, match, session):
+        return iter(['ip=', session.client_address[0]])
+
+    def test_template(self):
+        for _ in range(2):
+            self.get_file('pxelinux.cfg/01-aa-bb-cc-dd-ee-ff',
+                          options={'tsize': 0})
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x06tsize\x0025\x00')
+            self.ack_n(0)
+            data, _ = self.recv()
+            self.assertEqual(
+                data, '\x00\x03\x00\x01DEFAULT aa-bb-cc-dd-ee-ff'
+            )
+            self.ack_n(1)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.dynamic.cache.hits, 1)
+
+    def test_iterator(self):
+        self.get_file('client-ip')
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01ip=127.0.0.1')
+        self.ack_n(1)
+
+    def test_missing(self):
+        for filename in ('pxelinux.cfg/01-00-00-00-00-00-00', 'unknown'):
+            self.get_file(filename)
+            data, _ = self.recv()
+            self.assertTrue(data.startswith('\x00\x05\x00\x01'))
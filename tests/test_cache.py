@@ -0,0 +1,96 @@
+import time
+import unittest
+
+from dyntftpd.cache import BlockCache, TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        self.assertIsNone(cache.get('key'))
+        cache.set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertIn('key', cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.hit_rate, 0.5)
+
+        cache.invalidate('key')
+        self.assertIsNone(cache.get('key'))
+
+    def test_expiration(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set('key', 'value', ttl=-1)
+        self.assertNotIn('key', cache)
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(len(cache), 0)
+
+    def test_maxsize(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_max_bytes(self):
+        cache = TTLCache(maxsize=10, ttl=60, max_bytes=10)
+        cache.set('a', 'a' * 4)
+        cache.set('b', 'b' * 4)
+        cache.set('c', 'c' * 4)
+        self.assertEqual(cache.size, 8)
+        self.assertIsNone(cache.get('a'))
+        cache.set('big', 'x' * 11)
+        self.assertIsNone(cache.get('big'))
+        cache.invalidate('b')
+        self.assertEqual(cache.size, 4)
+
+    def test_sizeof(self):
+        cache = TTLCache(maxsize=10, ttl=60, max_bytes=10, sizeof=sum)
+        cache.set('a', [3, 3])
+        cache.set('b', [2, 2])
+        self.assertEqual(cache.size, 10)
+        cache.set('c', [1])
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 5)
+
+
+class TestBlockCache(unittest.TestCase):
+
+    def test_read(self):
+        content = 'abcdefghij'
+        reads = []
+
+        def read_chunk(offset, length):
+            reads.append(offset)
+            return content[offset:offset + length]
+
+        cache = BlockCache(max_bytes=100, chunk_size=4)
+        self.assertEqual(cache.read('key', 2, 5, read_chunk), 'cdefg')
+        self.assertEqual(reads, [0, 4])
+        self.assertEqual(cache.read('key', 6, 10, read_chunk), 'ghij')
+        self.assertEqual(reads, [0, 4, 8])
+        self.assertEqual(cache.read('key', 0, 10, read_chunk), content)
+        self.assertEqual(reads, [0, 4, 8])
+        self.assertEqual(cache.size, 10)
+
+    def test_max_bytes(self):
+        cache = BlockCache(max_bytes=8, chunk_size=4)
+        cache.put('a', 0, 'aaaa')
+        cache.put('b', 0, 'bbbb')
+        cache.get('a', 0)
+        cache.put('c', 0, 'cccc')
+        self.assertIsNone(cache.get('b', 0))
+        self.assertEqual(cache.get('a', 0), 'aaaa')
+        self.assertEqual(cache.size, 8)
+
+    def test_low_priority(self):
+        cache = BlockCache(max_bytes=8, chunk_size=4)
+        cache.put('a', 0, 'aaaa', low_priority=True)
+        cache.put('b', 0, 'bbbb')
+        # No room left, nothing is evicted
+        cache.put('c', 0, 'cccc', low_priority=True)
+        self.assertIsNone(cache.get('c', 0))
+        self.assertEqual(cache.get('a', 0), 'aaaa')
+        self.assertEqual(cache.get('b', 0), 'bbbb')
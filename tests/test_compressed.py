@@ -0,0 +1,166 @@
+import gzip
+import random
+import StringIO
+import unittest
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from dyntftpd.backends.memory import MemoryFile
+from dyntftpd.cache import BlockCache
+from dyntftpd.compressed import (
+    CHECKPOINT_SIZE, DECOMPRESSOR_SIZE, CompressedFile, GzipIndex, ZstdIndex
+)
+
+
+def gzip_compress(data):
+    out = StringIO.StringIO()
+    with gzip.GzipFile(fileobj=out, mode='w') as handle:
+        handle.write(data)
+    return out.getvalue()
+
+
+def make_data(size):
+    """ Returns `size` bytes of compressible data.
+    """
+    rand = random.Random(42)
+    words = ['kernel ', 'initrd ', 'boot ', 'append ', '\n']
+    data = []
+    length = 0
+    while length < size:
+        word = rand.choice(words) + str(rand.randint(0, 1 << 20))
+        data.append(word)
+        length += len(word)
+    return ''.join(data)[:size]
+
+
+class CountingFile(MemoryFile):
+    """ MemoryFile counting the bytes read.
+    """
+    __slots__ = ('bytes_read',)
+
+    def __init__(self, data, version=None):
+        super(CountingFile, self).__init__(data, version)
+        self.bytes_read = 0
+
+    def read_block(self, offset, length):
+        data = super(CountingFile, self).read_block(offset, length)
+        self.bytes_read += len(data)
+        return data
+
+
+class TestGzipIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.data = make_data(300000)
+
+    def check_reads(self, index, compressed):
+        self.assertEqual(index.size, len(self.data))
+        rand = random.Random(0)
+        for _ in xrange(50):
+            offset = rand.randint(0, len(self.data))
+            length = rand.randint(0, 5000)
+            self.assertEqual(
+                index.read(compressed, offset, length),
+                self.data[offset:offset + length]
+            )
+        self.assertEqual(index.read(compressed, len(self.data), 512), '')
+
+    def test_read(self):
+        compressed = MemoryFile(gzip_compress(self.data))
+        index = GzipIndex(compressed, span=10000)
+        self.assertEqual(
+            index.offsets, range(0, len(self.data) + 1, 10000)
+        )
+        self.check_reads(index, compressed)
+        # 31 checkpoints, 30 with a decompressor state
+        self.assertEqual(index.memory_size,
+                         31 * CHECKPOINT_SIZE + 30 * DECOMPRESSOR_SIZE)
+
+    def test_multiple_members(self):
+        compressed = MemoryFile(
+            gzip_compress(self.data[:100000]) +
+            gzip_compress(self.data[100000:])
+        )
+        index = GzipIndex(compressed, span=30000)
+        self.check_reads(index, compressed)
+
+    def test_invalid(self):
+        with self.assertRaises(IOError):
+            GzipIndex(MemoryFile('not gzipped'), span=1000)
+
+    def test_cached(self):
+        compressed = MemoryFile(gzip_compress(self.data), 'v1')
+        cache = BlockCache(100000, chunk_size=10000)
+        handle = CompressedFile(
+            compressed, GzipIndex(compressed, 10000), cache
+        )
+
+        self.assertEqual(handle.size, len(self.data))
+        self.assertEqual(handle.read_block(15000, 512),
+                         self.data[15000:15512])
+        self.assertEqual(handle.read_block(15512, 512),
+                         self.data[15512:16024])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_low_priority(self):
+        compressed = MemoryFile(gzip_compress(self.data), 'v1')
+        cache = BlockCache(20000, chunk_size=10000)
+        cache.put('other', 0, 'x' * 15000)
+        handle = CompressedFile(
+            compressed, GzipIndex(compressed, 10000), cache
+        )
+        handle.low_priority = True
+
+        self.assertEqual(handle.read_block(0, 512), self.data[:512])
+        self.assertEqual(cache.get('other', 0), 'x' * 15000)
+        self.assertIsNone(cache.get('v1', 0))
+
+    def test_sequential(self):
+        """ Sequential reads continue from the previous read instead of the
+        previous checkpoint.
+        """
+        compressed = CountingFile(gzip_compress(self.data), 'v1')
+        index = GzipIndex(compressed, span=len(self.data))
+        compressed.bytes_read = 0
+        handle = CompressedFile(
+            compressed, index, BlockCache(100000, chunk_size=5000)
+        )
+        for offset in xrange(0, len(self.data), 512):
+            self.assertEqual(handle.read_block(offset, 512),
+                             self.data[offset:offset + 512])
+        self.assertLessEqual(compressed.bytes_read, compressed.size + 65536)
+
+        # Reading backward restarts from the checkpoint
+        self.assertEqual(handle.read_block(0, 512), self.data[:512])
+        self.assertEqual(handle.read_block(100000, 512),
+                         self.data[100000:100512])
+
+
+@unittest.skipIf(zstandard is None, 'zstandard is not installed')
+class TestZstdIndex(unittest.TestCase):
+
+    def test_read(self):
+        data = make_data(200000)
+        compressor = zstandard.ZstdCompressor(write_checksum=True)
+        # Frames of 30000 bytes, and a skippable frame
+        compressed = MemoryFile(
+            ''.join(
+                compressor.compress(data[offset:offset + 30000])
+                for offset in xrange(0, len(data), 30000)
+            ) + '\x50\x2a\x4d\x18\x02\x00\x00\x00xx'
+        )
+        index = ZstdIndex(compressed)
+
+        self.assertEqual(index.size, len(data))
+        self.assertEqual(index.offsets, range(0, len(data), 30000))
+        rand = random.Random(0)
+        for _ in xrange(50):
+            offset = rand.randint(0, len(data))
+            length = rand.randint(0, 70000)
+            self.assertEqual(
+                index.read(compressed, offset, length),
+                data[offset:offset + length]
+            )
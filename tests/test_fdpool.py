@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from dyntftpd.fdpool import DescriptorPool
+
+
+class TestDescriptorPool(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.pool = DescriptorPool(max_fds=2)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.root)
+
+    def write(self, name, content):
+        path = os.path.join(self.root, name)
+        with open(path, 'w') as handle:
+            handle.write(content)
+        return path
+
+    def test_shared_descriptor(self):
+        path = self.write('pxelinux.0', 'abcdef')
+
+        first = self.pool.acquire(path)
+        second = self.pool.acquire(path)
+        self.assertEqual(first.fileno(), second.fileno())
+        self.assertEqual((self.pool.opens, self.pool.reuses), (1, 1))
+
+        # Positions are not shared
+        first.seek(2)
+        self.assertEqual(first.read(2), 'cd')
+        self.assertEqual(second.read(3), 'abc')
+        self.assertEqual(first.read(), 'ef')
+        second.seek(0, os.SEEK_END)
+        self.assertEqual(second.tell(), 6)
+
+        first.close()
+        second.close()
+        # Idle descriptor is kept open
+        self.assertEqual(len(self.pool), 1)
+        self.pool.acquire(path).close()
+        self.assertEqual(self.pool.opens, 1)
+
+    def test_replaced_file(self):
+        path = self.write('pxelinux.0', 'old')
+        handle = self.pool.acquire(path)
+
+        tmp = self.write('tmp', 'new')
+        os.rename(tmp, path)
+
+        self.assertEqual(self.pool.acquire(path).read(), 'new')
+        self.assertEqual(handle.read(), 'old')
+
+    def test_lru(self):
+        paths = [self.write(str(i), str(i)) for i in range(3)]
+        handles = [self.pool.acquire(path) for path in paths]
+        # All descriptors are in use
+        self.assertEqual(len(self.pool), 3)
+
+        for handle in handles:
+            handle.close()
+        self.assertEqual(len(self.pool), 2)
+        self.assertEqual(self.pool.acquire(paths[0]).read(), '0')
+        self.assertEqual(self.pool.opens, 4)
+
+    def test_missing(self):
+        with self.assertRaises(IOError):
+            self.pool.acquire(os.path.join(self.root, 'missing'))
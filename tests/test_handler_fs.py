@@ -1,5 +1,9 @@
+import gzip
+import logging
 import os
+import shutil
 import struct
+import tempfile
 
 from dyntftpd.handlers import TFTPUDPHandler, TFTPSession
 
@@ -31,7 +35,7 @@ class TestFileSystemHandler(TFTPServerTestCase):
         self.assertTrue(data.startswith('\x00\x05\x00\x01'))
 
     def test_non_octet(self):
-        """ Currently, the server only supports ascii transfers.
+        """ The server only supports octet and netascii transfers.
         """
         self.get_file('yo.txt', mode='ascii')
         data, _ = self.recv()
@@ -76,6 +80,90 @@ class TestFileSystemHandler(TFTPServerTestCase):
         # \x00\x06 = OACK
         self.assertEqual(data, '\x00\x06blksize\x001024\x00')
 
+    def test_tsize(self):
+        handle = open(os.path.join(self.tftp_root, 'test.txt'), 'w+')
+        handle.write('hello world')
+        handle.flush()
+
+        self.get_file('test.txt', options={'tsize': 0})
+        data, _ = self.recv()
+        # \x00\x06 = OACK
+        self.assertEqual(data, '\x00\x06tsize\x0011\x00')
+        self.ack_n(0)
+
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01hello world')
+        self.ack_n(1)
+
+    def test_compact_session(self):
+        with open(os.path.join(self.tftp_root, 'test.txt'), 'w') as handle:
+            handle.write('hello world')
+
+        self.get_file('test.txt')
+        self.recv()
+        session = self.server.sessions[
+            ('127.0.0.1', self.client_socket.getsockname()[1])
+        ]
+        self.assertFalse(hasattr(session, '__dict__'))
+        self.assertIs(
+            session.filename,
+            intern(os.path.join(self.tftp_root, 'test.txt'))
+        )
+        self.ack_n(1)
+
+    def test_netascii(self):
+        path = os.path.join(self.tftp_root, 'test.txt')
+        with open(path, 'w') as handle:
+            handle.write('line\n' * 100 + 'cr\r')
+
+        expected = 'line\r\n' * 100 + 'cr\r\x00'
+        for hits in (0, 1):
+            self.get_file('test.txt', mode='netascii', options={'tsize': 0})
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x06tsize\x00604\x00')
+            self.ack_n(0)
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x01' + expected[:512])
+            self.ack_n(1)
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x02' + expected[512:])
+            self.ack_n(2)
+            self.assertEqual(self.server.netascii_cache.hits, hits)
+
+        # A new version of the file is converted again
+        with open(path, 'w') as handle:
+            handle.write('new\n')
+        os.utime(path, (0, 0))
+        self.get_file('test.txt', mode='NETASCII')
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01new\r\n')
+        self.ack_n(1)
+
+    def test_netascii_streamed(self):
+        """ Files bigger than max_memory_size are converted as they are sent.
+        """
+        self.server.handler_args = {'netascii': {'max_memory_size': 100}}
+        self.client_socket.settimeout(2)
+        with open(os.path.join(self.tftp_root, 'test.txt'), 'w') as handle:
+            handle.write('line\r\n' * 100)
+
+        expected = 'line\r\x00\r\n' * 100
+        self.get_file('test.txt', mode='netascii', options={'tsize': 0})
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x06tsize\x00%s\x00' % len(expected))
+        self.ack_n(0)
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01' + expected[:512])
+        self.ack_n(1)
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x02' + expected[512:])
+        # Retransmission
+        self.ack_n(1)
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x02' + expected[512:])
+        self.ack_n(2)
+        self.assertEqual(len(self.server.netascii_cache), 0)
+
     def test_big_file(self):
         handle = open(os.path.join(self.tftp_root, 'test.txt'), 'w+')
         handle.write('A' * 512)
@@ -156,6 +244,41 @@ class TestFileSystemHandler(TFTPServerTestCase):
         # \x00\x04 = permission denied
         self.assertTrue(data.startswith('\x00\x05\x00\x02'))
 
+    def test_directory_transversal_sibling(self):
+        """ A directory whose name starts with the root's is out of the root.
+        """
+        sibling = self.tftp_root + '-secret'
+        os.mkdir(sibling)
+        try:
+            with open(os.path.join(sibling, 'key'), 'w') as handle:
+                handle.write('secret')
+            self.get_file('../%s/key' % os.path.basename(sibling))
+            data, _ = self.recv()
+            self.assertTrue(data.startswith('\x00\x05\x00\x02'))
+        finally:
+            shutil.rmtree(sibling)
+
+    def test_symlink_out_of_root(self):
+        """ Symlinks of the root may point out of it, unless confined.
+        """
+        target = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(target, 'pxelinux.0'), 'w') as handle:
+                handle.write('pxe')
+            os.symlink(os.path.join(target, 'pxelinux.0'),
+                       os.path.join(self.tftp_root, 'pxelinux.0'))
+            self.get_file('pxelinux.0')
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x01pxe')
+            self.ack_n(1)
+
+            self.server.handler_args['fs'] = {'confine_symlinks': True}
+            self.get_file('pxelinux.0')
+            data, _ = self.recv()
+            self.assertTrue(data.startswith('\x00\x05\x00\x02'))
+        finally:
+            shutil.rmtree(target)
+
     def test_permission_denied(self):
         filename = os.path.join(self.tftp_root, 'test.txt')
         handle = open(filename, 'w+')
@@ -194,6 +317,207 @@ class TestFileSystemHandler(TFTPServerTestCase):
         self.assertEqual(data, '\x00\x03\x00\x02' + 'B' * 512)
 
 
+class TestFileSystemHandlerWithIndex(TFTPServerTestCase):
+
+    def setUp(self):
+        return super(TestFileSystemHandlerWithIndex, self).setUp(
+            handler_args={'fs': {'index': True, 'index_poll_interval': 0}}
+        )
+
+    def test_non_existing(self):
+        self.get_file('invalid')
+        data, _ = self.recv()
+        # \x00\x05 = error
+        # \x00\x01 = no such file
+        self.assertTrue(data.startswith('\x00\x05\x00\x01'))
+
+    def test_small_file(self):
+        handle = open(os.path.join(self.tftp_root, 'test.txt'), 'w+')
+        handle.write('hello world')
+        handle.close()
+        self.server.file_index.scan()
+
+        self.get_file('test.txt', options={'tsize': 0})
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x06tsize\x0011\x00')
+        self.ack_n(0)
+
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01hello world')
+        self.ack_n(1)
+
+    def test_directory_transversal(self):
+        self.get_file('../../yo.txt')
+        data, _ = self.recv()
+        self.assertTrue(data.startswith('\x00\x05\x00\x02'))
+
+
+class TestFileSystemHandlerWithCompressedFiles(TFTPServerTestCase):
+
+    def setUp(self):
+        return super(TestFileSystemHandlerWithCompressedFiles, self).setUp(
+            handler_args={'fs': {'compressed_span': 1024,
+                                 'compressed_chunk_size': 512}}
+        )
+
+    def test_gzip(self):
+        content = ''.join(chr(ord('A') + i % 26) * 100 for i in xrange(30))
+        path = os.path.join(self.tftp_root, 'image.img.gz')
+        with gzip.open(path, 'wb') as handle:
+            handle.write(content)
+
+        # The index is built in a separate thread
+        backend = self.server.backends.get('fs')
+        image_path = backend.resolve('image.img')
+        self.assertTrue(backend.opens_async(image_path))
+
+        self.get_file('image.img', options={'tsize': 0})
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x06tsize\x003000\x00')
+        self.ack_n(0)
+
+        for block_id in xrange(1, 7):
+            data, _ = self.recv()
+            self.assertEqual(
+                data, struct.pack('!HH', 3, block_id) +
+                content[(block_id - 1) * 512:block_id * 512]
+            )
+            # Retransmission
+            if block_id == 3:
+                self.ack_n(2)
+                data, _ = self.recv()
+                self.assertEqual(data[4:], content[1024:1536])
+            self.ack_n(block_id)
+
+        self.assertFalse(backend.opens_async(image_path))
+        self.assertFalse(backend.opens_async(path))
+
+        # The compressed file itself can still be requested
+        self.get_file('image.img.gz')
+        data, _ = self.recv()
+        self.assertEqual(data[:6], '\x00\x03\x00\x01\x1f\x8b')
+
+
+class TestFileSystemHandlerWithNegativeCache(TFTPServerTestCase):
+
+    def setUp(self):
+        return super(TestFileSystemHandlerWithNegativeCache, self).setUp(
+            handler_args={
+                'fs': {'index': True, 'index_poll_interval': 0},
+                'negative_cache': {'ttl': 60}
+            }
+        )
+
+    def test_negative_cache(self):
+        cache = self.server.negative_cache
+
+        for _ in range(3):
+            self.get_file('pxelinux.cfg')
+            data, _ = self.recv()
+            self.assertTrue(data.startswith('\x00\x05\x00\x01'))
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+        # Cache is invalidated when the file is created
+        handle = open(os.path.join(self.tftp_root, 'pxelinux.cfg'), 'w+')
+        handle.write('default')
+        handle.close()
+        self.server.file_index.scan()
+
+        self.get_file('pxelinux.cfg')
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01default')
+        self.ack_n(1)
+
+
+class RecordsHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestFileSystemHandlerWithLogSummary(TFTPServerTestCase):
+
+    def setUp(self):
+        self.records = RecordsHandler()
+        logger = logging.getLogger('dyntftpd')
+        logger.addHandler(self.records)
+        self.level = logger.level
+        logger.setLevel(logging.DEBUG)
+
+        return super(TestFileSystemHandlerWithLogSummary, self).setUp(
+            handler_args={'log': {'summary': True, 'ack_sample': 2}}
+        )
+
+    def tearDown(self):
+        logger = logging.getLogger('dyntftpd')
+        logger.removeHandler(self.records)
+        logger.setLevel(self.level)
+        super(TestFileSystemHandlerWithLogSummary, self).tearDown()
+
+    def test_summary(self):
+        with open(os.path.join(self.tftp_root, 'test.txt'), 'w') as handle:
+            handle.write('A' * 512 + 'B' * 10)
+
+        self.get_file('test.txt')
+        data, _ = self.recv()
+        # Lost block 1, ACK 0 again
+        self.ack_n(0)
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01' + 'A' * 512)
+        self.ack_n(1)
+        data, _ = self.recv()
+        self.ack_n(2)
+
+        # Wait for the server to handle the final ACK
+        self.get_file('invalid')
+        self.recv()
+
+        infos = [record for record in self.records.records
+                 if record.levelno == logging.INFO]
+        self.assertEqual(len(infos), 1)
+        transfer = infos[0].transfer
+        self.assertEqual(
+            transfer['file'], os.path.join(self.tftp_root, 'test.txt')
+        )
+        self.assertEqual(transfer['status'], 'complete')
+        self.assertEqual(transfer['bytes'], 512 * 2 + 10)
+        self.assertEqual(transfer['blocks'], 3)
+        self.assertEqual(transfer['retransmits'], 1)
+        self.assertEqual(transfer['handler'], 'FileSystemHandler')
+        self.assertEqual(
+            transfer['client'], '127.0.0.1:%s' %
+            self.client_socket.getsockname()[1]
+        )
+
+        # 3 ACK received, 1 logged
+        acks = [record for record in self.records.records
+                if record.getMessage().startswith('ACK')]
+        self.assertEqual(len(acks), 1)
+
+    def test_no_ack_logged(self):
+        self.server.handler_args['log']['ack_sample'] = 0
+        with open(os.path.join(self.tftp_root, 'test.txt'), 'w') as handle:
+            handle.write('A' * 10)
+
+        self.get_file('test.txt')
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01' + 'A' * 10)
+        self.ack_n(1)
+
+        # Wait for the server to handle the final ACK
+        self.get_file('invalid')
+        self.recv()
+        self.assertFalse([
+            record for record in self.records.records
+            if record.getMessage().startswith('ACK')
+        ])
+        self.assertEqual(self.server.sessions, {})
+
+
 class CustomSession(TFTPSession):
 
     def load_file(self):
@@ -1,3 +1,4 @@
+import re
 import shutil
 import tempfile
 
@@ -78,6 +79,219 @@ class TestHTTPHandler(TFTPServerTestCase):
         self.assertTrue(data.startswith('\x00\x05\x00\x02'))
 
 
+class TestHTTPHandlerWithNegativeCache(TFTPServerTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.calls = 0
+        return super(TestHTTPHandlerWithNegativeCache, self).setUp(
+            handler=HTTPHandler, handler_args={
+                'http': {'cache_dir': self.cache_dir},
+                'negative_cache': {'ttl': 60}
+            })
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        super(TestHTTPHandlerWithNegativeCache, self).tearDown()
+
+    def get_404(self, url, request):
+        self.calls += 1
+        return get_404(url, request)
+
+    def test_404_cached(self):
+        with HTTMock(self.get_404) as mock:
+            for _ in range(3):
+                self.get_file('http://www.download.tld/pxelinux.cfg/default')
+                data, _ = self.recv()
+                self.assertTrue(data.startswith('\x00\x05\x00\x02'))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.server.negative_cache.hits, 2)
+
+
+class RangeOrigin(object):
+    """ Origin accepting ranged requests. The first request of each range
+    only returns half of it.
+    """
+
+    def __init__(self, content, accept_ranges=True):
+        self.content = content
+        self.accept_ranges = accept_ranges
+        self.ranges = []
+
+    def __call__(self, url, request):
+        headers = {'Content-Length': str(len(self.content))}
+        if self.accept_ranges:
+            headers['Accept-Ranges'] = 'bytes'
+
+        if request.method == 'HEAD':
+            return {'status_code': 200, 'headers': headers}
+
+        match = re.match(r'bytes=(\d+)-(\d+)',
+                         request.headers.get('Range', ''))
+        if not self.accept_ranges or not match:
+            return {'status_code': 200, 'content': self.content}
+
+        start, end = int(match.group(1)), int(match.group(2)) + 1
+        first_attempt = not any(r[1] == end for r in self.ranges)
+        self.ranges.append((start, end))
+        if first_attempt:
+            end = start + (end - start) // 2
+        return {'status_code': 206, 'content': self.content[start:end]}
+
+
+class FailingRangeOrigin(RangeOrigin):
+    """ RangeOrigin sending an ETag, which fails the ranged requests while
+    `failing` is True, and doesn't accept ranges past the end of the file.
+    """
+
+    def __init__(self, content):
+        super(FailingRangeOrigin, self).__init__(content)
+        self.failing = True
+
+    def __call__(self, url, request):
+        match = re.match(r'bytes=(\d+)-$', request.headers.get('Range', ''))
+        if match and int(match.group(1)) >= len(self.content):
+            return {'status_code': 416}
+        if self.failing and request.headers.get('Range'):
+            return {'status_code': 500}
+        response = super(FailingRangeOrigin, self).__call__(url, request)
+        response.setdefault('headers', {})['ETag'] = '"v1"'
+        return response
+
+
+class PartialRangeOrigin(RangeOrigin):
+    """ RangeOrigin sending an ETag, which fails the ranged requests
+    starting at `failing_from` or after.
+    """
+
+    def __init__(self, content, failing_from):
+        super(PartialRangeOrigin, self).__init__(content)
+        self.failing_from = failing_from
+
+    def __call__(self, url, request):
+        match = re.match(r'bytes=(\d+)-', request.headers.get('Range', ''))
+        if (
+            match and self.failing_from is not None and
+            int(match.group(1)) >= self.failing_from
+        ):
+            return {'status_code': 500}
+        response = super(PartialRangeOrigin, self).__call__(url, request)
+        response.setdefault('headers', {})['ETag'] = '"v1"'
+        return response
+
+
+class NoHeadOrigin(RangeOrigin):
+    """ RangeOrigin refusing HEAD requests.
+    """
+
+    def __call__(self, url, request):
+        if request.method == 'HEAD':
+            return {'status_code': 405}
+        return super(NoHeadOrigin, self).__call__(url, request)
+
+
+class TestHTTPHandlerWithRanges(TFTPServerTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        return super(TestHTTPHandlerWithRanges, self).setUp(
+            handler=HTTPHandler, handler_args={
+                'http': {
+                    'cache_dir': self.cache_dir,
+                    'range_workers': 2,
+                    'range_min_size': 0,
+                    'maxsize': 2000
+                }
+            })
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        super(TestHTTPHandlerWithRanges, self).tearDown()
+
+    def test_ranges(self):
+        origin = RangeOrigin('A' * 512 + 'B' * 88)
+        with HTTMock(origin):
+            self.get_file('http://www.download.tld/superfile')
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x01' + 'A' * 512)
+            self.ack_n(1)
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x02' + 'B' * 88)
+            self.ack_n(2)
+
+        # Each range was requested twice, the second time resuming from
+        # where the first attempt stopped.
+        self.assertEqual(sorted(origin.ranges), [
+            (0, 300), (150, 300), (300, 600), (450, 600)
+        ])
+
+    def test_ranges_failed(self):
+        """ The preallocated file of a failed ranged download isn't taken for
+        a partial download.
+        """
+        origin = FailingRangeOrigin('A' * 512 + 'B' * 88)
+        with HTTMock(origin):
+            self.get_file('http://www.download.tld/superfile')
+            data, _ = self.recv()
+            self.assertTrue(data.startswith('\x00\x05'))
+
+            origin.failing = False
+            self.get_file('http://www.download.tld/superfile')
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x01' + 'A' * 512)
+            self.ack_n(1)
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x02' + 'B' * 88)
+            self.ack_n(2)
+
+    def test_ranges_resumed(self):
+        """ Only the ranges missing after a failure are downloaded again.
+        """
+        origin = PartialRangeOrigin('A' * 512 + 'B' * 88, failing_from=300)
+        with HTTMock(origin):
+            self.get_file('http://www.download.tld/superfile')
+            data, _ = self.recv()
+            self.assertTrue(data.startswith('\x00\x05'))
+            self.assertEqual(sorted(origin.ranges), [(0, 300), (150, 300)])
+
+            origin.failing_from = None
+            origin.ranges = []
+            self.get_file('http://www.download.tld/superfile')
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x01' + 'A' * 512)
+            self.ack_n(1)
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x02' + 'B' * 88)
+            self.ack_n(2)
+        self.assertEqual(sorted(origin.ranges), [(300, 600), (450, 600)])
+
+    def test_head_refused(self):
+        origin = NoHeadOrigin('A' * 512 + 'B' * 88)
+        with HTTMock(origin):
+            self.get_file('http://www.download.tld/superfile')
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x01' + 'A' * 512)
+            self.ack_n(1)
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x02' + 'B' * 88)
+            self.ack_n(2)
+        self.assertEqual(origin.ranges, [])
+
+    def test_no_ranges(self):
+        origin = RangeOrigin('small file', accept_ranges=False)
+        with HTTMock(origin):
+            self.get_file('http://www.download.tld/superfile')
+            data, _ = self.recv()
+            self.assertEqual(data, '\x00\x03\x00\x01small file')
+            self.ack_n(1)
+
+    def test_maxsize(self):
+        with HTTMock(RangeOrigin('x' * 3000)):
+            self.get_file('http://www.download.tld/superfile')
+            data, _ = self.recv()
+            self.assertTrue(data.startswith('\x00\x05\x00\x02'))
+
+
 class TestHTTPHandlerWithTimeout(TFTPServerTestCase):
 
     def setUp(self):
@@ -0,0 +1,144 @@
+import os
+import socket
+import threading
+import time
+import unittest
+
+from dyntftpd import handoff
+from dyntftpd.server import TFTPServer
+
+from . import TFTPServerTestCase
+
+
+class TestEncoding(unittest.TestCase):
+
+    def test_encode_decode(self):
+        message = handoff.encode('\x00\x04\x00\x01', ('127.0.0.1', 4242))
+        self.assertEqual(
+            handoff.decode(message), ('\x00\x04\x00\x01', ('127.0.0.1', 4242))
+        )
+
+    def test_inherited_fds(self):
+        self.assertEqual(handoff.inherited_fds({}), (None, None))
+        self.assertEqual(handoff.inherited_fds({
+            handoff.LISTEN_FD_ENV: '3', handoff.PREDECESSOR_FD_ENV: '4'
+        }), (3, 4))
+
+
+class Process(object):
+    """ Stands for the successor process, running in a thread.
+    """
+
+    def __init__(self, returncode=None):
+        self.returncode = returncode
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.returncode = -15
+
+
+class ReloadingServer(TFTPServer):
+    """ Starts its successor in a thread of the current process.
+    """
+    successor = None
+
+    def spawn_successor(self, args, env):
+        if args == ['fail']:
+            return Process(returncode=1)
+
+        # Duplicate the descriptors, as a new process would inherit them
+        self.successor = TFTPServer(
+            host='127.0.0.1', port=0, root=self.root,
+            listen_fd=os.dup(int(env[handoff.LISTEN_FD_ENV])),
+            predecessor_fd=os.dup(int(env[handoff.PREDECESSOR_FD_ENV]))
+        )
+        self.successor.timeout = 0.001
+        thread = threading.Thread(target=self.successor.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return Process()
+
+
+class TestHandoff(TFTPServerTestCase):
+
+    def setUp(self):
+        super(TestHandoff, self).setUp()
+        # Replace the server started by TFTPServerTestCase
+        self.server.shutdown()
+        self.server.server_close()
+
+        self.server = ReloadingServer(
+            host='127.0.0.1', port=0, root=self.tftp_root
+        )
+        self.server.timeout = 5
+        self.listen_ip, self.listen_port = self.server.socket.getsockname()
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+        with open(os.path.join(self.tftp_root, 'test.txt'), 'w') as handle:
+            handle.write('x' * 512 + 'y' * 512 + 'z' * 10)
+
+    def tearDown(self):
+        if self.server.successor is not None:
+            self.server.successor.shutdown()
+            self.server.successor.server_close()
+        super(TestHandoff, self).tearDown()
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_reload(self):
+        self.get_file('test.txt')
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01' + 'x' * 512)
+
+        # The reload starts once the next datagram is handled
+        self.server.request_reload(['successor'])
+        self.ack_n(1)
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x02' + 'y' * 512)
+
+        self.wait_for(lambda: self.server.successor is not None)
+        # Let the old server receive READY
+        time.sleep(0.1)
+
+        # The transfer in progress is completed by the old server
+        self.ack_n(2)
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x03' + 'z' * 10)
+        self.ack_n(3)
+
+        # Then the old server exits
+        self.server_thread.join(5)
+        self.assertFalse(self.server_thread.is_alive())
+
+        # New requests are served by the new server, on the same port
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.sendto('\x00\x01test.txt\x00octet\x00',
+                      (self.listen_ip, self.listen_port))
+        data, _ = client.recvfrom(1024)
+        self.assertEqual(data, '\x00\x03\x00\x01' + 'x' * 512)
+        self.assertIn(
+            ('127.0.0.1', client.getsockname()[1]),
+            self.server.successor.sessions
+        )
+        client.close()
+
+    def test_reload_aborted(self):
+        self.server.request_reload(['fail'])
+        self.get_file('test.txt')
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01' + 'x' * 512)
+        self.wait_for(lambda: self.server.reload_args is None)
+
+        # The server is still serving
+        self.ack_n(1)
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x02' + 'y' * 512)
+        self.assertTrue(self.server_thread.is_alive())
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from httmock import HTTMock
+
+from dyntftpd.handlers.http import HTTPHandler
+
+from . import TFTPServerTestCase
+
+
+class ETagOrigin(object):
+    """ Origin sending ETags, and answering conditional and ranged requests.
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.requests = []
+
+    def __call__(self, url, request):
+        self.requests.append((url.path, dict(request.headers)))
+        content = self.files[url.path]
+        headers = {'ETag': '"v1"'}
+
+        if request.headers.get('If-None-Match') == '"v1"':
+            return {'status_code': 304, 'headers': headers}
+
+        range_header = request.headers.get('Range')
+        if range_header and request.headers.get('If-Range') == '"v1"':
+            start = int(range_header[len('bytes='):-1])
+            return {
+                'status_code': 206, 'headers': headers,
+                'content': content[start:]
+            }
+        return {'status_code': 200, 'headers': headers, 'content': content}
+
+
+class TestHTTPCache(TFTPServerTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        return super(TestHTTPCache, self).setUp(
+            handler=HTTPHandler, handler_args={
+                'http': {'cache_dir': self.cache_dir, 'max_age': 60}
+            })
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        super(TestHTTPCache, self).tearDown()
+
+    @property
+    def cache(self):
+        return self.server.backends.get('http').cache
+
+    def restart(self):
+        """ Forget the in-memory state of the cache.
+        """
+        self.server.backends.get('http')._cache = None
+
+    def fetch(self, path):
+        self.get_file('http://www.download.tld' + path)
+        data, _ = self.recv()
+        self.ack_n(1)
+        return data[4:]
+
+    def test_persistent(self):
+        origin = ETagOrigin({'/boot.ipxe': '#!ipxe'})
+        with HTTMock(origin):
+            self.assertEqual(self.fetch('/boot.ipxe'), '#!ipxe')
+            self.restart()
+            self.assertEqual(self.fetch('/boot.ipxe'), '#!ipxe')
+        self.assertEqual(len(origin.requests), 1)
+
+        with open(os.path.join(self.cache_dir, 'index.json')) as index:
+            entry, = json.load(index)
+        self.assertEqual(entry['url'], 'http://www.download.tld/boot.ipxe')
+        self.assertEqual(entry['etag'], '"v1"')
+        self.assertTrue(entry['complete'])
+
+    def test_revalidate(self):
+        self.server.handler_args['http']['max_age'] = 0
+        origin = ETagOrigin({'/boot.ipxe': '#!ipxe'})
+        with HTTMock(origin):
+            self.assertEqual(self.fetch('/boot.ipxe'), '#!ipxe')
+            self.restart()
+            self.assertEqual(self.fetch('/boot.ipxe'), '#!ipxe')
+        self.assertEqual(origin.requests[1][1]['If-None-Match'], '"v1"')
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_resume(self):
+        url = 'http://www.download.tld/vmlinuz'
+        filename = hashlib.sha1(url).hexdigest()
+        with open(os.path.join(self.cache_dir, 'index.json'), 'w') as index:
+            json.dump([{
+                'url': url, 'filename': filename, 'size': 5,
+                'complete': False, 'etag': '"v1"'
+            }], index)
+        with open(os.path.join(self.cache_dir, filename + '.part'), 'w') \
+                as part:
+            part.write('hello')
+
+        origin = ETagOrigin({'/vmlinuz': 'hello world'})
+        with HTTMock(origin):
+            self.assertEqual(self.fetch('/vmlinuz'), 'hello world')
+        self.assertEqual(origin.requests[0][1]['Range'], 'bytes=5-')
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, filename)))
+
+    def test_eviction(self):
+        self.server.handler_args['http']['cache_size'] = 15
+        origin = ETagOrigin({'/a': 'a' * 10, '/b': 'b' * 10})
+        with HTTMock(origin):
+            self.fetch('/a')
+            self.fetch('/b')
+            self.restart()
+            self.assertEqual(
+                self.cache.get('http://www.download.tld/a'), None
+            )
+            self.assertEqual(self.cache.size, 10)
+
+    def test_url_locks(self):
+        url = 'http://www.download.tld/a'
+        with self.cache.lock(url):
+            self.assertIn(url, self.cache._url_locks)
+        origin = ETagOrigin({'/a': 'a' * 10, '/b': 'b' * 10})
+        with HTTMock(origin):
+            self.fetch('/a')
+            self.fetch('/b')
+        self.assertEqual(self.cache._url_locks, {})
+
+    def test_memory_max_age(self):
+        """ Files in memory are not revalidated for memory_max_age seconds.
+        """
+        self.server.handler_args['http'].update({
+            'max_age': 0, 'memory_cache_size': 20, 'memory_max_object': 10
+        })
+        origin = ETagOrigin({'/a': 'a' * 10})
+        with HTTMock(origin):
+            for _ in range(4):
+                self.assertEqual(self.fetch('/a'), 'a' * 10)
+            # Downloaded, then revalidated when promoted
+            self.assertEqual(len(origin.requests), 2)
+            self.assertEqual(self.cache.memory_hits, 3)
+
+            self.server.handler_args['http']['memory_max_age'] = 0
+            self.fetch('/a')
+            self.assertEqual(len(origin.requests), 3)
+
+    def test_memory_tier(self):
+        self.server.handler_args['http'].update({
+            'memory_cache_size': 20, 'memory_max_object': 10
+        })
+        origin = ETagOrigin({
+            '/a': 'a' * 10, '/b': 'b' * 10, '/c': 'c' * 10, '/big': 'x' * 11
+        })
+        url = 'http://www.download.tld/%s'
+        with HTTMock(origin):
+            # Promoted when read for the second time
+            self.fetch('/a')
+            self.assertEqual(self.cache.memory, {})
+            self.fetch('/a')
+            self.fetch('/a')
+            self.assertEqual(self.cache.memory_hits, 2)
+
+            for _ in range(3):
+                self.fetch('/big')
+            for _ in range(2):
+                self.fetch('/b')
+            self.assertEqual(sorted(self.cache.memory), [url % 'a', url % 'b'])
+
+            # c replaces b, read less recently, but not a, read more often
+            for _ in range(2):
+                self.fetch('/c')
+            self.assertEqual(sorted(self.cache.memory), [url % 'a', url % 'c'])
+
+        # Served from memory
+        os.unlink(self.cache.path(self.cache.get(url % 'a')))
+        self.assertEqual(self.fetch('/a'), 'a' * 10)
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from dyntftpd.index import FileIndex, pyinotify
+
+
+class TestFileIndex(unittest.TestCase):
+
+    use_inotify = False
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'pxelinux.cfg'))
+        self.write('pxelinux.0', 'x' * 42)
+        self.write('pxelinux.cfg/default', 'default')
+        self.index = FileIndex(
+            self.root, poll_interval=0, use_inotify=self.use_inotify
+        )
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.root)
+
+    def write(self, path, content):
+        with open(os.path.join(self.root, path), 'w') as handle:
+            handle.write(content)
+
+    def lookup(self, path):
+        self.index.refresh()
+        return self.index.lookup(os.path.join(self.root, path))
+
+    def rescan(self):
+        if not self.use_inotify:
+            self.index.refresh()
+            self.index.join()
+
+    def test_lookup(self):
+        self.assertEqual(self.lookup('pxelinux.0').size, 42)
+        self.assertEqual(self.lookup('pxelinux.cfg/default').size, 7)
+        self.assertIsNone(self.lookup('pxelinux.cfg/01-aa-bb-cc-dd-ee-ff'))
+        # directories are not indexed
+        self.assertIsNone(self.lookup('pxelinux.cfg'))
+        self.assertIsNone(self.index.lookup('/etc/passwd'))
+
+    def test_updates(self):
+        self.write('pxelinux.cfg/C0A8', 'hex ip')
+        self.write('pxelinux.0', 'x' * 10)
+        os.unlink(os.path.join(self.root, 'pxelinux.cfg/default'))
+
+        self.rescan()
+        self.assertEqual(self.lookup('pxelinux.cfg/C0A8').size, 6)
+        self.assertEqual(self.lookup('pxelinux.0').size, 10)
+        self.assertIsNone(self.lookup('pxelinux.cfg/default'))
+
+    def test_poll_interval(self):
+        if self.use_inotify:
+            return
+        self.index.poll_interval = 3600
+        self.write('new', '')
+        self.assertIsNone(self.lookup('new'))
+        self.index.last_scan = time.time() - 3600
+        # The rescan runs in background, lookups use the old index meanwhile
+        self.assertIsNone(self.lookup('new'))
+        self.index.join()
+        self.assertIsNotNone(self.lookup('new'))
+
+
+@unittest.skipIf(pyinotify is None, 'pyinotify is not installed')
+class TestFileIndexInotify(TestFileIndex):
+
+    use_inotify = True
+
+    def test_new_directory(self):
+        self.assertTrue(self.index.uses_inotify)
+        os.mkdir(os.path.join(self.root, 'images'))
+        self.lookup('images')
+        self.write('images/vmlinuz', 'kernel')
+        self.assertEqual(self.lookup('images/vmlinuz').size, 6)
+
+        shutil.rmtree(os.path.join(self.root, 'images'))
+        self.assertIsNone(self.lookup('images/vmlinuz'))
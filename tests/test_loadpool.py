@@ -0,0 +1,79 @@
+import select
+import threading
+import time
+import unittest
+
+from dyntftpd.loadpool import LoadPool
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+class TestLoadPool(unittest.TestCase):
+
+    def setUp(self):
+        self.results = []
+
+    def tearDown(self):
+        self.pool.close()
+
+    def callback(self, result, exc_info):
+        self.results.append(
+            (result, exc_info[0] if exc_info is not None else None)
+        )
+
+    def test_workers(self):
+        self.pool = LoadPool(workers=2)
+        lock = threading.Lock()
+        running = [0, 0]  # current, max
+        release = threading.Event()
+
+        def load():
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            release.wait()
+            with lock:
+                running[0] -= 1
+            return 'loaded'
+
+        for _ in range(10):
+            self.assertTrue(self.pool.submit(load, self.callback))
+        self.assertTrue(wait_for(lambda: running[0] == 2))
+        release.set()
+        self.pool.join()
+        self.assertEqual(running, [0, 2])
+
+        # Callbacks are called by the serve loop, once woken up
+        self.assertEqual(self.results, [])
+        self.assertEqual(select.select([self.pool], [], [], 1)[0],
+                         [self.pool])
+        self.pool.run_callbacks()
+        self.assertEqual(self.results, [('loaded', None)] * 10)
+        self.assertEqual(select.select([self.pool], [], [], 0)[0], [])
+
+    def test_max_pending(self):
+        self.pool = LoadPool(workers=1, max_pending=1)
+        started, release = threading.Event(), threading.Event()
+
+        def load():
+            started.set()
+            release.wait()
+
+        self.assertTrue(self.pool.submit(load, self.callback))
+        started.wait()
+        self.assertTrue(self.pool.submit(load, self.callback))
+        self.assertFalse(self.pool.submit(load, self.callback))
+        release.set()
+        self.pool.join()
+
+    def test_error(self):
+        self.pool = LoadPool(workers=1)
+        self.pool.submit(lambda: 1 / 0, self.callback)
+        self.pool.join()
+        self.pool.run_callbacks()
+        self.assertEqual(self.results, [(None, ZeroDivisionError)])
@@ -0,0 +1,104 @@
+import logging
+import threading
+import unittest
+
+from dyntftpd.logqueue import QueueHandler, queue_handlers
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self, blocked=None):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.blocked = blocked
+
+    def emit(self, record):
+        if self.blocked is not None:
+            self.blocked.wait()
+        self.records.append(record)
+
+
+class TestQueueHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('test_logqueue')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+
+    def test_write(self):
+        target = ListHandler()
+        self.logger.addHandler(target)
+        queue_handlers(self.logger)
+        self.assertIsInstance(self.logger.handlers[0], QueueHandler)
+
+        args = ['hello']
+        self.logger.info('%s world', args)
+        # The message is formatted when logged
+        args.append('!')
+        try:
+            raise ValueError('oops')
+        except ValueError:
+            self.logger.exception('failed')
+
+        self.logger.handlers[0].flush()
+        self.assertEqual(
+            [record.getMessage() for record in target.records],
+            ["['hello'] world", 'failed']
+        )
+        self.assertIn('ValueError: oops', target.records[1].exc_text)
+
+    def test_drop(self):
+        blocked = threading.Event()
+        target = ListHandler(blocked)
+        handler = QueueHandler(target, maxsize=2)
+        self.logger.addHandler(handler)
+
+        for i in xrange(10):
+            self.logger.info('record %s', i)
+        # One record is being written, two are queued
+        self.assertGreaterEqual(handler.dropped, 7)
+
+        # The drops are reported once the queue is drained
+        blocked.set()
+        handler.flush()
+        dropped = handler.dropped
+        self.assertEqual(len(target.records), 10 - dropped + 1)
+        self.assertEqual(target.records[-1].getMessage(),
+                         '%s log records dropped' % dropped)
+
+        # Later drops are reported separately
+        blocked.clear()
+        for i in xrange(10):
+            self.logger.info('record %s', i)
+        self.assertGreaterEqual(handler.dropped - dropped, 7)
+        blocked.set()
+        self.logger.removeHandler(handler)
+        handler.close()
+        self.assertEqual(
+            target.records[-1].getMessage(),
+            '%s log records dropped' % (handler.dropped - dropped)
+        )
+        self.assertEqual(handler.reported, handler.dropped)
+
+    def test_target_level(self):
+        blocked = threading.Event()
+        target = ListHandler(blocked)
+        target.setLevel(logging.WARNING)
+        handler = QueueHandler(target, maxsize=1)
+        self.logger.addHandler(handler)
+
+        self.logger.warning('written')
+        # Records below the level of the target don't fill the queue
+        for _ in xrange(3):
+            self.logger.info('ignored')
+        self.assertEqual(handler.dropped, 0)
+
+        blocked.set()
+        handler.flush()
+        self.assertEqual([record.getMessage() for record in target.records],
+                         ['written'])
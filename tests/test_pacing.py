@@ -0,0 +1,234 @@
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+import unittest
+
+from dyntftpd.pacing import Pacer, PacingPolicy, Timers
+
+from . import TFTPServerTestCase
+from .test_handler_fs import RecordsHandler
+
+
+class TestPacer(unittest.TestCase):
+
+    def setUp(self):
+        self.pacer = Pacer(PacingPolicy(
+            rate=100, min_rate=10, max_rate=200, increase=50, rto=1,
+            min_rto=0.01, max_rto=4, max_retries=2
+        ))
+
+    def test_rtt(self):
+        self.pacer.on_send(0, 0)
+        self.pacer.on_ack(0.1)
+        self.assertAlmostEqual(self.pacer.srtt, 0.1)
+        self.assertAlmostEqual(self.pacer.rto, 0.3)
+
+        # Samples of retransmitted blocks are ignored
+        self.pacer.on_send(1, 1)
+        self.pacer.on_send(2, 1)
+        self.pacer.on_ack(2.5)
+        self.assertAlmostEqual(self.pacer.srtt, 0.1)
+
+        self.pacer.on_send(3, 2)
+        self.pacer.on_ack(3.02)
+        self.assertAlmostEqual(self.pacer.srtt, 0.09)
+
+    def test_aimd(self):
+        self.assertEqual(self.pacer.delay(0), 0)
+        self.pacer.on_send(0, 0)
+        self.assertAlmostEqual(self.pacer.delay(0), 0.01)
+
+        self.pacer.on_ack(0.1)
+        self.assertEqual(self.pacer.rate, 150)
+        self.pacer.on_ack(0.2)
+        self.pacer.on_ack(0.3)
+        self.assertEqual(self.pacer.rate, 200)
+
+        # Halved once per RTT
+        self.pacer.on_loss(1)
+        self.pacer.on_loss(1.05)
+        self.assertEqual(self.pacer.rate, 100)
+        self.pacer.on_loss(1.2)
+        self.assertEqual(self.pacer.rate, 50)
+        for now in (2, 3, 4):
+            self.pacer.on_loss(now)
+        self.assertEqual(self.pacer.rate, 10)
+
+    def test_timeout(self):
+        self.pacer.on_send(0, 0)
+        self.assertTrue(self.pacer.on_timeout(1))
+        self.assertEqual(self.pacer.rto, 2)
+        # The second ACK of the retransmitted DATA 1 is stale until DATA 3
+        # is sent
+        self.pacer.on_send(1, 0)
+        self.pacer.on_send(1.1, 1)
+        self.assertTrue(self.pacer.is_stale_ack(1))
+        self.assertFalse(self.pacer.is_stale_ack(0))
+        self.pacer.on_send(1.2, 2)
+        self.assertFalse(self.pacer.is_stale_ack(1))
+        self.pacer.on_send(1.3, 2)
+        self.assertTrue(self.pacer.on_timeout(3))
+        self.assertEqual(self.pacer.rto, 4)
+        self.assertFalse(self.pacer.on_timeout(7))
+
+    def test_timer(self):
+        timers = Timers()
+        self.pacer.set_timer(timers, 'client', 1, Pacer.RTO)
+        self.pacer.set_timer(timers, 'client', 2, Pacer.SEND)
+        self.assertEqual(timers.pop_due(1), ['client'])
+        # Replaced by the second timer
+        self.assertEqual(self.pacer.due(1), None)
+        self.assertEqual(timers.pop_due(2), ['client'])
+        self.assertEqual(self.pacer.due(2), Pacer.SEND)
+        self.assertEqual(self.pacer.due(2), None)
+
+
+class LossyLink(object):
+    """ Relays datagrams between a client and the server, dropping the
+    datagrams for which `drop(data)` returns True, and delaying the others
+    by `delay` seconds.
+    """
+
+    def __init__(self, server_address, drop=lambda data: False, delay=0):
+        self.server_address = server_address
+        self.drop = drop
+        self.delay = delay
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.settimeout(0.1)
+        self.address = self.socket.getsockname()
+        self.client_address = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            try:
+                data, address = self.socket.recvfrom(65536)
+            except socket.timeout:
+                continue
+            if address == self.server_address:
+                destination = self.client_address
+            else:
+                self.client_address = address
+                destination = self.server_address
+            if self.drop(data):
+                continue
+            if self.delay:
+                time.sleep(self.delay)
+            self.socket.sendto(data, destination)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.socket.close()
+
+
+class TestPacing(TFTPServerTestCase):
+
+    def setUp(self):
+        super(TestPacing, self).setUp(handler_args={
+            'pacing': {'enabled': True, 'rto': 0.05, 'min_rto': 0.05,
+                       'max_retries': 2},
+            'log': {'summary': True},
+        })
+        self.server.timeout = 1
+        self.client_socket.settimeout(3)
+        self.records = RecordsHandler()
+        logger = logging.getLogger('dyntftpd')
+        logger.addHandler(self.records)
+        self.level = logger.level
+        logger.setLevel(logging.INFO)
+
+        with open(os.path.join(self.tftp_root, 'test.txt'), 'w') as handle:
+            handle.write('A' * 512 + 'B' * 512 + 'C' * 512 + 'D')
+
+        self.dropped = []
+        self.link = LossyLink(
+            (self.listen_ip, self.listen_port), drop=self.drop_data
+        )
+        self.listen_ip, self.listen_port = self.link.address
+
+    def tearDown(self):
+        self.link.close()
+        logger = logging.getLogger('dyntftpd')
+        logger.removeHandler(self.records)
+        logger.setLevel(self.level)
+        super(TestPacing, self).tearDown()
+
+    def drop_data(self, data):
+        """ Drops the first transmission of DATA block 3.
+        """
+        if data[:4] == '\x00\x03\x00\x03' and 3 not in self.dropped:
+            self.dropped.append(3)
+            return True
+        return False
+
+    def test_server_retransmission(self):
+        """ The lost block is retransmitted by the server, the client never
+        retransmits.
+        """
+        self.get_file('test.txt')
+        for block_id, content in enumerate('ABCD', 1):
+            data, _ = self.recv()
+            self.assertEqual(data[:4], struct.pack('!HH', 3, block_id))
+            self.assertEqual(data[4], content)
+            self.ack_n(block_id)
+
+        # Wait for the server to handle the final ACK
+        deadline = time.time() + 2
+        while self.server.sessions and time.time() < deadline:
+            time.sleep(0.01)
+
+        transfer = self.records.records[-1].transfer
+        self.assertEqual(transfer['status'], 'complete')
+        self.assertEqual(transfer['retransmits'], 1)
+        self.assertEqual(transfer['loss'], 0.2)
+        self.assertGreater(transfer['rtt'], 0)
+
+    def test_duplicate_ack_of_retransmission(self):
+        """ The client acks both the first transmission of a block and its
+        retransmission on timeout: the second ACK doesn't send the next block
+        again (sorcerer's apprentice).
+        """
+        self.link.drop = lambda data: False
+        self.get_file('test.txt')
+        for _ in xrange(2):
+            data, _ = self.recv()
+            self.assertEqual(data[:4], '\x00\x03\x00\x01')
+        self.ack_n(1)
+        self.ack_n(1)
+
+        received = []
+        while len(received) < 3:
+            data, _ = self.recv()
+            block_id = struct.unpack('!H', data[2:4])[0]
+            if block_id not in received:
+                self.ack_n(block_id)
+            received.append(block_id)
+        self.assertEqual(received, [2, 3, 4])
+
+        deadline = time.time() + 2
+        while self.server.sessions and time.time() < deadline:
+            time.sleep(0.01)
+        transfer = self.records.records[-1].transfer
+        self.assertEqual(transfer['status'], 'complete')
+        self.assertEqual(transfer['retransmits'], 1)
+
+    def test_abandon(self):
+        self.get_file('test.txt')
+        for _ in xrange(3):
+            data, _ = self.recv()
+            self.assertEqual(data[:4], '\x00\x03\x00\x01')
+
+        deadline = time.time() + 2
+        while self.server.sessions and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.server.sessions, {})
+        self.assertEqual(self.records.records[-1].transfer['status'],
+                         'timeout')
@@ -0,0 +1,227 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from httmock import HTTMock
+
+from dyntftpd.handlers.clever import CleverHandler
+from dyntftpd.prefetch import TransitionModel, subnet
+
+from . import TFTPServerTestCase
+
+
+class TestTransitionModel(unittest.TestCase):
+
+    def test_subnet(self):
+        self.assertEqual(subnet('192.168.1.42'), '192.168.1.0/24')
+        self.assertEqual(subnet('192.168.1.42', prefix=16), '192.168.0.0/16')
+        self.assertEqual(subnet('2001:db8::1:2:3:4'), '2001:db8::/64')
+        self.assertEqual(subnet('invalid'), 'invalid')
+
+    def boot(self, model, ip, *filenames):
+        for filename in filenames:
+            model.observe(ip, filename)
+
+    def test_predict(self):
+        model = TransitionModel()
+        self.boot(model, '10.0.0.1', 'pxelinux.0', 'ldlinux.c32',
+                  'pxelinux.cfg/default', 'vmlinuz')
+        self.boot(model, '10.0.0.2', 'pxelinux.0', 'pxelinux.0',
+                  'ldlinux.c32', 'pxelinux.cfg/default', 'memtest')
+
+        key = model.subnet('10.0.0.3')
+        self.assertEqual(
+            model.predict(key, 'pxelinux.0'),
+            ['ldlinux.c32', 'pxelinux.cfg/default']
+        )
+        # vmlinuz and memtest are observed once each
+        self.assertEqual(
+            sorted(model.predict(key, 'pxelinux.cfg/default')),
+            ['memtest', 'vmlinuz']
+        )
+        self.assertEqual(
+            model.predict(key, 'pxelinux.cfg/default', min_probability=0.6),
+            []
+        )
+        self.assertEqual(
+            model.predict(key, 'pxelinux.cfg/default', min_count=3), []
+        )
+        self.assertEqual(model.predict(model.subnet('10.0.1.1'),
+                                       'pxelinux.0'), [])
+
+    def test_bounds(self):
+        model = TransitionModel(max_subnets=2, max_successors=2, max_count=4)
+        for i in xrange(3):
+            self.boot(model, '10.0.%s.1' % i, 'a', 'b')
+        self.assertEqual(model.subnets.keys(), ['10.0.1.0/24', '10.0.2.0/24'])
+
+        self.boot(model, '10.0.1.2', 'a', 'c')
+        self.boot(model, '10.0.1.3', 'a', 'd')
+        self.assertEqual(model.subnets['10.0.1.0/24']['a'], {'b': 1, 'd': 1})
+
+        self.boot(model, '10.0.1.4', 'a', 'd')
+        self.boot(model, '10.0.1.5', 'a', 'd')
+        self.assertEqual(model.subnets['10.0.1.0/24']['a'], {'d': 1})
+
+
+class TestPrefetcher(TFTPServerTestCase):
+
+    def setUp(self):
+        super(TestPrefetcher, self).setUp(
+            handler=CleverHandler, handler_args={
+                'block_cache': {'size': 4096, 'chunk_size': 512},
+                'prefetch': {'enabled': True, 'min_count': 1,
+                             'budget': 3000},
+            })
+        for name, size in (
+            ('pxelinux.0', 1000), ('ldlinux.c32', 1000),
+            ('pxelinux.cfg/default', 100), ('vmlinuz', 3000),
+        ):
+            path = os.path.join(self.tftp_root, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.mkdir(os.path.dirname(path))
+            with open(path, 'w') as handle:
+                handle.write('A' * size)
+        self.prefetcher = self.server.prefetcher
+
+    def request(self, ip, *filenames):
+        for filename in filenames:
+            self.prefetcher.on_request(ip, filename)
+            self.prefetcher.join()
+
+    def test_prefetch(self):
+        self.request('10.0.0.1', 'pxelinux.0', 'ldlinux.c32',
+                     'pxelinux.cfg/default', 'vmlinuz')
+        self.assertEqual(self.prefetcher.prefetched, 0)
+        self.assertEqual(self.server.block_cache.size, 0)
+
+        self.request('10.0.0.2', 'pxelinux.0')
+        self.assertEqual(self.prefetcher.prefetched, 2)
+        self.assertEqual(self.prefetcher.bytes, 1100)
+        self.assertEqual(self.server.block_cache.size, 1100)
+
+        # ldlinux.c32 was prefetched, vmlinuz doesn't fit in the budget left
+        self.request('10.0.0.2', 'ldlinux.c32')
+        self.assertEqual(self.prefetcher.useful, 1)
+        self.assertEqual(self.prefetcher.dropped, 1)
+
+        # Still in cache, pxelinux.cfg/default is still expected
+        self.request('10.0.0.3', 'pxelinux.0')
+        self.assertEqual(self.prefetcher.prefetched, 3)
+        self.assertEqual(self.prefetcher.bytes, 1100)
+        self.request('10.0.0.3', 'ldlinux.c32')
+
+        status = self.prefetcher.status()
+        self.assertEqual(status['useful'], 2)
+        self.assertEqual(status['accuracy'], 2. / 3)
+        self.assertEqual(status['predicted'], 5)
+
+    def test_low_priority(self):
+        # The block cache is full of files requested by clients
+        for name in ('pxelinux.0', 'ldlinux.c32', 'vmlinuz'):
+            handle = self.server.backends.get('fs').open(
+                os.path.join(self.tftp_root, name)
+            )
+            handle.read_block(0, 4096)
+        size = self.server.block_cache.size
+        self.assertGreater(size, 4096 - 100)
+
+        self.request('10.0.0.1', 'ldlinux.c32', 'pxelinux.cfg/default')
+        self.request('10.0.0.2', 'ldlinux.c32')
+        self.assertEqual(self.prefetcher.prefetched, 1)
+        self.assertIsNone(self.server.block_cache.get(
+            self.server.backends.get('fs').open(
+                os.path.join(self.tftp_root, 'pxelinux.cfg/default')
+            ).key, 0
+        ))
+        self.assertEqual(self.server.block_cache.size, size)
+
+    def test_handler(self):
+        for filename in ('pxelinux.0', 'ldlinux.c32', 'pxelinux.0'):
+            self.get_file(filename)
+            for block_id in (1, 2):
+                data, _ = self.recv()
+                self.assertEqual(data[:4], '\x00\x03\x00' + chr(block_id))
+                self.ack_n(block_id)
+        self.prefetcher.join()
+        self.assertEqual(self.prefetcher.prefetched, 1)
+
+
+class TestHTTPPrefetchCost(TFTPServerTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        super(TestHTTPPrefetchCost, self).setUp(
+            handler=CleverHandler, handler_args={
+                'http': {'cache_dir': self.cache_dir, 'max_age': 60},
+            })
+        self.backend = self.server.backends.get('http')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        super(TestHTTPPrefetchCost, self).tearDown()
+
+    def test_prefetch_cost(self):
+        url = 'http://www.download.tld/vmlinuz'
+        self.assertEqual(self.backend.prefetch_cost(url), 0)
+
+        # Complete files are revalidated when requested, not prefetched
+        entry = self.backend.cache.begin(url)
+        entry.size = 1000
+        entry.complete = True
+        self.assertIsNone(self.backend.prefetch_cost(url))
+        entry.fetched_at = 0
+        self.assertIsNone(self.backend.prefetch_cost(url))
+
+        # Bounded cache: only files fitting in the cache are prefetched
+        self.backend.cache.max_bytes = 1500
+        initrd = 'http://www.download.tld/initrd'
+        with HTTMock(lambda url, request: {
+            'status_code': 200, 'headers': {'Content-Length': '400'}
+        }):
+            self.assertEqual(self.backend.prefetch_cost(initrd), 400)
+            self.backend.cache.max_bytes = 1200
+            self.assertIsNone(self.backend.prefetch_cost(initrd))
+        with HTTMock(lambda url, request: {'status_code': 200}):
+            self.assertIsNone(self.backend.prefetch_cost(initrd))
+
+    def test_open_prefetch(self):
+        url = 'http://www.download.tld/vmlinuz'
+        requests = []
+
+        def origin(url, request):
+            requests.append(request.method)
+            if request.headers.get('If-None-Match') == '"v1"':
+                return {'status_code': 304}
+            return {'status_code': 200, 'content': 'x' * 1000,
+                    'headers': {'ETag': '"v1"'}}
+
+        config = self.server.handler_args['http']
+        config['memory_promote_hits'] = 1
+        config['max_age'] = 0
+        cache = self.backend.cache
+        with HTTMock(origin):
+            handle = self.backend.open_prefetch(url)
+            self.assertEqual(handle.read_block(0, 2000), 'x' * 1000)
+            handle.close()
+            self.assertEqual(requests, ['GET'])
+            entry = cache.peek(url)
+            last_access = entry.last_access
+
+            # Stale complete files are read without revalidation, and
+            # without counting as an access
+            handle = self.backend.open_prefetch(url)
+            self.assertEqual(handle.read_block(0, 2000), 'x' * 1000)
+            handle.close()
+            self.assertEqual(requests, ['GET'])
+            self.assertEqual(entry.hits, 0)
+            self.assertEqual(entry.last_access, last_access)
+            self.assertEqual((cache.hits, cache.misses), (0, 0))
+            self.assertNotIn(url, cache.memory)
+
+            # Client reads are revalidated and counted
+            self.backend.open(url).close()
+            self.assertEqual(requests, ['GET', 'GET'])
+            self.assertEqual(entry.hits, 1)
+            self.assertIn(url, cache.memory)
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+
+from httmock import HTTMock
+
+from dyntftpd.handlers.clever import CleverHandler
+from dyntftpd.preload import Preloader, read_manifest
+
+from . import TFTPServerTestCase
+
+
+def get_kernel(url, request):
+    return 'kernel'
+
+
+class TestPreloader(TFTPServerTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        super(TestPreloader, self).setUp(
+            handler=CleverHandler, handler_args={
+                'block_cache': {'size': 1024 * 1024, 'chunk_size': 512},
+                'http': {'cache_dir': self.cache_dir, 'max_age': 60},
+            })
+        os.mkdir(os.path.join(self.tftp_root, 'pxelinux.cfg'))
+        for name, content in (
+            ('pxelinux.0', 'A' * 1000),
+            ('pxelinux.cfg/default', 'default'),
+            ('pxelinux.cfg/C0A8', 'hex'),
+        ):
+            with open(os.path.join(self.tftp_root, name), 'w') as handle:
+                handle.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        super(TestPreloader, self).tearDown()
+
+    def test_read_manifest(self):
+        manifest = os.path.join(self.tftp_root, 'manifest')
+        with open(manifest, 'w') as handle:
+            handle.write('# comment\npxelinux.0\n\n  pxelinux.cfg/*\n')
+        self.assertEqual(
+            read_manifest(manifest), ['pxelinux.0', 'pxelinux.cfg/*']
+        )
+
+    def test_preload(self):
+        preloader = Preloader(self.server, [
+            'pxelinux.0', 'pxelinux.cfg/*', 'missing',
+            'http://www.download.tld/vmlinuz',
+        ], concurrency=2)
+        with HTTMock(get_kernel):
+            preloader.start()
+            self.assertTrue(preloader.wait(5))
+
+        self.assertEqual(preloader.status()['files'], 4)
+        self.assertEqual(preloader.bytes, 1000 + 7 + 3 + 6)
+        self.assertEqual(preloader.errors, 1)
+        self.assertEqual(self.server.block_cache.size, 1000 + 7 + 3)
+
+        # Served from cache, without HTTP request
+        self.get_file('http://www.download.tld/vmlinuz')
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01kernel')
+        self.ack_n(1)
+
+        misses = self.server.block_cache.misses
+        self.get_file('pxelinux.0')
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01' + 'A' * 512)
+        self.assertEqual(self.server.block_cache.misses, misses)
@@ -0,0 +1,159 @@
+import os
+import struct
+import threading
+import time
+import unittest
+
+from dyntftpd.backends.memory import MemoryBackend
+from dyntftpd.handlers.clever import CleverHandler
+from dyntftpd.readahead import ReadAheadPool
+
+from . import TFTPServerTestCase
+
+
+class SlowFile(object):
+    """ File of `size` bytes whose reads wait for `delay` seconds. """
+
+    def __init__(self, size, delay=0):
+        self.size = size
+        self.delay = delay
+        self.reads = []
+        self.lock = threading.Lock()
+
+    def read_block(self, offset, length):
+        time.sleep(self.delay)
+        with self.lock:
+            self.reads.append(offset)
+        length = max(min(length, self.size - offset), 0)
+        return chr(ord('A') + offset // 10 % 26) * length
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.001)
+    return predicate()
+
+
+class TestReadAhead(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ReadAheadPool(size=40, min_blocks=1, workers=2, stall=0.1)
+
+    def test_read_ahead(self):
+        handle = SlowFile(95)
+        readahead = self.pool.attach(handle.read_block, 10)
+
+        # The first block and the window are read before the client asks
+        self.assertTrue(wait_for(lambda: len(handle.reads) == 2))
+        self.assertEqual(readahead.read(0, 10), 'A' * 10)
+        self.assertEqual(self.pool.hits, 1)
+
+        # The window grows with each hit, up to 40 bytes
+        for offset in xrange(10, 100, 10):
+            self.assertTrue(wait_for(lambda: offset in readahead.blocks))
+            self.assertEqual(readahead.read(offset, 10),
+                             handle.read_block(offset, 10))
+            self.assertLessEqual(readahead.window, 4)
+            self.assertLessEqual(len(readahead.blocks), 5)
+        self.assertEqual(readahead.window, 4)
+        self.assertEqual(self.pool.misses, 0)
+        self.assertTrue(readahead.eof)
+
+    def test_miss(self):
+        handle = SlowFile(1000)
+        readahead = self.pool.attach(handle.read_block, 10)
+        self.assertTrue(wait_for(lambda: readahead.next_offset == 20))
+
+        # Out of sequence: read synchronously, and read ahead from there
+        self.assertEqual(readahead.read(500, 10), 'Y' * 10)
+        self.assertEqual(self.pool.misses, 1)
+        self.assertTrue(wait_for(lambda: 510 in readahead.blocks))
+        self.assertNotIn(0, readahead.blocks)
+
+    def test_retransmission(self):
+        handle = SlowFile(1000)
+        readahead = self.pool.attach(handle.read_block, 10)
+        self.assertTrue(wait_for(lambda: 10 in readahead.blocks))
+        readahead.read(0, 10)
+        readahead.read(0, 10)
+        self.assertEqual(self.pool.hits, 2)
+
+    def test_stall(self):
+        handle = SlowFile(1000)
+        readahead = self.pool.attach(handle.read_block, 10)
+        self.assertTrue(wait_for(lambda: readahead.next_offset == 20))
+
+        self.pool.sweep(time.time())
+        self.assertEqual(len(readahead.blocks), 2)
+
+        time.sleep(0.2)
+        self.pool.sweep(time.time())
+        self.assertEqual(readahead.blocks, {})
+
+        # Stalled transfers are not read ahead
+        readahead.schedule()
+        time.sleep(0.05)
+        self.assertEqual(readahead.blocks, {})
+
+        # Until the client is back
+        self.assertEqual(readahead.read(0, 10), 'A' * 10)
+        self.assertTrue(wait_for(lambda: 10 in readahead.blocks))
+
+    def test_cancel(self):
+        handle = SlowFile(1000, delay=0.05)
+        readahead = self.pool.attach(handle.read_block, 10)
+        self.assertTrue(wait_for(lambda: handle.reads))
+        readahead.cancel()
+        reads = len(handle.reads)
+        time.sleep(0.1)
+        self.assertEqual(len(handle.reads), reads)
+        self.assertEqual(readahead.blocks, {})
+
+    def test_read_error(self):
+        def read_block(offset, length):
+            if offset >= 10:
+                raise IOError(5, 'Input/output error')
+            return 'A' * length
+
+        readahead = self.pool.attach(read_block, 10)
+        self.assertTrue(wait_for(lambda: readahead.eof))
+        self.assertEqual(readahead.read(0, 10), 'A' * 10)
+        self.assertRaises(IOError, readahead.read, 10, 10)
+
+
+class TestReadAheadTransfer(TFTPServerTestCase):
+
+    def setUp(self):
+        super(TestReadAheadTransfer, self).setUp(
+            handler=CleverHandler, handler_args={'readahead': {'size': 2048}}
+        )
+        self.client_socket.settimeout(2)
+
+    def test_transfer(self):
+        content = ''.join(chr(ord('A') + i) * 512 for i in xrange(10)) + 'Z'
+        with open(os.path.join(self.tftp_root, 'test.txt'), 'w') as handle:
+            handle.write(content)
+
+        self.get_file('test.txt')
+        received = ''
+        for block_id in xrange(1, 12):
+            data, _ = self.recv()
+            self.assertEqual(data[:4], struct.pack('!HH', 3, block_id))
+            received += data[4:]
+            self.ack_n(block_id)
+        self.assertEqual(received, content)
+        self.assertGreater(self.server.readahead.hits, 0)
+
+        self.assertTrue(wait_for(lambda: not self.server.sessions))
+
+    def test_in_memory(self):
+        self.server.backends.register(
+            'memory', MemoryBackend({'mem.txt': 'hello'}), r'^mem'
+        )
+        self.get_file('mem.txt')
+        data, _ = self.recv()
+        self.assertEqual(data, '\x00\x03\x00\x01hello')
+        session = self.server.sessions.values()[0]
+        self.assertIsNone(session.readahead)
+        self.ack_n(1)
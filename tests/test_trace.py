@@ -0,0 +1,199 @@
+import argparse
+import os
+import struct
+import tempfile
+import threading
+import unittest
+
+from dyntftpd import TFTPServer
+from dyntftpd.handlers.clever import CleverHandler
+from dyntftpd.handlers.fs import FileSystemHandler
+from dyntftpd.replay import (
+    Replayer, arguments_parser, format_report, import_handler, percentiles
+)
+from dyntftpd.trace import TraceRecorder, encode, parse, read_trace
+
+from . import TFTPServerTestCase
+
+
+class TestTrace(unittest.TestCase):
+
+    def test_parse(self):
+        for data, expected in (
+            ('\x00\x01file\x00octet\x00', (1, ['file', 'octet', {}])),
+            ('\x00\x01file\x00octet\x00blksize\x001024\x00',
+             (1, ['file', 'octet', {'blksize': '1024'}])),
+            ('\x00\x01file\x00octet', (1, [])),
+            ('\x00\x04\x01\x02', (4, [258])),
+            ('\x00\x05\x00\x01oops\x00', (5, [1])),
+            ('\x00\x02file\x00octet\x00', (2, [])),
+            ('\x00', (None, [])),
+        ):
+            self.assertEqual(parse(data), expected)
+            if expected[1] or expected[0] == 2:
+                self.assertEqual(parse(encode(*expected)), expected)
+
+    def test_record(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            recorder = TraceRecorder(path)
+            recorder.record('\x00\x01caf\xe9\x00octet\x00tsize\x000\x00',
+                            ('10.0.0.1', 1234))
+            recorder.record('\x00\x04\x00\x01', ('10.0.0.1', 1234))
+            recorder.close()
+            recorder.record('\x00\x04\x00\x02', ('10.0.0.1', 1234))
+
+            records = read_trace(path)
+        finally:
+            os.unlink(path)
+
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0][1:], (
+            ('10.0.0.1', 1234), 1, ['caf\xe9', 'octet', {'tsize': '0'}]
+        ))
+        self.assertEqual(records[1][1:], (('10.0.0.1', 1234), 4, [1]))
+        self.assertLessEqual(records[0][0], records[1][0])
+
+    def test_append(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            old = TraceRecorder(path)
+            old.record('\x00\x04\x00\x01', ('10.0.0.1', 1234))
+            # Server reloaded: the old server completes its transfers
+            new = TraceRecorder(path)
+            new.record('\x00\x04\x00\x01', ('10.0.0.2', 1234))
+            new.close()
+            old.record('\x00\x04\x00\x02', ('10.0.0.1', 1234))
+            old.close()
+            records = read_trace(path)
+
+            # Segments are merged by time
+            with open(path, 'w') as trace:
+                trace.write('{"version": 1, "start": 100}\n'
+                            '[0.5,"10.0.0.1",1234,4,1]\n'
+                            '{"version": 1, "start": 102}\n'
+                            '[0.1,"10.0.0.2",1234,4,1]\n'
+                            '{"version": 1, "start": 100}\n'
+                            '[3,"10.0.0.1",1234,4,2]\n')
+            merged = read_trace(path)
+        finally:
+            os.unlink(path)
+
+        self.assertEqual(
+            sorted((record[1][0], record[3]) for record in records),
+            [('10.0.0.1', [1]), ('10.0.0.1', [2]), ('10.0.0.2', [1])]
+        )
+        self.assertEqual(
+            [(record[0], record[1][0]) for record in merged],
+            [(0.5, '10.0.0.1'), (2.1, '10.0.0.2'), (3, '10.0.0.1')]
+        )
+
+    def test_percentiles(self):
+        self.assertEqual(percentiles(range(1, 101)),
+                         {'p50': 51, 'p90': 91, 'p99': 100})
+        self.assertEqual(percentiles([]),
+                         {'p50': None, 'p90': None, 'p99': None})
+
+    def test_handler_option(self):
+        parser = arguments_parser()
+        self.assertIs(parser.parse_args(['trace']).handler, CleverHandler)
+        self.assertIs(
+            parser.parse_args([
+                'trace', '--handler', 'dyntftpd.handlers.fs.FileSystemHandler'
+            ]).handler,
+            FileSystemHandler
+        )
+        for path in ('dyntftpd.handlers.fs.Missing', 'missing.Handler',
+                     'Handler'):
+            self.assertRaises(argparse.ArgumentTypeError, import_handler, path)
+
+
+class TestReplay(TFTPServerTestCase):
+
+    def setUp(self):
+        handle, self.trace_path = tempfile.mkstemp()
+        os.close(handle)
+        super(TestReplay, self).setUp(
+            handler_args={'trace': {'path': self.trace_path}}
+        )
+        self.client_socket.settimeout(2)
+        with open(os.path.join(self.tftp_root, 'test.txt'), 'w') as handle:
+            handle.write('A' * 512 + 'B' * 100)
+
+    def tearDown(self):
+        super(TestReplay, self).tearDown()
+        os.unlink(self.trace_path)
+
+    def record_workload(self):
+        # Complete transfer, with a retransmitted ACK
+        self.get_file('test.txt')
+        self.recv()
+        self.ack_n(0)
+        self.recv()
+        self.ack_n(1)
+        self.recv()
+        self.ack_n(2)
+
+        # Missing file
+        self.get_file('missing')
+        self.recv()
+
+        # Abandoned transfer with options
+        self.get_file('test.txt', options={'blksize': '100'})
+        self.recv()
+        self.ack_n(0)
+        self.recv()
+
+        self.server.trace.close()
+
+    def replay(self, **kwargs):
+        server = TFTPServer(host='127.0.0.1', port=0, root=self.tftp_root)
+        server.timeout = 0.001
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            return Replayer(
+                read_trace(self.trace_path), server.socket.getsockname(),
+                **kwargs
+            ).run()
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+
+    def test_replay(self):
+        self.record_workload()
+        records = read_trace(self.trace_path)
+        self.assertEqual([record[2] for record in records],
+                         [1, 4, 4, 4, 1, 1, 4])
+
+        report = self.replay(timeout=0.5)
+        self.assertEqual(report['requests'], 3)
+        self.assertEqual(report['completed'], 1)
+        self.assertEqual(report['bytes'], 512 + 100 + 100)
+        self.assertEqual(report['errors'], {1: 1})
+        self.assertEqual(report['timeouts'], 0)
+        self.assertIsNotNone(report['first_latency']['p50'])
+        self.assertIsNotNone(report['block_latency']['p99'])
+        self.assertIn('3 requests, 1 transfers completed',
+                      format_report(report))
+
+    def test_replay_fast(self):
+        self.record_workload()
+        report = self.replay(speed=0, timeout=0.5)
+        self.assertEqual(report['completed'], 1)
+        self.assertEqual(report['errors'], {1: 1})
+
+    def test_timeout(self):
+        self.record_workload()
+        # Nobody listens to this address
+        sock = __import__('socket').socket(2, 2)
+        sock.bind(('127.0.0.1', 0))
+        address = sock.getsockname()
+        sock.close()
+        report = Replayer(read_trace(self.trace_path), address,
+                          speed=0, timeout=0.1).run()
+        self.assertEqual(report['completed'], 0)
+        self.assertEqual(report['timeouts'], 3)